@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""HTTP load test for the registro.py API.
+
+Seeds a temporary copy of f1_app.db with N users and M bets, starts
+registro.py on a free port in a subprocess and drives a weighted mix of
+requests, either with a fixed number of concurrent clients (closed loop)
+or at a fixed arrival rate (open loop; latency is measured from the
+scheduled send time so a stalled server can't hide its queueing).
+
+Run with: py -3 bench_carga.py --users 200 --bets 2000 --concurrency 16 --duration 20
+      or: py -3 bench_carga.py --rate 300 --duration 20 --output runs/rate300.json
+Compare:  py -3 bench_carga.py --compare runs/old.json runs/new.json
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import createDB  # noqa: E402
+import db  # noqa: E402
+import registro  # noqa: E402
+from sesiones import SessionManager  # noqa: E402
+
+DEFAULT_MIX = 'login=10,register=2,pilotos=20,create_bet=10,list=25,status=8,detail=10,static=15'
+BENCH_PASSWORD = 'Bench1234'
+# the server signs with this key so the bench can mint tokens itself
+# instead of paying a PBKDF2 login before every authenticated request
+BENCH_SESSION_SECRET = 'bench-session-secret'
+PERCENTILES = (50, 99, 99.9)
+
+
+# ---- seeding ----
+def seed_database(src, dst, users, bets, rng):
+    """Copia las bases (app + referencia) y agrega usuarios/apuestas.
+
+    Devuelve {'users': {id: email}, 'bets': {user_id: [bet_ids]}, 'drivers': [ids]}.
+    """
+    shutil.copyfile(src, dst)
+    src_ref = os.path.join(os.path.dirname(os.path.abspath(src)), 'f1_ref.db')
+    dst_ref = os.path.join(os.path.dirname(dst), 'f1_ref.db')
+    if os.path.exists(src_ref):
+        shutil.copyfile(src_ref, dst_ref)
+    else:
+        createDB.ensure_reference_db(dst, dst_ref)
+    conn = db.connect_app(dst, dst_ref)
+    try:
+        registro.ensure_usuarios_table(conn)
+        registro.ensure_apuestas_table(conn)
+        cur = conn.cursor()
+        # one hash for everybody: seeding 10k users shouldn't take 10k PBKDF2 runs
+        pwd_hash = registro.hash_password(BENCH_PASSWORD)
+        cur.executemany(
+            'INSERT INTO usuarios (nombre, apellido, email, contrasena, fecha_nacimiento) VALUES (?, ?, ?, ?, ?)',
+            ((f'Bench{i}', 'User', f'bench{i}@example.com', pwd_hash, '1990-01-01') for i in range(users)),
+        )
+        cur.execute("SELECT id, email FROM usuarios WHERE email LIKE 'bench%@example.com'")
+        user_ids = {row[0]: row[1] for row in cur.fetchall()}
+        drivers = [row[0] for row in cur.execute('SELECT id FROM ref.drivers')]
+        if len(drivers) < 3:
+            raise SystemExit('La base no tiene pilotos: corré createDB.py primero')
+        ids = list(user_ids)
+        rows = []
+        for _ in range(bets):
+            top = rng.sample(drivers, 3)
+            rows.append((rng.choice(ids), top[0], top[1], top[2], rng.choice(('pendiente', 'activa', 'rechazada'))))
+        cur.executemany('''
+            INSERT INTO apuestas_top3 (user_id, top1_driver_id, top2_driver_id, top3_driver_id, status)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        bets_by_user = {uid: [] for uid in ids}
+        for bet_id, uid in cur.execute('SELECT id, user_id FROM apuestas_top3'):
+            if uid in bets_by_user:
+                bets_by_user[uid].append(bet_id)
+        return {'users': user_ids, 'bets': bets_by_user, 'drivers': drivers}
+    finally:
+        conn.close()
+
+
+# ---- server ----
+def start_server(db_path, env_extra=None):
+    env = dict(os.environ, F1_PORT='0', F1_DB_PATH=db_path, F1_HOST='127.0.0.1',
+               F1_SESSION_SECRET=BENCH_SESSION_SECRET,
+               # every simulated user comes from 127.0.0.1
+               F1_RATE_LIMIT='0')
+    env.update(env_extra or {})
+    proc = subprocess.Popen(
+        [sys.executable, '-u', os.path.join(BASE_DIR, 'registro.py')],
+        cwd=BASE_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    deadline = time.monotonic() + 30
+    for line in proc.stdout:
+        if line.startswith('Serving at http://'):
+            port = int(line.split()[2].rsplit(':', 1)[1])
+            # keep draining stdout so the server never blocks on a full pipe
+            threading.Thread(target=lambda: [None for _ in proc.stdout], daemon=True).start()
+            return proc, port
+        if time.monotonic() > deadline:
+            break
+    proc.kill()
+    raise SystemExit('El servidor no arrancó')
+
+
+# ---- workload ----
+class Workload:
+    def __init__(self, port, seed, rng):
+        self.port = port
+        self.seed = seed
+        self.rng = rng
+        self.user_ids = list(seed['users'])
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._sessions = SessionManager(BENCH_SESSION_SECRET.encode('utf-8'))
+        self._tokens = {}
+
+    def _token(self, uid):
+        with self._lock:
+            token = self._tokens.get(uid)
+            if token is None:
+                token = self._tokens[uid] = self._sessions.issue(uid)
+            return token
+
+    def _request(self, method, path, body=None, uid=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            headers = {}
+            if uid is not None:
+                headers['Authorization'] = f'Bearer {self._token(uid)}'
+            payload = None
+            if body is not None:
+                payload = json.dumps(body).encode('utf-8')
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body=payload, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+            return resp.status, data
+        finally:
+            conn.close()
+
+    def _user(self):
+        with self._lock:
+            return self.rng.choice(self.user_ids)
+
+    def _bet_of(self, uid):
+        with self._lock:
+            bets = self.seed['bets'].get(uid)
+            return self.rng.choice(bets) if bets else None
+
+    def op_login(self):
+        uid = self._user()
+        status, data = self._request('POST', '/login', {'email': self.seed['users'][uid], 'password': BENCH_PASSWORD})
+        if status == 200:
+            try:
+                token = json.loads(data)['token']
+                with self._lock:
+                    self._tokens[uid] = token
+            except (ValueError, KeyError, TypeError):
+                pass
+        return status, data
+
+    def op_register(self):
+        n = next(self._counter)
+        return self._request('POST', '/register', {
+            'nombre': 'Load', 'apellido': 'Test', 'email': f'load{os.getpid()}_{n}_{time.time_ns()}@example.com',
+            'password': BENCH_PASSWORD, 'fecha_nacimiento': '1990-01-01',
+        })
+
+    def op_pilotos(self):
+        return self._request('GET', '/api/pilotos')
+
+    def op_create_bet(self):
+        uid = self._user()
+        with self._lock:
+            top = self.rng.sample(self.seed['drivers'], 3)
+        status, data = self._request('POST', '/apuestas/top3',
+                                     {'top1': top[0], 'top2': top[1], 'top3': top[2]}, uid=uid)
+        if status == 200:
+            try:
+                bet_id = json.loads(data)['bet']['id']
+                with self._lock:
+                    self.seed['bets'].setdefault(uid, []).append(bet_id)
+            except (ValueError, KeyError, TypeError):
+                pass
+        return status, data
+
+    def op_list(self):
+        return self._request('GET', '/apuestas/top3', uid=self._user())
+
+    def op_status(self):
+        uid = self._user()
+        bet_id = self._bet_of(uid)
+        if bet_id is None:
+            return self.op_list()
+        with self._lock:
+            status = self.rng.choice(('pendiente', 'activa', 'rechazada'))
+        return self._request('POST', '/apuestas/top3/status', {'bet_id': bet_id, 'status': status}, uid=uid)
+
+    def op_detail(self):
+        uid = self._user()
+        bet_id = self._bet_of(uid)
+        if bet_id is None:
+            return self.op_list()
+        return self._request('GET', f'/apuestas/top3/detalle?bet_id={bet_id}', uid=uid)
+
+    def op_static(self):
+        with self._lock:
+            page = self.rng.choice(('/index.html', '/apuestas.html', '/css/style.css', '/js/apuestas.js'))
+        return self._request('GET', page)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if not hasattr(Workload, f'op_{name}'):
+            raise SystemExit(f'Operación desconocida en --mix: {name}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.throttled = {}
+
+    def add(self, route, seconds, outcome):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if outcome == 'throttled':
+                self.throttled[route] = self.throttled.get(route, 0) + 1
+            elif outcome != 'ok':
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def run_op(workload, name, recorder, scheduled=None):
+    start = time.perf_counter()
+    try:
+        status, _ = getattr(workload, f'op_{name}')()
+        if status == 429:
+            outcome = 'throttled'
+        else:
+            outcome = 'ok' if 200 <= status < 400 else 'error'
+    except (OSError, http.client.HTTPException):
+        outcome = 'error'
+    end = time.perf_counter()
+    recorder.add(name, end - (scheduled if scheduled is not None else start), outcome)
+
+
+def closed_loop(workload, mix, concurrency, duration, recorder, rng):
+    names, weights = list(mix), list(mix.values())
+    stop_at = time.perf_counter() + duration
+
+    def client(seed):
+        local = random.Random(seed)
+        while time.perf_counter() < stop_at:
+            run_op(workload, local.choices(names, weights)[0], recorder)
+
+    threads = [threading.Thread(target=client, args=(rng.random(),)) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def open_loop(workload, mix, rate, duration, recorder, rng, max_workers):
+    names, weights = list(mix), list(mix.values())
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    total = int(rate * duration)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run_op, workload, rng.choices(names, weights)[0], recorder, scheduled)
+
+
+def percentile(sorted_values, p):
+    # nearest-rank
+    k = max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    total = errors = throttled = 0
+    for name, values in sorted(recorder.latencies.items()):
+        values.sort()
+        errs = recorder.errors.get(name, 0)
+        limited = recorder.throttled.get(name, 0)
+        total += len(values)
+        errors += errs
+        throttled += limited
+        routes[name] = {
+            'count': len(values),
+            'errors': errs,
+            'throttled': limited,
+            'throughput': round(len(values) / elapsed, 2),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3),
+        }
+        for p in PERCENTILES:
+            routes[name][f'p{p:g}_ms'.replace('.', '')] = round(percentile(values, p) * 1000, 3)
+    return {'requests': total, 'errors': errors, 'throttled': throttled, 'throughput': round(total / elapsed, 2), 'elapsed': round(elapsed, 3)}, routes
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(result):
+    totals = result['totals']
+    print(f"\n{totals['requests']} requests in {totals['elapsed']}s -> {totals['throughput']} req/s, "
+          f"{totals['errors']} errors, {totals['throttled']} throttled (429)")
+    print(f"{'route':<12}{'count':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'errors':>8}"
+          f"{'429':>8}")
+    for name, r in result['routes'].items():
+        print(f"{name:<12}{r['count']:>8}{r['throughput']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+              f"{r['p999_ms']:>10}{r['errors']:>8}{r['throttled']:>8}")
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('label') or old_path} -> {new['meta'].get('label') or new_path}")
+    print(f"{'route':<12} {'req/s':<26} {'p50 ms':<26} {'p99 ms':<26}")
+    for name in sorted(set(old['routes']) | set(new['routes'])):
+        a, b = old['routes'].get(name), new['routes'].get(name)
+        if not a or not b:
+            print(f"{name:<12} (only in {'new' if b else 'old'})")
+            continue
+        cells = []
+        for key in ('throughput', 'p50_ms', 'p99_ms'):
+            delta = (b[key] - a[key]) / a[key] * 100 if a[key] else 0.0
+            cells.append(f"{a[key]}->{b[key]} ({delta:+.0f}%)")
+        print(f"{name:<12} {cells[0]:<26} {cells[1]:<26} {cells[2]:<26}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--bets', type=int, default=2000)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='op=peso,... (%(default)s)')
+    parser.add_argument('--concurrency', type=int, default=16, help='clientes en lazo cerrado')
+    parser.add_argument('--rate', type=float, help='req/s en lazo abierto (ignora --concurrency)')
+    parser.add_argument('--max-workers', type=int, default=256, help='hilos cliente en lazo abierto')
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--db', default=os.path.join(BASE_DIR, 'f1_app.db'), help='base a copiar')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='variables para el servidor (p.ej. F1_SERVER_MODE=pool)')
+    parser.add_argument('--label', help='nombre de la corrida')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='archivo JSON de resultados')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compara dos resultados')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    server_env = dict(kv.split('=', 1) for kv in args.env)
+    tmp = tempfile.mkdtemp(prefix='f1bench-')
+    proc = None
+    try:
+        db_path = os.path.join(tmp, 'f1_app.db')
+        print(f"Seeding {args.users} users / {args.bets} bets in {tmp}")
+        seed = seed_database(args.db, db_path, args.users, args.bets, rng)
+        proc, port = start_server(db_path, server_env)
+        print(f"Server on port {port}")
+        workload = Workload(port, seed, rng)
+
+        if args.warmup > 0:
+            closed_loop(workload, mix, min(4, args.concurrency), args.warmup, Recorder(), rng)
+        recorder = Recorder()
+        t0 = time.perf_counter()
+        if args.rate:
+            open_loop(workload, mix, args.rate, args.duration, recorder, rng, args.max_workers)
+        else:
+            closed_loop(workload, mix, args.concurrency, args.duration, recorder, rng)
+        elapsed = time.perf_counter() - t0
+        totals, routes = summarize(recorder, elapsed)
+        result = {
+            'meta': {
+                'label': args.label,
+                'commit': git_commit(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'mode': 'open' if args.rate else 'closed',
+                'rate': args.rate,
+                'concurrency': None if args.rate else args.concurrency,
+                'duration': args.duration,
+                'users': args.users,
+                'bets': args.bets,
+                'mix': mix,
+                'server_env': server_env,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+            },
+            'totals': totals,
+            'routes': routes,
+        }
+        print_report(result)
+        if args.output:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2)
+            print(f"Results saved to {args.output}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Benchmark de los importadores de createDB.py sobre datos sintéticos.
+
+Generates CSVs with generar_datos.py, then times every ``import_*``
+function twice in a fresh subprocess: cold (empty DB, insert path) and
+warm (same CSV again, update path, file cache hot). Reports rows/sec, DB
+size and peak RSS. With ``--baseline`` it exits non-zero when any
+rows/sec drops more than ``--threshold`` below the saved numbers.
+
+Run with: py -3 bench_import.py --race-rows 1000000 --save-baseline bench_import_baseline.json
+    then: py -3 bench_import.py --race-rows 1000000 --baseline bench_import_baseline.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import createDB  # noqa: E402
+import generar_datos  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# name -> (table setup, importer, generated CSV)
+CASES = {
+    'import_from_csv': ('create_table_drivers', 'import_from_csv', 'pilotos.csv'),
+    'import_from_csv[variante]': ('create_table_drivers', 'import_from_csv', 'pilotos_variante.csv'),
+    'import_constructors_from_csv': ('create_constructors_table', 'import_constructors_from_csv', 'constructores.csv'),
+    'import_results_from_csv': ('create_results_table', 'import_results_from_csv', 'ganadores.csv'),
+    'import_results_from_csv[seson]': ('create_results_table', 'import_results_from_csv', 'ganadores_seson.csv'),
+    'import_race_results_from_csv': ('create_race_results_detailed_table', 'import_race_results_from_csv',
+                                     'race_results_allseasons.csv'),
+    'import_race_results_from_csv[2025]': ('create_race_results_detailed_table', 'import_race_results_from_csv',
+                                           'race_results_season.csv'),
+}
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_case(case, csv_path, db_path):
+    """Corre en un proceso nuevo: import en frío y luego en caliente."""
+    setup_name, importer_name, _ = CASES[case]
+    conn = createDB.create_connection(db_path)
+    getattr(createDB, setup_name)(conn)
+    importer = getattr(createDB, importer_name)
+    out = {}
+    for phase in ('cold', 'warm'):
+        t0 = time.perf_counter()
+        inserted, updated = importer(conn, csv_path)
+        seconds = time.perf_counter() - t0
+        rows = inserted + updated
+        out[phase] = {
+            'seconds': round(seconds, 4),
+            'rows': rows,
+            'inserted': inserted,
+            'updated': updated,
+            'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'db_bytes': os.path.getsize(db_path),
+        }
+    conn.close()
+    return out
+
+
+def run_isolated(case, csv_path, tmp):
+    db_path = os.path.join(tmp, f"{case.replace('[', '_').replace(']', '')}.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', case, csv_path, db_path],
+        capture_output=True, text=True, cwd=tmp,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"{case} falló:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def check_regressions(results, baseline, threshold):
+    failures = []
+    for case, phases in results.items():
+        for phase, r in phases.items():
+            old = baseline.get('results', {}).get(case, {}).get(phase, {}).get('rows_per_sec')
+            new = r['rows_per_sec']
+            if old and new is not None and new < old * (1 - threshold):
+                failures.append(f"{case} [{phase}]: {new} rows/s < {old} rows/s (-{(1 - new / old) * 100:.0f}%)")
+    return failures
+
+
+def fmt_bytes(n):
+    if n is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return f"{n:.0f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de importadores de createDB.py')
+    parser.add_argument('--race-rows', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', action='append', help='correr solo estos casos')
+    parser.add_argument('--baseline', help='JSON de una corrida anterior para comparar')
+    parser.add_argument('--threshold', type=float, default=0.2, help='caída de rows/s tolerada (0.2 = 20%%)')
+    parser.add_argument('--save-baseline', metavar='PATH', help='guardar resultados como JSON')
+    parser.add_argument('--keep', action='store_true', help='no borrar el directorio temporal')
+    parser.add_argument('--worker', nargs=3, metavar=('CASE', 'CSV', 'DB'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        case, csv_path, db_path = args.worker
+        # importers print progress/warnings; keep stdout for the JSON line
+        sys.stdout, real_stdout = sys.stderr, sys.stdout
+        result = run_case(case, csv_path, db_path)
+        sys.stdout = real_stdout
+        print(json.dumps(result))
+        return
+
+    tmp = tempfile.mkdtemp(prefix='f1import-')
+    try:
+        t0 = time.perf_counter()
+        files = generar_datos.generate(os.path.join(tmp, 'csv'), args.race_rows, args.seed)
+        print(f"Generated CSVs ({args.race_rows} race rows) in {time.perf_counter() - t0:.1f}s")
+        results = {}
+        print(f"{'case':<38}{'phase':<6}{'rows':>10}{'sec':>9}{'rows/s':>11}{'db':>9}{'peak rss':>10}")
+        for case, (_, _, csv_name) in CASES.items():
+            if args.only and case not in args.only:
+                continue
+            results[case] = run_isolated(case, files[csv_name][0], tmp)
+            for phase, r in results[case].items():
+                print(f"{case:<38}{phase:<6}{r['rows']:>10}{r['seconds']:>9}{r['rows_per_sec']:>11}"
+                      f"{fmt_bytes(r['db_bytes']):>9}{fmt_bytes(r['peak_rss_bytes']):>10}")
+
+        report = {'race_rows': args.race_rows, 'seed': args.seed, 'results': results}
+        if args.save_baseline:
+            with open(args.save_baseline, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved {args.save_baseline}")
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+            if baseline.get('race_rows') != args.race_rows:
+                print(f"Warning: baseline used {baseline.get('race_rows')} race rows")
+            failures = check_regressions(results, baseline, args.threshold)
+            if failures:
+                print('REGRESSION:')
+                for line in failures:
+                    print(f"  {line}")
+                sys.exit(1)
+            print(f"No regressions beyond {args.threshold * 100:.0f}%")
+    finally:
+        if args.keep:
+            print(f"Kept {tmp}")
+        else:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
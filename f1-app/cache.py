@@ -0,0 +1,160 @@
+"""Byte-bounded LRU caches for encoded bet responses.
+
+``BET_CACHE.lists`` keeps the encoded ``GET /apuestas/top3`` response per
+user and ``BET_CACHE.details`` the encoded bet per bet id (with its owner,
+so the handler can still check it). Both store the exact bytes sent to the
+client, so a hit costs no SQL and no JSON encoding.
+
+Invalidation rides on the event hub: every committed create/status/delete
+is published, and ``on_event`` drops the user's list and the bet's detail
+before the write handler answers. The hub payload is not written through:
+two updates of the same bet may publish in a different order than they
+committed. A reader that started its query before such a write can't
+store stale bytes afterwards: it takes a ``ticket()`` before querying and
+``put()`` is refused if the key was invalidated in between.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# dict/tuple/bytes bookkeeping per entry, roughly
+ENTRY_OVERHEAD = 120
+
+
+class ByteLRU:
+    def __init__(self, max_bytes, name=''):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.rejected = 0
+        # per-key invalidation counters for put() tickets; when it grows too
+        # big it is cleared and the epoch bump voids every open ticket
+        self._versions = {}
+        self._epoch = 0
+
+    @staticmethod
+    def _size(value):
+        return len(value[-1] if isinstance(value, tuple) else value) + ENTRY_OVERHEAD
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def ticket(self, key):
+        """Tomar antes de consultar la base; ``put`` lo valida."""
+        with self._lock:
+            return (self._epoch, self._versions.get(key, 0))
+
+    def put(self, key, value, ticket=None):
+        size = self._size(value)
+        with self._lock:
+            if ticket is not None and ticket != (self._epoch, self._versions.get(key, 0)):
+                # invalidated while the caller was reading the database
+                self.rejected += 1
+                return False
+            if size > self.max_bytes:
+                return False
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= self._size(old)
+            self._data[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.bytes -= self._size(evicted)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= self._size(old)
+            self.invalidations += 1
+            self._versions[key] = self._versions.get(key, 0) + 1
+            if len(self._versions) > max(1024, 4 * len(self._data)):
+                self._versions = {}
+                self._epoch += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+            self._versions = {}
+            self._epoch += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'rejected': self.rejected,
+            }
+
+
+def encode(obj):
+    return json.dumps(obj).encode('utf-8')
+
+
+class BetCache:
+    def __init__(self, list_bytes=4 << 20, detail_bytes=2 << 20):
+        self.lists = ByteLRU(list_bytes, 'list')
+        self.details = ByteLRU(detail_bytes, 'detail')
+
+    def on_event(self, event_id, event, user_id, bet):
+        """Listener para ``EventHub.add_listener``."""
+        if not bet or 'id' not in bet:
+            return
+        self.lists.invalidate(user_id)
+        self.details.invalidate(int(bet['id']))
+
+    def clear(self, *_):
+        """Driver names may change with a new reference generation."""
+        self.lists.clear()
+        self.details.clear()
+
+    def metrics(self):
+        rows = {'hits': [], 'misses': [], 'evictions': [], 'invalidations': [],
+                'bytes': [], 'entries': [], 'max_bytes': []}
+        for cache in (self.lists, self.details):
+            st = cache.stats()
+            for field, samples in rows.items():
+                samples.append(({'cache': cache.name}, st[field]))
+        return [
+            ('f1_bet_cache_hits_total', 'counter', 'Bet cache hits.', rows['hits']),
+            ('f1_bet_cache_misses_total', 'counter', 'Bet cache misses.', rows['misses']),
+            ('f1_bet_cache_evictions_total', 'counter', 'Entries evicted to stay under the byte limit.',
+             rows['evictions']),
+            ('f1_bet_cache_invalidations_total', 'counter', 'Entries invalidated by writes.',
+             rows['invalidations']),
+            ('f1_bet_cache_bytes', 'gauge', 'Approximate bytes held.', rows['bytes']),
+            ('f1_bet_cache_max_bytes', 'gauge', 'Byte limit.', rows['max_bytes']),
+            ('f1_bet_cache_entries', 'gauge', 'Cached entries.', rows['entries']),
+        ]
+
+
+BET_CACHE = BetCache(
+    list_bytes=int(os.environ.get('F1_BET_LIST_CACHE_BYTES', 4 << 20)),
+    detail_bytes=int(os.environ.get('F1_BET_DETAIL_CACHE_BYTES', 2 << 20)),
+)
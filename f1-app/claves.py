@@ -0,0 +1,363 @@
+"""Password hashing with a calibrated, self-describing policy.
+
+Every stored hash names its algorithm and parameters::
+
+    pbkdf2_sha256$<iterations>$<salt hex>$<key hex>
+    scrypt$<n>$<r>$<p>$<salt hex>$<key hex>
+
+so the policy can change at any time: old hashes still verify with their
+own parameters, and ``needs_rehash()`` tells which ones are behind. The
+login handler hands those to ``REHASHER``, whose thread re-hashes them
+with the current policy after the response has gone out.
+
+The policy comes from a JSON file written by ``python claves.py
+calibrate``, which times the KDF on this host and picks the parameters
+that fit a latency target (e.g. 250 ms per login). Without a file the
+policy is PBKDF2-SHA256 with 100,000 iterations, what every existing hash
+uses.
+
+At most ``max_concurrent`` derivations run at once; further logins wait
+for a slot instead of piling up on the CPU. Time spent deriving and
+waiting is exported per algorithm and operation, next to the target.
+"""
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+PBKDF2 = 'pbkdf2_sha256'
+SCRYPT = 'scrypt'
+SCHEMES = (PBKDF2, SCRYPT) if hasattr(hashlib, 'scrypt') else (PBKDF2,)
+DEFAULT_POLICY = {'scheme': PBKDF2, 'iterations': 100_000}
+SALT_BYTES = 16
+KEY_BYTES = 32
+# scrypt: keep the per-login memory bounded whatever the calibration says
+SCRYPT_MAX_MEMORY = 64 << 20
+SCRYPT_R, SCRYPT_P = 8, 1
+
+
+def _scrypt_maxmem(n, r, p):
+    # what OpenSSL checks against maxmem: the V array plus the B blocks
+    return 128 * r * (n + p + 2) + (1 << 16)
+
+
+def _derive(scheme, params, password, salt):
+    data = password.encode('utf-8')
+    if scheme == PBKDF2:
+        return hashlib.pbkdf2_hmac('sha256', data, salt, params['iterations'], KEY_BYTES)
+    n, r, p = params['n'], params['r'], params['p']
+    return hashlib.scrypt(data, salt=salt, n=n, r=r, p=p, maxmem=_scrypt_maxmem(n, r, p), dklen=KEY_BYTES)
+
+
+def parse(stored):
+    """``(scheme, params, salt, key)``; ValueError si el formato no es válido."""
+    parts = stored.split('$')
+    if parts[0] == PBKDF2 and len(parts) == 4:
+        params = {'iterations': int(parts[1])}
+    elif parts[0] == SCRYPT and len(parts) == 6:
+        params = {'n': int(parts[1]), 'r': int(parts[2]), 'p': int(parts[3])}
+    else:
+        raise ValueError('unknown password hash format')
+    return parts[0], params, binascii.unhexlify(parts[-2]), binascii.unhexlify(parts[-1])
+
+
+def encode(scheme, params, salt, key):
+    if scheme == PBKDF2:
+        fields = [params['iterations']]
+    else:
+        fields = [params['n'], params['r'], params['p']]
+    return '$'.join([scheme, *map(str, fields), salt.hex(), key.hex()])
+
+
+def check_policy(policy):
+    """Valida y normaliza una política (dict) leída de un archivo o del entorno.
+
+    Anything malformed raises ValueError (or KeyError for a missing field).
+    """
+    if not isinstance(policy, dict):
+        raise ValueError(f"password policy must be a JSON object, not {type(policy).__name__}")
+    scheme = policy.get('scheme', PBKDF2)
+    if scheme not in SCHEMES:
+        raise ValueError(f"unsupported password scheme: {scheme}")
+    try:
+        if scheme == PBKDF2:
+            params = {'iterations': int(policy['iterations'])}
+        else:
+            params = {'n': int(policy['n']), 'r': int(policy.get('r', SCRYPT_R)),
+                      'p': int(policy.get('p', SCRYPT_P))}
+    except TypeError as e:
+        # e.g. "iterations": [1]
+        raise ValueError(f"bad password policy value: {e}")
+    if scheme == PBKDF2:
+        if params['iterations'] < 10_000:
+            raise ValueError('pbkdf2 needs at least 10000 iterations')
+    else:
+        if params['n'] < 2 or params['n'] & (params['n'] - 1):
+            raise ValueError('scrypt n must be a power of two')
+    return dict(params, scheme=scheme, target_ms=policy.get('target_ms'))
+
+
+def load_policy(path):
+    """Política del archivo de calibración, o la por defecto si no existe."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return check_policy(json.load(f))
+    except FileNotFoundError:
+        return check_policy(DEFAULT_POLICY)
+
+
+class PasswordHasher:
+    def __init__(self, policy=None, max_concurrent=None):
+        self.configure(policy or DEFAULT_POLICY)
+        self._slots = threading.BoundedSemaphore(max_concurrent or os.cpu_count() or 1)
+        self._lock = threading.Lock()
+        # (scheme, op) -> [count, derive seconds, wait seconds]
+        self._stats = {}
+        self.rejected = 0
+
+    def configure(self, policy):
+        policy = check_policy(policy)
+        self.scheme = policy.pop('scheme')
+        self.target_ms = policy.pop('target_ms')
+        self.params = policy
+
+    def _timed_derive(self, op, scheme, params, password, salt):
+        t0 = time.perf_counter()
+        with self._slots:
+            t1 = time.perf_counter()
+            key = _derive(scheme, params, password, salt)
+        t2 = time.perf_counter()
+        with self._lock:
+            entry = self._stats.setdefault((scheme, op), [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += t2 - t1
+            entry[2] += t1 - t0
+        return key
+
+    def hash(self, password, op='hash'):
+        salt = os.urandom(SALT_BYTES)
+        scheme, params = self.scheme, self.params
+        return encode(scheme, params, salt, self._timed_derive(op, scheme, params, password, salt))
+
+    def verify(self, stored, password):
+        try:
+            scheme, params, salt, key = parse(stored)
+            if scheme not in SCHEMES:
+                raise ValueError(f"unsupported password scheme: {scheme}")
+        except (ValueError, binascii.Error):
+            with self._lock:
+                self.rejected += 1
+            return False
+        derived = self._timed_derive('verify', scheme, params, password, salt)
+        return hmac.compare_digest(derived, key)
+
+    def needs_rehash(self, stored):
+        """True si el hash no usa exactamente la política actual."""
+        try:
+            scheme, params, _, _ = parse(stored)
+        except (ValueError, binascii.Error):
+            return False
+        return scheme != self.scheme or params != self.params
+
+    def metrics(self):
+        """Samples in the format of ``METRICS.add_collector``."""
+        with self._lock:
+            stats = sorted(self._stats.items())
+            rejected = self.rejected
+        count, seconds, waited = [], [], []
+        for (scheme, op), (n, derive, wait) in stats:
+            labels = {'scheme': scheme, 'op': op}
+            count.append((labels, n))
+            seconds.append((labels, derive))
+            waited.append((labels, wait))
+        policy = [({'scheme': self.scheme, **{k: str(v) for k, v in self.params.items()}}, 1)]
+        samples = [
+            ('f1_kdf_operations_total', 'counter', 'Password key derivations, by scheme and operation.', count),
+            ('f1_kdf_seconds_total', 'counter', 'Time spent in key derivations.', seconds),
+            ('f1_kdf_wait_seconds_total', 'counter', 'Time spent waiting for a derivation slot.', waited),
+            ('f1_kdf_rejected_total', 'counter', 'Stored hashes in an unknown format.', [({}, rejected)]),
+            ('f1_kdf_policy_info', 'gauge', 'Current hashing policy.', policy),
+        ]
+        if self.target_ms:
+            samples.append(('f1_kdf_target_seconds', 'gauge', 'Calibrated time budget per derivation.',
+                            [({}, self.target_ms / 1000)]))
+        return samples
+
+
+class Rehasher:
+    """Re-hashes outdated passwords on its own thread, after the login response.
+
+    ``store(user_id, old_hash, new_hash)`` must only replace ``old_hash``
+    (a password changed meanwhile wins) and return whether it did. The
+    queue is bounded: when it is full the upgrade waits for a later login.
+    """
+
+    def __init__(self, hasher, maxsize=256):
+        self.hasher = hasher
+        self.store = None
+        self._queue = queue.Queue(maxsize)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.outcomes = {'upgraded': 0, 'stale': 0, 'dropped': 0, 'error': 0}
+
+    def start(self, store):
+        self.store = store
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='f1-rehash', daemon=True)
+            self._thread.start()
+
+    def submit(self, user_id, old_hash, password):
+        if self._thread is None:
+            return False
+        with self._lock:
+            if user_id in self._pending:
+                return False
+            self._pending.add(user_id)
+        try:
+            self._queue.put_nowait((user_id, old_hash, password))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(user_id)
+                self.outcomes['dropped'] += 1
+            return False
+
+    def _loop(self):
+        while True:
+            user_id, old_hash, password = self._queue.get()
+            try:
+                new_hash = self.hasher.hash(password, op='rehash')
+                outcome = 'upgraded' if self.store(user_id, old_hash, new_hash) else 'stale'
+            except Exception as e:
+                outcome = 'error'
+                print(f"Password rehash failed for user {user_id}: {e}")
+            with self._lock:
+                self._pending.discard(user_id)
+                self.outcomes[outcome] += 1
+
+    def join(self, timeout=5.0):
+        """Espera a que la cola se vacíe (herramientas y pruebas)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._pending:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def metrics(self):
+        with self._lock:
+            outcomes = sorted(self.outcomes.items())
+        return [
+            ('f1_password_rehash_total', 'counter', 'Outdated hashes re-hashed after login, by outcome.',
+             [({'outcome': k}, v) for k, v in outcomes]),
+            ('f1_password_rehash_queue', 'gauge', 'Re-hashes waiting for the worker.',
+             [({}, self._queue.qsize())]),
+        ]
+
+
+# ---- calibration ----
+def _time_once(scheme, params):
+    salt = os.urandom(SALT_BYTES)
+    t0 = time.perf_counter()
+    _derive(scheme, params, 'calibration-Password1', salt)
+    return time.perf_counter() - t0
+
+
+def measure(scheme, params, rounds=5):
+    """Mediana de ``rounds`` derivaciones, en segundos."""
+    times = sorted(_time_once(scheme, params) for _ in range(rounds))
+    return times[len(times) // 2]
+
+
+def calibrate(scheme, target_ms, rounds=5, max_memory=SCRYPT_MAX_MEMORY):
+    """Parámetros de ``scheme`` que tardan como mucho ``target_ms`` en este host."""
+    target = target_ms / 1000
+    if scheme == PBKDF2:
+        # cost is linear in the iterations: scale a probe, then check it
+        probe = {'iterations': 20_000}
+        per_iteration = measure(scheme, probe, rounds) / probe['iterations']
+        iterations = max(10_000, int(target / per_iteration) // 1000 * 1000)
+        while iterations > 10_000 and measure(scheme, {'iterations': iterations}, rounds) > target:
+            iterations = max(10_000, int(iterations * 0.9) // 1000 * 1000)
+        params = {'iterations': iterations}
+    elif scheme == SCRYPT:
+        # n is a power of two: double it while it fits in time and memory
+        params = {'n': 1 << 14, 'r': SCRYPT_R, 'p': SCRYPT_P}
+        while 128 * SCRYPT_R * params['n'] * 2 <= max_memory:
+            bigger = dict(params, n=params['n'] * 2)
+            if measure(scheme, bigger, rounds) > target:
+                break
+            params = bigger
+    else:
+        raise ValueError(f"unsupported password scheme: {scheme}")
+    measured = measure(scheme, params, rounds)
+    return dict(params, scheme=scheme, target_ms=target_ms, measured_ms=round(measured * 1000, 1),
+                cpus=os.cpu_count())
+
+
+def main():
+    import argparse
+    import sqlite3
+    from collections import Counter
+
+    base = os.path.dirname(os.environ.get('F1_DB_PATH') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'f1_app.db'))
+    parser = argparse.ArgumentParser(description='Calibración y estado del hash de contraseñas')
+    sub = parser.add_subparsers(dest='command', required=True)
+    cal = sub.add_parser('calibrate', help='elige parámetros para un presupuesto de latencia')
+    cal.add_argument('--scheme', choices=SCHEMES, default=PBKDF2)
+    cal.add_argument('--target-ms', type=float, default=250.0)
+    cal.add_argument('--rounds', type=int, default=5)
+    cal.add_argument('--write', metavar='PATH', nargs='?', const=os.path.join(base, 'password_kdf.json'),
+                     help='guarda la política (por defecto junto a la base)')
+    bench = sub.add_parser('bench', help='mide la política actual')
+    bench.add_argument('--policy', default=os.path.join(base, 'password_kdf.json'))
+    stats = sub.add_parser('stats', help='hashes guardados por algoritmo y parámetros')
+    stats.add_argument('--db', default=os.path.join(base, 'f1_app.db'))
+    args = parser.parse_args()
+
+    if args.command == 'calibrate':
+        policy = calibrate(args.scheme, args.target_ms, args.rounds)
+        print(json.dumps(policy, indent=2))
+        if policy['measured_ms'] > args.target_ms:
+            print(f"Warning: the minimum {args.scheme} cost already takes {policy['measured_ms']} ms here",
+                  file=sys.stderr)
+        if args.write:
+            tmp = f'{args.write}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(policy, f, indent=2)
+            os.replace(tmp, args.write)
+            print(f"Policy written to {args.write}; outdated hashes are upgraded on login", file=sys.stderr)
+    elif args.command == 'bench':
+        policy = load_policy(args.policy)
+        scheme = policy.pop('scheme')
+        target_ms = policy.pop('target_ms')
+        ms = measure(scheme, policy) * 1000
+        print(json.dumps({'scheme': scheme, **policy, 'target_ms': target_ms, 'measured_ms': round(ms, 1)}))
+    else:
+        hasher = PasswordHasher(load_policy(os.path.join(os.path.dirname(args.db), 'password_kdf.json')))
+        conn = sqlite3.connect(f'file:{args.db}?mode=ro', uri=True)
+        try:
+            counts = Counter()
+            outdated = 0
+            for (stored,) in conn.execute('SELECT contrasena FROM usuarios'):
+                try:
+                    scheme, params, _, _ = parse(stored or '')
+                    counts[' '.join([scheme] + [f'{k}={v}' for k, v in params.items()])] += 1
+                except (ValueError, binascii.Error):
+                    counts['unknown'] += 1
+                outdated += hasher.needs_rehash(stored or '')
+        finally:
+            conn.close()
+        print(json.dumps({'hashes': dict(counts.most_common()), 'outdated': outdated}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,16 @@ import os
 import sqlite3
 from sqlite3 import Error
 
+import db
+import snapshot
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# usuarios/apuestas (written by registro.py)
+APP_DB_PATH = os.environ.get('F1_DB_PATH') or os.path.join(SCRIPT_DIR, 'f1_app.db')
+# drivers/resultados/constructors/race_results (written only here)
+REF_DB_PATH = os.environ.get('F1_REF_DB_PATH') or os.path.join(os.path.dirname(APP_DB_PATH), 'f1_ref.db')
+OLTP_TABLES = ('usuarios', 'apuestas_top3')
+
 CSV_FILE = "Pilotos_2023_2024 (1).csv"
 RESULTS_CSV = "resultado_races.csv"
 CONSTRUCTORS_CSV = "Constructores_2023_2024.csv"
@@ -12,12 +22,144 @@ SEASON2025_CSV = "Formula1_2025Season_RaceResults.csv"
 def create_connection(db_file):
     """Crea una conexión a la base de datos SQLite (crea el archivo si no existe)."""
     try:
-        conn = sqlite3.connect(db_file)
+        conn = db.connect(db_file)
         return conn
     except Error as e:
         print("Error al conectar:", e)
         return None
 
+def ensure_reference_db(app_path=APP_DB_PATH, ref_path=REF_DB_PATH):
+    """Crea la base de referencia si no existe.
+
+    Older installs kept drivers & co. inside f1_app.db. The first time we
+    copy them (same ids, since apuestas_top3 points at drivers.id) into
+    their own file; the copies left in f1_app.db are no longer read.
+    Devuelve True si la creó.
+    """
+    if os.path.exists(ref_path):
+        return False
+    tmp = f'{ref_path}.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    src = sqlite3.connect(app_path)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst)
+        cur = dst.cursor()
+        for table in OLTP_TABLES:
+            cur.execute(f'DROP TABLE IF EXISTS {table}')
+        dst.commit()
+        db.apply_pragmas(dst, db.REF_IMPORT_PRAGMAS)
+        cur.execute('VACUUM')
+    finally:
+        src.close()
+        dst.close()
+    os.replace(tmp, ref_path)
+    print(f"Reference tables copied from {app_path} to {ref_path}")
+    return True
+
+
+def read_generation(conn):
+    """Número de generación de la base de referencia (0 si nunca se marcó)."""
+    try:
+        row = conn.execute("SELECT value FROM ref_meta WHERE key = 'generation'").fetchone()
+    except Error:
+        return 0
+    return int(row[0]) if row else 0
+
+
+def bump_generation(conn):
+    generation = read_generation(conn) + 1
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS ref_meta (key TEXT PRIMARY KEY, value TEXT)")
+    cur.execute("INSERT OR REPLACE INTO ref_meta (key, value) VALUES ('generation', ?)", (str(generation),))
+    cur.execute("INSERT OR REPLACE INTO ref_meta (key, value) VALUES ('built_at', datetime('now'))")
+    conn.commit()
+    return generation
+
+
+def table_counts(conn):
+    counts = {}
+    for table in db.REF_TABLES:
+        try:
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        except Error:
+            counts[table] = 0
+    return counts
+
+
+def start_shadow_build(ref_path=REF_DB_PATH):
+    """Prepara una copia de la base de referencia para importar sin tocar la activa.
+
+    The shadow starts as a copy of the live file (backup API, readers are
+    not blocked) so the upsert importers keep every existing drivers.id.
+    Devuelve la ruta del archivo sombra.
+    """
+    shadow = f'{ref_path}.shadow-{os.getpid()}'
+    for path in (shadow, shadow + '-journal'):
+        if os.path.exists(path):
+            os.remove(path)
+    if os.path.exists(ref_path):
+        src = sqlite3.connect(db.readonly_uri(ref_path), uri=True)
+        dst = sqlite3.connect(shadow)
+        try:
+            src.backup(dst)
+        finally:
+            src.close()
+            dst.close()
+    return shadow
+
+
+def validate_reference_db(conn, previous_counts):
+    """Lista de problemas que impiden publicar la base (vacía = OK)."""
+    problems = []
+    check = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    if check != 'ok':
+        problems.append(f'integrity_check: {check}')
+    counts = table_counts(conn)
+    for table in ('drivers', 'race_results'):
+        if counts[table] == 0:
+            problems.append(f'{table} quedó vacía')
+    for table, before in previous_counts.items():
+        # importers only upsert, so a table can never shrink
+        if counts[table] < before:
+            problems.append(f'{table}: {counts[table]} filas < {before} antes del import')
+    return problems
+
+
+def finish_shadow_build(conn, shadow, ref_path, previous_counts):
+    """Valida la sombra y la publica con un rename atómico. Devuelve True si se publicó.
+
+    Servers open a new connection (and ATTACH by path) per request, so the
+    next request sees the new file while in-flight readers keep the old
+    inode. Relies on POSIX rename semantics: on Windows the rename fails
+    while the live file is open.
+    """
+    problems = validate_reference_db(conn, previous_counts)
+    if problems:
+        conn.close()
+        print("Shadow build rejected, live database untouched:")
+        for p in problems:
+            print(f"  {p}")
+        print(f"Shadow kept for inspection: {shadow}")
+        return False
+    generation = bump_generation(conn)
+    db.apply_pragmas(conn, (('journal_mode', 'DELETE'),))
+    conn.close()
+    with open(shadow, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(shadow, ref_path)
+    print(f"Reference database generation {generation} published at {ref_path}")
+    return True
+
+
+def create_reference_connection(ref_path=REF_DB_PATH):
+    conn = create_connection(ref_path)
+    if conn:
+        db.apply_pragmas(conn, db.REF_IMPORT_PRAGMAS)
+    return conn
+
+
 def create_table_drivers(conn):
     """Crea la tabla drivers si no existe."""
     sql = """
@@ -426,18 +568,40 @@ def import_results_from_csv(conn, csv_path):
 
     return inserted, updated
 
+def write_race_results_snapshot(ref_path=REF_DB_PATH):
+    """Escribe el snapshot columnar de race_results a partir de la base publicada."""
+    path = snapshot.default_path(ref_path)
+    conn = sqlite3.connect(db.readonly_uri(ref_path), uri=True)
+    try:
+        rows = snapshot.write_snapshot(conn, path, generation=read_generation(conn))
+    except (Error, OSError) as e:
+        print("Error al escribir el snapshot:", e)
+        return None
+    finally:
+        conn.close()
+    print(f"Snapshot {path}: {rows} rows")
+    return path
+
+
 def main():
-    # Use the database file located in the same directory as this script
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    db_path = os.path.join(script_dir, 'f1_app.db')
+    # --swap: build a complete new reference DB in a shadow file, validate it
+    # and rename it over the live one (zero downtime for running servers)
+    argv = os.sys.argv[1:]
+    swap = '--swap' in argv
+    args = [a for a in argv if a != '--swap']
     csv_path = CSV_FILE
     # if a CSV path is passed as argument, use it
-    if len(os.sys.argv) > 1:
-        csv_path = os.sys.argv[1]
-
-    conn = create_connection(db_path)
+    if args:
+        csv_path = args[0]
+
+    # reference data goes to its own file so imports never block bets
+    if os.path.exists(APP_DB_PATH):
+        ensure_reference_db(APP_DB_PATH, REF_DB_PATH)
+    target = start_shadow_build(REF_DB_PATH) if swap else REF_DB_PATH
+    conn = create_reference_connection(target)
     if not conn:
         return
+    previous_counts = table_counts(conn)
 
     create_table_drivers(conn)
     inserted, updated = import_from_csv(conn, csv_path)
@@ -474,7 +638,19 @@ def main():
     for rr in cur.execute("SELECT id, track, position, driver, team, season FROM race_results ORDER BY season DESC LIMIT 20"):
         print(rr)
 
-    # Crear la tabla de usuarios (si no existe) y mostrar muestra
+    if swap:
+        if not finish_shadow_build(conn, target, REF_DB_PATH, previous_counts):
+            os.sys.exit(1)
+    else:
+        bump_generation(conn)
+        conn.close()
+    write_race_results_snapshot(REF_DB_PATH)
+
+    # Crear la tabla de usuarios (si no existe) en la base de la app y mostrar muestra
+    conn = create_connection(APP_DB_PATH)
+    if not conn:
+        return
+    cur = conn.cursor()
     create_usuarios_table(conn)
     ensure_usuarios_monto_column(conn)
     try:
@@ -485,6 +661,11 @@ def main():
     for u in cur.execute("SELECT id, nombre, apellido, email, fecha_nacimiento, created_at FROM usuarios LIMIT 10"):
         print(u)
 
+    if db.QUERY_LOG.enabled:
+        print("Top statements (F1_QUERY_LOG):")
+        for q in db.QUERY_LOG.top(10):
+            print(f"  {q['total_ms']:>10.1f} ms  x{q['calls']:<6} {q['sql'][:100]}")
+
     conn.close()
 
 if __name__ == '__main__':
@@ -0,0 +1,522 @@
+"""Thin wrapper around sqlite3.connect that times every statement.
+
+Connections created with ``connect()`` hand out cursors that add the time
+spent inside SQLite to a per-thread counter, so the HTTP handler can report
+SQLite time per request. Everything else behaves like plain sqlite3.
+
+Opt-in slow-query log (``F1_QUERY_LOG=1``): statements are aggregated by
+normalized SQL, the ones slower than ``F1_SLOW_QUERY_MS`` are logged with
+their parameters redacted, and ``EXPLAIN QUERY PLAN`` is captured once per
+distinct slow statement to flag full table scans.
+"""
+import os
+import pathlib
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+_local = threading.local()
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+
+def normalize_sql(sql):
+    """Colapsa espacios y reemplaza literales por '?' para agrupar sentencias."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _SPACE_RE.sub(' ', sql).strip()
+    return _IN_LIST_RE.sub('IN (?...)', sql)
+
+
+def redact_params(params):
+    if not params:
+        return '[]'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{k}: <{type(v).__name__}>' for k, v in params.items()) + '}'
+    return '[' + ', '.join(f'<{type(v).__name__}>' for v in params) + ']'
+
+
+class _StatementStats:
+    __slots__ = ('calls', 'total', 'max', 'slow', 'lock_errors', 'plan', 'full_scan')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.lock_errors = 0
+        self.plan = None
+        self.full_scan = False
+
+
+class QueryLog:
+    def __init__(self, enabled=False, slow_ms=50.0, out=None):
+        self.enabled = enabled
+        self.slow_seconds = slow_ms / 1000.0
+        self.out = out or sys.stderr
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, conn, sql, params, seconds, error=None):
+        key = normalize_sql(sql)
+        explain = False
+        with self._lock:
+            st = self._stats.get(key)
+            if st is None:
+                st = self._stats[key] = _StatementStats()
+            st.calls += 1
+            st.total += seconds
+            if seconds > st.max:
+                st.max = seconds
+            if error is not None and 'locked' in str(error):
+                st.lock_errors += 1
+            if seconds >= self.slow_seconds:
+                st.slow += 1
+                if st.plan is None:
+                    st.plan = []
+                    explain = True
+        if seconds >= self.slow_seconds or error is not None:
+            print(f"SLOW QUERY {seconds * 1000:.1f} ms: {key} params={redact_params(params)}"
+                  + (f" error={error}" if error is not None else ''), file=self.out)
+        if explain and conn is not None:
+            self._explain(conn, key, sql, params, st)
+        return key
+
+    def add_fetch_time(self, key, seconds):
+        with self._lock:
+            st = self._stats.get(key)
+            if st is not None:
+                st.total += seconds
+
+    def _explain(self, conn, key, sql, params, st):
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return
+        try:
+            # plain cursor: not timed, not logged
+            cur = sqlite3.Cursor(conn)
+            cur.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            plan = [f'(plan unavailable: {e})']
+        full_scan = any(line.startswith('SCAN') and 'INDEX' not in line for line in plan)
+        with self._lock:
+            st.plan = plan
+            st.full_scan = full_scan
+        if full_scan:
+            print(f"FULL SCAN in slow query: {key} plan={plan}", file=self.out)
+
+    def top(self, n=20, sort='total'):
+        with self._lock:
+            rows = [
+                {
+                    'sql': key,
+                    'calls': st.calls,
+                    'total_ms': round(st.total * 1000, 3),
+                    'avg_ms': round(st.total * 1000 / st.calls, 3) if st.calls else 0,
+                    'max_ms': round(st.max * 1000, 3),
+                    'slow': st.slow,
+                    'lock_errors': st.lock_errors,
+                    'full_scan': st.full_scan,
+                    'plan': st.plan,
+                } for key, st in self._stats.items()
+            ]
+        sort_key = {'total': 'total_ms', 'max': 'max_ms', 'avg': 'avg_ms',
+                    'calls': 'calls', 'slow': 'slow'}.get(sort, 'total_ms')
+        rows.sort(key=lambda r: r[sort_key], reverse=True)
+        return rows[:n]
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+QUERY_LOG = QueryLog(
+    enabled=os.environ.get('F1_QUERY_LOG', '') not in ('', '0'),
+    slow_ms=float(os.environ.get('F1_SLOW_QUERY_MS', '50')),
+)
+
+
+def reset_request_time():
+    _local.seconds = 0.0
+
+
+def request_time():
+    return getattr(_local, 'seconds', 0.0)
+
+
+def _add_time(seconds):
+    _local.seconds = getattr(_local, 'seconds', 0.0) + seconds
+
+
+class TimedCursor(sqlite3.Cursor):
+    _log_key = None
+
+    def _timed(self, method, sql, params):
+        t0 = time.perf_counter()
+        error = None
+        try:
+            return method(sql, params)
+        except sqlite3.OperationalError as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            _add_time(elapsed)
+            if QUERY_LOG.enabled:
+                self._log_key = QUERY_LOG.record(self.connection, sql, params, elapsed, error)
+
+    def _fetched(self, t0):
+        elapsed = time.perf_counter() - t0
+        _add_time(elapsed)
+        if self._log_key is not None:
+            QUERY_LOG.add_fetch_time(self._log_key, elapsed)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _add_time(elapsed)
+            if QUERY_LOG.enabled:
+                QUERY_LOG.record(None, sql, (), elapsed)
+
+    def executescript(self, sql_script):
+        t0 = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _add_time(time.perf_counter() - t0)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._fetched(t0)
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._fetched(t0)
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._fetched(t0)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        # a slow COMMIT usually means waiting on the write lock / fsync
+        t0 = time.perf_counter()
+        error = None
+        try:
+            return super().commit()
+        except sqlite3.OperationalError as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            _add_time(elapsed)
+            if QUERY_LOG.enabled:
+                QUERY_LOG.record(None, 'COMMIT', (), elapsed, error)
+
+
+def connect(path, **kwargs):
+    """Como sqlite3.connect pero con cursores cronometrados."""
+    kwargs.setdefault('factory', TimedConnection)
+    return sqlite3.connect(path, **kwargs)
+
+
+# ---- app (OLTP) database + read-only reference database ----
+# Reference data (drivers, results...) lives in its own file written only by
+# createDB.py; usuarios/apuestas_top3 live in the app file. The server opens
+# the app file and ATTACHes the reference file read-only as schema "ref", so
+# a long import never holds the lock bet placement needs.
+REF_SCHEMA = 'ref'
+REF_TABLES = ('drivers', 'constructors', 'resultados', 'race_results')
+
+# per-connection pragmas for the app file (journal_mode=WAL is persistent and
+# set once by init_app_db)
+APP_PRAGMAS = (
+    ('synchronous', 'NORMAL'),
+)
+APP_PERSISTENT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('wal_autocheckpoint', 1000),
+)
+# the reference file is rewritten in bulk by createDB.py and only read by
+# the server: rollback journal (single file, safe to copy/rename) and a big
+# page cache so imports don't spill mid-transaction
+REF_IMPORT_PRAGMAS = (
+    ('journal_mode', 'DELETE'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -65536),
+)
+BUSY_TIMEOUT = 5.0
+
+
+def readonly_uri(path):
+    return pathlib.Path(path).resolve().as_uri() + '?mode=ro'
+
+
+def apply_pragmas(conn, pragmas, schema=None):
+    prefix = f'{schema}.' if schema else ''
+    for name, value in pragmas:
+        conn.execute(f'PRAGMA {prefix}{name} = {value}')
+
+
+def connect_app(app_path, ref_path, ref_uri=None, **kwargs):
+    """Conexión a la base de usuarios/apuestas con la de referencia adjunta como ``ref``.
+
+    ``ref_uri`` (p. ej. la réplica en memoria) reemplaza al archivo ``ref_path``.
+    """
+    kwargs.setdefault('timeout', BUSY_TIMEOUT)
+    conn = connect(app_path, uri=True, **kwargs)
+    apply_pragmas(conn, APP_PRAGMAS)
+    conn.execute(f'ATTACH DATABASE ? AS {REF_SCHEMA}', (ref_uri or readonly_uri(ref_path),))
+    return conn
+
+
+class RefWatcher:
+    """Notices when the reference file gets a new generation (createDB.py).
+
+    ``check()`` costs one ``os.stat``; when inode/mtime/size change it reads
+    the generation number from ``ref_meta`` and calls the listeners only if
+    that number changed. An in-place import commits several times before it
+    bumps the generation, so listeners never see a half-imported file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.generation = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, fn):
+        """``fn(generation)`` se llama cuando cambia la generación."""
+        self._listeners.append(fn)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _read_generation(self):
+        """Generación del archivo, 0 sin ``ref_meta``, None si ahora no se puede leer."""
+        try:
+            conn = sqlite3.connect(readonly_uri(self.path), uri=True)
+        except sqlite3.Error:
+            return None
+        try:
+            row = conn.execute("SELECT value FROM ref_meta WHERE key = 'generation'").fetchone()
+            return int(row[0]) if row else 0
+        except sqlite3.OperationalError as e:
+            # a locked file mid-import is not generation 0
+            return 0 if 'no such table' in str(e) else None
+        except sqlite3.Error:
+            return None
+        finally:
+            conn.close()
+
+    def check(self):
+        signature = self._stat()
+        if signature == self._signature:
+            return self.generation
+        with self._lock:
+            if signature == self._signature:
+                return self.generation
+            generation = self._read_generation()
+            if generation is None:
+                # keep the old signature so the next check reads it again
+                return self.generation
+            first = self._signature is None
+            changed = generation != self.generation
+            self._signature = signature
+            self.generation = generation
+        if changed and not first:
+            print(f"Reference database changed (generation {generation})")
+            for fn in self._listeners:
+                try:
+                    fn(generation)
+                except Exception as e:
+                    print(f"Reference listener failed: {e}")
+        return generation
+
+
+# indexes that only exist in the in-memory replica: built after the copy so
+# the import path in createDB.py stays as fast as before
+REPLICA_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_drivers_name_id ON drivers(name, id)',
+    'CREATE INDEX IF NOT EXISTS idx_constructors_season ON constructors(season)',
+    'CREATE INDEX IF NOT EXISTS idx_resultados_season ON resultados(season)',
+    'CREATE INDEX IF NOT EXISTS idx_race_results_season_track ON race_results(season, track)',
+    'CREATE INDEX IF NOT EXISTS idx_race_results_driver ON race_results(driver)',
+)
+
+
+class RefReplica:
+    """Copy of the reference file in a shared-cache in-memory database.
+
+    ``load()`` copies the file with the backup API into
+    ``file:f1ref_gen{N}_{pid}_{n}?mode=memory&cache=shared``, builds
+    ``REPLICA_INDEXES`` and only then publishes the new ``uri``, so requests
+    keep attaching the previous generation while a refresh is running.
+
+    A shared-cache memory database lives while any connection has it open,
+    and attaching a name that was freed silently creates an empty one. A
+    private keeper connection holds each copy; a replaced copy is closed
+    once no caller is between ``pin()`` and ``unpin()``, i.e. no ATTACH of
+    it can still be on its way. Connections that attached it keep it alive
+    themselves.
+    """
+
+    def __init__(self):
+        self.uri = None
+        self.generation = None
+        self.loaded_at = None
+        self.load_seconds = 0.0
+        self.loads = 0
+        self.failures = 0
+        # uri -> [keeper connection, pins]
+        self._copies = {}
+        self._lock = threading.Lock()
+        self._loading = False
+        self._wanted = None
+
+    def load(self, ref_path, generation=None):
+        t0 = time.perf_counter()
+        name = f"f1ref_gen{generation or 0}_{os.getpid()}_{self.loads}"
+        uri = f"file:{name}?mode=memory&cache=shared"
+        keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            src = sqlite3.connect(readonly_uri(ref_path), uri=True)
+            try:
+                src.backup(keeper)
+            finally:
+                src.close()
+            # what was actually copied, whatever the caller expected
+            try:
+                row = keeper.execute("SELECT value FROM ref_meta WHERE key = 'generation'").fetchone()
+                generation = int(row[0]) if row else 0
+            except sqlite3.OperationalError:
+                generation = 0
+            for sql in REPLICA_INDEXES:
+                try:
+                    keeper.execute(sql)
+                except sqlite3.OperationalError as e:
+                    # a table missing from an old reference file
+                    print(f"Replica index skipped: {e}")
+            keeper.execute('ANALYZE')
+            keeper.commit()
+        except Exception:
+            keeper.close()
+            raise
+        with self._lock:
+            self._copies[uri] = [keeper, 0]
+            self.uri = uri
+            self.generation = generation
+            self.loaded_at = time.time()
+            self.load_seconds = time.perf_counter() - t0
+            self.loads += 1
+            unused = self._take_unused()
+        for old in unused:
+            old.close()
+        print(f"Reference replica generation {generation} loaded in {self.load_seconds * 1000:.0f} ms")
+        return uri
+
+    def pin(self):
+        """URI actual, reservada hasta ``unpin()`` (tiene que envolver el ATTACH)."""
+        with self._lock:
+            uri = self.uri
+            if uri is not None:
+                self._copies[uri][1] += 1
+            return uri
+
+    def unpin(self, uri):
+        if uri is None:
+            return
+        with self._lock:
+            self._copies[uri][1] -= 1
+            unused = self._take_unused()
+        for old in unused:
+            old.close()
+
+    def _take_unused(self):
+        unused = [uri for uri, (_, pins) in self._copies.items() if uri != self.uri and pins == 0]
+        return [self._copies.pop(uri)[0] for uri in unused]
+
+    def refresh_async(self, ref_path, generation, done=None, current=None):
+        """Recarga en un hilo aparte; mientras tanto se sigue usando la copia vieja.
+
+        A refresh asked for while a load is running is kept and served when
+        it ends. After each load ``current()`` (the watcher's check) gives
+        the generation on disk now; if it differs from the one copied, the
+        file moved on meanwhile and it is loaded again. ``done(generation)``
+        is called once the new copy is in use.
+        """
+        with self._lock:
+            self._wanted = (ref_path, generation, done, current)
+            if self._loading:
+                return True
+            self._loading = True
+
+        def work():
+            while True:
+                with self._lock:
+                    if self._wanted is None:
+                        self._loading = False
+                        return
+                    ref_path, generation, done, current = self._wanted
+                    self._wanted = None
+                try:
+                    self.load(ref_path, generation)
+                    loaded = self.generation
+                    if done is not None:
+                        done(loaded)
+                    latest = current() if current is not None else loaded
+                    if latest is not None and latest != loaded:
+                        with self._lock:
+                            if self._wanted is None:
+                                self._wanted = (ref_path, latest, done, current)
+                except Exception as e:
+                    self.failures += 1
+                    print(f"Reference replica refresh failed, keeping generation {self.generation}: {e}")
+
+        threading.Thread(target=work, name='ref-replica', daemon=True).start()
+        return True
+
+    def size_bytes(self):
+        with self._lock:
+            if self.uri is None:
+                return 0
+            keeper = self._copies[self.uri][0]
+            page_count = keeper.execute('PRAGMA page_count').fetchone()[0]
+            page_size = keeper.execute('PRAGMA page_size').fetchone()[0]
+        return page_count * page_size
@@ -0,0 +1,605 @@
+"""Append-only journal of bet events (create / status / settle / delete).
+
+``JOURNAL.on_event`` is an ``EventHub`` listener: every committed change is
+assigned the next sequence number and queued; a writer thread appends
+whatever has queued up as one batch (one ``write`` and one ``fsync``), so
+the request thread never waits on the disk. Sequence numbers keep growing
+across restarts.
+
+On disk the journal is a directory of segments::
+
+    base-<through>.log   compacted history up to seq <through> (optional)
+    seg-<first>.log      raw events from seq <first>; the last one is active
+
+Records are ``<length u32, crc32 u32, seq u64>`` followed by the JSON
+event. A torn record at the end of the active segment (crash mid-write)
+is cut off when the journal is opened; a batch whose write fails is cut
+off right away (or, if that fails too, the writer moves on to a new
+segment) and counted as ``lost``. Each segment keeps a sparse
+seq -> offset index (built on first read), so ``events_since(n)`` is a
+bisect over segments, a bisect over the index and a sequential read.
+
+When the active segment passes ``segment_bytes`` a new one is started;
+once more than ``keep_segments`` closed segments pile up, the oldest are
+folded into a new base that keeps only the latest state of each bet that
+still exists (as a 'created' record with its final status). Consumers
+positioned inside the compacted range get ``None`` and must restart from
+0, like ``EventHub`` answers 'reset'.
+
+``python diario.py replay`` rebuilds the trending aggregates and the
+per-status counts from the journal alone. The tool opens the journal
+read-only, so it is safe to run next to the server; compaction on demand
+goes through the server (``POST /api/journal/compact``).
+"""
+import atexit
+import bisect
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, deque
+
+RECORD = struct.Struct('<IIQ')
+SEGMENT_BYTES = 8 * 1024 * 1024
+KEEP_SEGMENTS = 4
+INDEX_EVERY = 128
+BATCH_MAX = 1024
+READ_LIMIT = 1000
+
+
+def _segment_name(first_seq):
+    return f"seg-{first_seq:020d}.log"
+
+
+def _base_name(through):
+    return f"base-{through:020d}.log"
+
+
+def iter_records(path, offset=0):
+    """(seq, payload, offset del registro) desde ``offset`` hasta el primer registro incompleto."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            length, crc, seq = RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            yield seq, payload, offset
+            offset += RECORD.size + length
+
+
+class Segment:
+    __slots__ = ('path', 'first_seq', 'last_seq', 'size', 'seqs', 'offsets', 'base')
+
+    def __init__(self, path, first_seq, base=False):
+        self.path = path
+        self.first_seq = first_seq
+        self.last_seq = None
+        self.size = 0
+        # sparse index; None until the segment is first read
+        self.seqs = None
+        self.offsets = None
+        self.base = base
+
+    def scan(self):
+        """Construye el índice leyendo el segmento; devuelve (final válido, registros)."""
+        seqs, offsets = [], []
+        end = 0
+        count = 0
+        for seq, payload, offset in iter_records(self.path):
+            if count % INDEX_EVERY == 0:
+                offsets.append(offset)
+                seqs.append(seq)
+            count += 1
+            self.last_seq = seq
+            end = offset + RECORD.size + len(payload)
+        self.offsets, self.seqs = offsets, seqs
+        return end, count
+
+    def offset_for(self, since):
+        """Offset from which every record with seq > ``since`` follows."""
+        if self.seqs is None:
+            self.scan()
+        seqs = self.seqs
+        i = bisect.bisect_right(seqs, since) - 1
+        return self.offsets[i] if i >= 0 else 0
+
+    def note(self, seq, offset, count):
+        # offsets first: a concurrent reader bisects seqs and then indexes offsets
+        if count % INDEX_EVERY == 0:
+            self.offsets.append(offset)
+            self.seqs.append(seq)
+        self.last_seq = seq
+
+
+class Journal:
+    def __init__(self, segment_bytes=SEGMENT_BYTES, keep_segments=KEEP_SEGMENTS, fsync=True):
+        self.segment_bytes = segment_bytes
+        self.keep_segments = keep_segments
+        self.fsync = fsync
+        self.path = None
+        self.readonly = False
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._segments = []
+        self._active = None
+        self._active_count = 0
+        self._file = None
+        # the active segment has a tail that couldn't be cut off
+        self._broken = False
+        self._next_seq = 1
+        self.durable_seq = 0
+        # last seq the writer is done with, written or lost
+        self._handled_seq = 0
+        self.compacted_through = 0
+        self._stopping = False
+        self._thread = None
+        # held by the writer around each batch and by rotations from outside it
+        self._write_lock = threading.Lock()
+        self._compacting = False
+        self.lost = 0
+        self.batches = 0
+        self.written = 0
+        self.compactions = 0
+        self.write_seconds = 0.0
+
+    # ---- open / recovery ----
+    def open(self, path, readonly=False):
+        """Abre el journal; ``readonly`` para herramientas al lado del servidor.
+
+        A read-only journal doesn't touch the directory (no torn tail cut
+        off, no leftovers removed) and starts no writer: it reads what was
+        durable when it was opened.
+        """
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            last = self._load_retrying()
+            self.durable_seq = self._handled_seq = last
+            return last
+        os.makedirs(path, exist_ok=True)
+        last = self._load()
+        self._next_seq = last + 1
+        self.durable_seq = self._handled_seq = last
+        self._stopping = False
+        self._thread = threading.Thread(target=self._writer, name='journal-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return last
+
+    def _load_retrying(self, attempts=3):
+        # the server may compact or rotate while we list the directory
+        for attempt in range(attempts):
+            try:
+                return self._load()
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+
+    def _load(self):
+        """Lee el directorio y arma la lista de segmentos; devuelve el último seq."""
+        path = self.path
+        base = None
+        segments = []
+        for name in sorted(os.listdir(path)):
+            full = os.path.join(path, name)
+            if name.startswith('base-') and name.endswith('.log'):
+                if base is not None and not self.readonly:
+                    # an interrupted compaction left the previous base behind
+                    os.remove(base.path)
+                base = Segment(full, 0, base=True)
+                base.last_seq = int(name[5:-4])
+            elif name.startswith('seg-') and name.endswith('.log'):
+                segments.append(Segment(full, int(name[4:-4])))
+            elif name.endswith('.tmp') and not self.readonly:
+                os.remove(full)
+        compacted = 0
+        if base is not None:
+            compacted = base.last_seq
+            # segments folded into the base but not deleted yet
+            for seg in [s for s in segments if s.first_seq <= base.last_seq]:
+                if not self.readonly:
+                    os.remove(seg.path)
+                segments.remove(seg)
+        # closed segments end where the next one starts; exact values come
+        # from the index when they are first read
+        for seg, nxt in zip(segments, segments[1:]):
+            seg.last_seq = nxt.first_seq - 1
+        active = None
+        if segments:
+            active = segments[-1]
+            end, self._active_count = active.scan()
+            if end < os.path.getsize(active.path) and not self.readonly:
+                print(f"Journal: truncating torn tail of {active.path} at {end}")
+                with open(active.path, 'r+b') as f:
+                    f.truncate(end)
+            active.size = end
+            last = active.last_seq if active.last_seq is not None else active.first_seq - 1
+        else:
+            last = compacted
+        with self._cond:
+            self._segments = ([base] if base is not None else []) + segments
+            self._active = active
+            self.compacted_through = compacted
+        return last
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    # ---- appending ----
+    def append(self, event, user_id, data):
+        """Encola el evento; devuelve su número de secuencia."""
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            payload = json.dumps({'seq': seq, 'ts': round(time.time(), 3), 'event': event,
+                                  'user_id': user_id, 'bet': data},
+                                 separators=(',', ':')).encode('utf-8')
+            self._pending.append((seq, payload))
+            self._cond.notify()
+        return seq
+
+    def on_event(self, event_id, event, user_id, data):
+        """Listener para ``EventHub.add_listener``."""
+        if self.enabled and data and 'id' in data:
+            self.append(event, user_id, data)
+
+    def flush(self, timeout=5.0):
+        """Espera a que todo lo encolado esté escrito; False si venció o se perdió el final."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            target = self._next_seq - 1
+            while self._handled_seq < target and self._thread is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return self.durable_seq >= target
+
+    def close(self):
+        if self._thread is None:
+            return
+        self.flush()
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5.0)
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                batch = []
+                while self._pending and len(batch) < BATCH_MAX:
+                    batch.append(self._pending.popleft())
+            try:
+                with self._write_lock:
+                    self._write_batch(batch)
+                ok = True
+            except OSError as e:
+                # keep serving requests; the gap shows up in the metrics
+                print(f"Journal write failed, {len(batch)} events lost: {e}")
+                self.lost += len(batch)
+                ok = False
+            with self._cond:
+                if ok:
+                    self.durable_seq = batch[-1][0]
+                self._handled_seq = batch[-1][0]
+                self._cond.notify_all()
+
+    def _write_batch(self, batch):
+        t0 = time.perf_counter()
+        if (self._active is None or self._broken
+                or (self._active.size and self._active.size >= self.segment_bytes)):
+            self._rotate(batch[0][0])
+        if self._file is None:
+            self._file = open(self._active.path, 'ab')
+        seg = self._active
+        mark = (len(seg.seqs), seg.last_seq, self._active_count)
+        chunks = []
+        offset = seg.size
+        for seq, payload in batch:
+            seg.note(seq, offset, self._active_count)
+            self._active_count += 1
+            record = RECORD.pack(len(payload), zlib.crc32(payload), seq) + payload
+            chunks.append(record)
+            offset += len(record)
+        try:
+            self._file.write(b''.join(chunks))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except OSError:
+            self._discard_tail(seg, mark)
+            raise
+        seg.size = offset
+        self.batches += 1
+        self.written += len(batch)
+        self.write_seconds += time.perf_counter() - t0
+
+    def _discard_tail(self, seg, mark):
+        """Deshace un lote que no llegó entero al disco."""
+        indexed, last_seq, count = mark
+        with self._cond:
+            del seg.offsets[indexed:]
+            del seg.seqs[indexed:]
+            seg.last_seq = last_seq
+            self._active_count = count
+        # part of the batch may be on disk: the next batch must not land
+        # after it, or readers (and open()) would stop at the torn record
+        f, self._file = self._file, None
+        try:
+            f.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(seg.path, seg.size)
+        except OSError as e:
+            print(f"Journal: could not truncate {seg.path} at {seg.size}, starting a new segment: {e}")
+            self._broken = True
+
+    def _rotate(self, first_seq):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        seg = Segment(os.path.join(self.path, _segment_name(first_seq)), first_seq)
+        seg.seqs, seg.offsets = [], []
+        self._file = open(seg.path, 'ab')
+        self._broken = False
+        with self._cond:
+            if self._active is not None:
+                self._active.last_seq = first_seq - 1
+            self._segments.append(seg)
+            self._active = seg
+            self._active_count = 0
+            closed = sum(1 for s in self._segments if not s.base) - 1
+            start = closed > self.keep_segments and not self._compacting
+            if start:
+                self._compacting = True
+        if start:
+            threading.Thread(target=self._compact_background, name='journal-compact', daemon=True).start()
+
+    # ---- reading ----
+    def events_since(self, since, limit=READ_LIMIT, attempts=3):
+        """[(seq, payload JSON)] con seq > ``since`` (a lo sumo ``limit``), o None si hay que empezar de 0."""
+        for attempt in range(attempts):
+            try:
+                return self._events_since(since, limit)
+            except FileNotFoundError:
+                # compact() folded a segment after we took the list; the
+                # fresh list has the new base (or tells us to reset)
+                if attempt == attempts - 1:
+                    raise
+                if self.readonly:
+                    self._load_retrying()
+
+    def _events_since(self, since, limit):
+        with self._cond:
+            segments = list(self._segments)
+            durable = self.durable_seq
+            compacted = self.compacted_through
+        if 0 < since < compacted:
+            return None
+        out = []
+        for seg in segments:
+            if seg.last_seq is not None and seg.last_seq <= since:
+                continue
+            for seq, payload, _ in iter_records(seg.path, seg.offset_for(since)):
+                if seq > durable:
+                    return out
+                if seq <= since:
+                    continue
+                out.append((seq, payload))
+                if len(out) >= limit:
+                    return out
+        return out
+
+    def read(self, since=0):
+        """Todos los eventos (dicts) desde ``since``, en orden."""
+        while True:
+            batch = self.events_since(since)
+            if batch is None:
+                raise ValueError(f"seq {since} was compacted; read from 0")
+            if not batch:
+                return
+            for since, payload in batch:
+                yield json.loads(payload)
+
+    # ---- compaction ----
+    def _compact_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Journal compaction failed: {e}")
+        finally:
+            with self._cond:
+                self._compacting = False
+
+    def compact_now(self):
+        """Cierra el segmento activo y pliega todos los cerrados en la base.
+
+        False si no había nada que plegar o ya hay una compactación en curso.
+        """
+        if not self.enabled:
+            raise ValueError('only the process writing the journal can compact it')
+        self.flush()
+        with self._cond:
+            if self._compacting:
+                return False
+            self._compacting = True
+        try:
+            with self._write_lock:
+                if self._active is not None and self._active.size:
+                    self._rotate(self.durable_seq + 1)
+            return self.compact(keep=0)
+        finally:
+            with self._cond:
+                self._compacting = False
+
+    def compact(self, keep=None):
+        """Pliega los segmentos cerrados más viejos (todos menos ``keep``) en una base nueva."""
+        keep = self.keep_segments if keep is None else keep
+        with self._cond:
+            closed = [s for s in self._segments if not s.base and s is not self._active]
+            victims = closed[:max(0, len(closed) - keep)]
+            if not victims:
+                return False
+            old_base = self._segments[0] if self._segments[0].base else None
+        through = victims[-1].last_seq
+        latest = {}
+        for seg in ([old_base] if old_base else []) + victims:
+            for seq, payload, _ in iter_records(seg.path):
+                if seq > through:
+                    break
+                record = json.loads(payload)
+                bet_id = record['bet']['id']
+                if record['event'] == 'deleted':
+                    latest.pop(bet_id, None)
+                else:
+                    latest[bet_id] = record
+        t0 = time.perf_counter()
+        path = os.path.join(self.path, _base_name(through))
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            for record in sorted(latest.values(), key=lambda r: r['seq']):
+                record['event'] = 'created'
+                record['bet'].pop('previous_status', None)
+                payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+                f.write(RECORD.pack(len(payload), zlib.crc32(payload), record['seq']) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        base = Segment(path, 0, base=True)
+        base.last_seq = through
+        with self._cond:
+            self._segments = [base] + [s for s in self._segments if not s.base and s not in victims]
+            self.compacted_through = through
+            self.compactions += 1
+        # readers that already opened them keep their file handles
+        for seg in ([old_base] if old_base else []) + victims:
+            os.remove(seg.path)
+        print(f"Journal compacted through seq {through}: {len(latest)} bets kept, "
+              f"{len(victims)} segments folded in {time.perf_counter() - t0:.2f}s")
+        return True
+
+    # ---- introspection ----
+    def stats(self):
+        with self._cond:
+            segments = list(self._segments)
+            stats = {
+                'last_seq': self.durable_seq,
+                'queued': len(self._pending),
+                'compacted_through': self.compacted_through,
+                'batches': self.batches,
+                'written': self.written,
+                'lost': self.lost,
+                'compactions': self.compactions,
+                'write_seconds': self.write_seconds,
+            }
+        stats['segments'] = len(segments)
+        stats['bytes'] = sum(os.path.getsize(s.path) for s in segments if os.path.exists(s.path))
+        return stats
+
+    def metrics(self):
+        """Samples in the format of ``METRICS.add_collector``."""
+        if not self.enabled:
+            return []
+        st = self.stats()
+        return [
+            ('f1_journal_last_seq', 'gauge', 'Last sequence number written to the journal.',
+             [({}, st['last_seq'])]),
+            ('f1_journal_queued', 'gauge', 'Events waiting for the writer.', [({}, st['queued'])]),
+            ('f1_journal_events_total', 'counter', 'Events written.', [({}, st['written'])]),
+            ('f1_journal_lost_events_total', 'counter', 'Events dropped by failed writes.',
+             [({}, st['lost'])]),
+            ('f1_journal_batches_total', 'counter', 'Batched writes (one fsync each).',
+             [({}, st['batches'])]),
+            ('f1_journal_write_seconds_total', 'counter', 'Time spent writing batches.',
+             [({}, st['write_seconds'])]),
+            ('f1_journal_segments', 'gauge', 'Segment files, base included.', [({}, st['segments'])]),
+            ('f1_journal_bytes', 'gauge', 'Size of the journal on disk.', [({}, st['bytes'])]),
+            ('f1_journal_compactions_total', 'counter', 'Compactions run.', [({}, st['compactions'])]),
+        ]
+
+
+JOURNAL = Journal(
+    segment_bytes=int(os.environ.get('F1_JOURNAL_SEGMENT_BYTES', SEGMENT_BYTES)),
+    keep_segments=int(os.environ.get('F1_JOURNAL_KEEP_SEGMENTS', KEEP_SEGMENTS)),
+    fsync=os.environ.get('F1_JOURNAL_FSYNC', '1') != '0',
+)
+
+
+# ---- replay ----
+def replay(journal, since=0):
+    """Reconstruye agregados a partir del journal: (trending, conteos)."""
+    from tendencias import TrendingAggregator
+
+    trending = TrendingAggregator()
+    events = Counter()
+    status = {}
+    last = since
+    for record in journal.read(since):
+        bet = record['bet']
+        trending.on_event(record['seq'], record['event'], record['user_id'], bet)
+        events[record['event']] += 1
+        if record['event'] == 'deleted':
+            status.pop(bet['id'], None)
+        else:
+            status[bet['id']] = bet.get('status') or 'pendiente'
+        last = record['seq']
+    counts = {
+        'last_seq': last,
+        'events': dict(events),
+        'bets': len(status),
+        'by_status': dict(Counter(status.values())),
+    }
+    return trending, counts
+
+
+def main():
+    import argparse
+
+    default_dir = os.path.join(os.path.dirname(os.path.abspath(
+        os.environ.get('F1_DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'f1_app.db'))),
+        'journal')
+    parser = argparse.ArgumentParser(description='Journal de eventos de apuestas')
+    # compaction belongs to the server (POST /api/journal/compact): it is
+    # the only process allowed to rewrite the directory
+    parser.add_argument('command', choices=('stats', 'replay', 'tail'))
+    parser.add_argument('--dir', default=default_dir)
+    parser.add_argument('--since', type=int, default=0)
+    parser.add_argument('-k', type=int, default=5, help='top-k para replay')
+    args = parser.parse_args()
+
+    journal = Journal()
+    # the server may be writing to it right now
+    journal.open(args.dir, readonly=True)
+    if args.command == 'stats':
+        print(json.dumps(journal.stats(), indent=2))
+    elif args.command == 'tail':
+        for record in journal.read(args.since):
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+    else:
+        t0 = time.perf_counter()
+        trending, counts = replay(journal, args.since)
+        counts['seconds'] = round(time.perf_counter() - t0, 3)
+        print(json.dumps(counts, indent=2))
+        print(json.dumps(trending.snapshot(args.k), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
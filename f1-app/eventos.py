@@ -0,0 +1,232 @@
+"""In-process pub/sub hub for bet changes + server-sent events fan-out.
+
+The write paths in registro.py call ``HUB.publish(...)`` after committing.
+Every event gets a monotonically increasing id and is kept in a bounded
+backlog so EventSource clients can resume with ``Last-Event-ID``. Ids
+restart with the process, so on the wire they carry the hub's random
+``epoch`` (``<epoch>-<n>``): an id from another process, or any id the
+backlog can't cover, is answered with a ``reset`` event.
+
+SSE connections are NOT served by a request thread: once the handler has
+written the response headers it hands the socket to the hub, and a single
+pusher thread multiplexes every subscriber with ``selectors`` (non-blocking
+writes, heartbeats, disconnect detection).
+"""
+import json
+import secrets
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+HEARTBEAT_SECONDS = 15.0
+BACKLOG_SIZE = 2048
+# drop a subscriber whose unsent buffer grows past this (slow/dead consumer)
+MAX_PENDING_BYTES = 256 * 1024
+RETRY_MS = 3000
+
+
+def format_event(event_id, event, data):
+    """Serializa un evento en formato text/event-stream."""
+    payload = json.dumps(data, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n".encode('utf-8')
+
+
+class _Subscriber:
+    __slots__ = ('sock', 'user_id', 'pending')
+
+    def __init__(self, sock, user_id):
+        self.sock = sock
+        self.user_id = user_id
+        self.pending = bytearray()
+
+
+class EventHub:
+    def __init__(self, backlog=BACKLOG_SIZE, heartbeat=HEARTBEAT_SECONDS):
+        self.heartbeat = heartbeat
+        self.epoch = secrets.token_hex(4)
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._backlog = deque(maxlen=backlog)
+        self._listeners = []
+        self._subs = {}
+        self._new_subs = []
+        self._selector = None
+        self._wake_r = self._wake_w = None
+        self._thread = None
+
+    # ---- publishing ----
+    def add_listener(self, fn):
+        """Registra un callback ``fn(event_id, event, user_id, data)`` síncrono."""
+        self._listeners.append(fn)
+
+    def publish(self, event, user_id, data):
+        with self._lock:
+            self._last_id += 1
+            event_id = self._last_id
+            self._backlog.append((event_id, event, user_id, data))
+            if self._subs or self._new_subs:
+                frame = format_event(self.sse_id(event_id), event, data)
+                # subscribers the pusher hasn't registered yet already got
+                # their replay up to the previous id: they need this one too
+                for sub in (*self._subs.values(), *self._new_subs):
+                    if sub.user_id == user_id:
+                        sub.pending += frame
+        self._wake()
+        for fn in self._listeners:
+            try:
+                fn(event_id, event, user_id, data)
+            except Exception as e:
+                print(f"Event listener failed for {event}: {e}")
+        return event_id
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def sse_id(self, event_id):
+        return f"{self.epoch}-{event_id}"
+
+    def events_since(self, last_event_id, user_id):
+        """Eventos posteriores a ``last_event_id`` (``<epoch>-<n>``) para el usuario,
+        o None si no se puede reanudar."""
+        with self._lock:
+            return self._events_since_locked(last_event_id, user_id)
+
+    def _events_since_locked(self, last_event_id, user_id):
+        epoch, _, last_id = str(last_event_id).rpartition('-')
+        if epoch != self.epoch or not last_id.isdigit():
+            # an id from a previous server process (or garbage)
+            return None
+        last_id = int(last_id)
+        if last_id > self._last_id:
+            return None
+        oldest = self._backlog[0][0] if self._backlog else self._last_id + 1
+        if last_id < oldest - 1:
+            return None
+        return [(eid, ev, data) for eid, ev, uid, data in self._backlog
+                if eid > last_id and uid == user_id]
+
+    # ---- subscribing ----
+    def subscribe(self, sock, user_id, last_event_id=None):
+        """Adopta un socket con las cabeceras SSE ya enviadas.
+
+        Replays missed events (or sends ``reset`` when the gap can't be
+        covered) and from then on the pusher thread owns the socket.
+        """
+        sub = _Subscriber(sock, user_id)
+        with self._lock:
+            sub.pending += f"retry: {RETRY_MS}\n\n".encode('ascii')
+            current = self.sse_id(self._last_id)
+            if last_event_id is None:
+                sub.pending += format_event(current, 'hello', {'last_id': current})
+            else:
+                missed = self._events_since_locked(last_event_id, user_id)
+                if missed is None:
+                    sub.pending += format_event(current, 'reset', {'last_id': current})
+                else:
+                    for eid, ev, data in missed:
+                        sub.pending += format_event(self.sse_id(eid), ev, data)
+            self._new_subs.append(sub)
+            self._ensure_thread()
+        self._wake()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subs) + len(self._new_subs)
+
+    # ---- pusher thread ----
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, name='sse-pusher', daemon=True)
+        self._thread.start()
+
+    def _wake(self):
+        if self._wake_w is None:
+            return
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run(self):
+        next_heartbeat = time.monotonic() + self.heartbeat
+        while True:
+            timeout = max(0.0, next_heartbeat - time.monotonic())
+            for key, mask in self._selector.select(timeout):
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                sub = key.data
+                if mask & selectors.EVENT_READ:
+                    # clients never send anything after the request; EOF or
+                    # error means they went away
+                    try:
+                        data = sub.sock.recv(4096)
+                    except (BlockingIOError, InterruptedError):
+                        data = b'-'
+                    except OSError:
+                        data = b''
+                    if not data:
+                        with self._lock:
+                            self._drop(sub)
+            now = time.monotonic()
+            with self._lock:
+                for sub in self._new_subs:
+                    sub.sock.setblocking(False)
+                    self._subs[sub.sock.fileno()] = sub
+                    self._selector.register(sub.sock, selectors.EVENT_READ, sub)
+                self._new_subs = []
+                if now >= next_heartbeat:
+                    for sub in self._subs.values():
+                        sub.pending += b': hb\n\n'
+                    next_heartbeat = now + self.heartbeat
+                for sub in list(self._subs.values()):
+                    self._flush(sub)
+
+    def _flush(self, sub):
+        if sub.pending:
+            try:
+                sent = sub.sock.send(sub.pending)
+                del sub.pending[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self._drop(sub)
+                return
+        if len(sub.pending) > MAX_PENDING_BYTES:
+            self._drop(sub)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if sub.pending else 0)
+        try:
+            if self._selector.get_key(sub.sock).events != events:
+                self._selector.modify(sub.sock, events, sub)
+        except (KeyError, ValueError):
+            pass
+
+    def _drop(self, sub):
+        try:
+            self._selector.unregister(sub.sock)
+        except (KeyError, ValueError):
+            pass
+        for fd, s in list(self._subs.items()):
+            if s is sub:
+                del self._subs[fd]
+        try:
+            sub.sock.close()
+        except OSError:
+            pass
+
+
+HUB = EventHub()
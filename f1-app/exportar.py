@@ -0,0 +1,210 @@
+"""Streaming exports for ``GET /api/export/{table}``.
+
+Rows are read from a SQLite cursor with ``fetchmany`` and written as soon as
+a chunk of roughly ``CHUNK_BYTES`` is encoded, so memory stays flat no
+matter how many rows the table has. The response has no Content-Length:
+HTTP/1.1 clients get ``Transfer-Encoding: chunked``, HTTP/1.0 clients get
+the body delimited by closing the connection.
+
+Formats: NDJSON (one JSON object per line, default) or CSV; either one can
+be gzip-compressed on the fly (``Accept-Encoding: gzip`` or ``?gzip=1``).
+"""
+import csv
+import io
+import json
+import zlib
+
+FETCH_ROWS = 500
+CHUNK_BYTES = 64 * 1024
+MAX_LIMIT = 10_000_000
+
+
+class ExportSpec:
+    """Una exportación: SELECT base, columnas y filtros permitidos (param -> columna)."""
+
+    def __init__(self, sql, columns, filters=None, order_by=None, group_by=None, admin=False):
+        self.sql = sql
+        self.columns = columns
+        self.filters = filters or {}
+        self.order_by = order_by
+        self.group_by = group_by
+        self.admin = admin
+
+    def build_query(self, params, limit=None):
+        """Devuelve (sql, args). Lanza ValueError si un filtro no es válido."""
+        where = []
+        args = []
+        for name, (column, cast) in self.filters.items():
+            value = params.get(name, [None])[0]
+            if value in (None, ''):
+                continue
+            try:
+                args.append(cast(value))
+            except ValueError:
+                raise ValueError(f"Filtro inválido: {name}")
+            where.append(f"{column} = ?")
+        sql = self.sql
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if self.group_by:
+            sql += ' GROUP BY ' + self.group_by
+        if self.order_by:
+            sql += ' ORDER BY ' + self.order_by
+        if limit is not None:
+            sql += ' LIMIT ?'
+            args.append(limit)
+        return sql, args
+
+
+EXPORTS = {
+    'race_results': ExportSpec(
+        'SELECT id, season, track, position, car_no, driver, team, starting_grid, laps, '
+        'time_retired, points, plus1pt, fastest_lap, fastest_lap_time FROM ref.race_results',
+        ['id', 'season', 'track', 'position', 'car_no', 'driver', 'team', 'starting_grid', 'laps',
+         'time_retired', 'points', 'plus1pt', 'fastest_lap', 'fastest_lap_time'],
+        filters={'season': ('season', int), 'track': ('track', str),
+                 'driver': ('driver', str), 'team': ('team', str)},
+        order_by='id',
+    ),
+    'drivers': ExportSpec(
+        'SELECT id, season, pos, name, nationality, team, pts FROM ref.drivers',
+        ['id', 'season', 'pos', 'name', 'nationality', 'team', 'pts'],
+        filters={'season': ('season', int), 'team': ('team', str)},
+        order_by='id',
+    ),
+    'constructors': ExportSpec(
+        'SELECT id, season, pos, team, pts FROM ref.constructors',
+        ['id', 'season', 'pos', 'team', 'pts'],
+        filters={'season': ('season', int)},
+        order_by='id',
+    ),
+    'resultados': ExportSpec(
+        'SELECT id, season, grand_prix, winner, team, laps, time FROM ref.resultados',
+        ['id', 'season', 'grand_prix', 'winner', 'team', 'laps', 'time'],
+        filters={'season': ('season', int), 'winner': ('winner', str)},
+        order_by='id',
+    ),
+    # aggregated per driver and season from race_results
+    'driver_stats': ExportSpec(
+        "SELECT season, driver, COUNT(*), COUNT(CASE WHEN position = '1' THEN 1 END), "
+        "COUNT(CASE WHEN position IN ('1', '2', '3') THEN 1 END), TOTAL(points), "
+        "COUNT(CASE WHEN plus1pt = 'Yes' THEN 1 END) FROM ref.race_results",
+        ['season', 'driver', 'races', 'wins', 'podiums', 'points', 'plus1pt'],
+        filters={'season': ('season', int), 'driver': ('driver', str)},
+        group_by='season, driver',
+        order_by='season, driver',
+    ),
+    'apuestas_top3': ExportSpec(
+        'SELECT id, user_id, top1_driver_id, top2_driver_id, top3_driver_id, status, created_at '
+        'FROM apuestas_top3',
+        ['id', 'user_id', 'top1_driver_id', 'top2_driver_id', 'top3_driver_id', 'status', 'created_at'],
+        filters={'user_id': ('user_id', int), 'status': ('status', str)},
+        order_by='id',
+        admin=True,
+    ),
+}
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+class ChunkedWriter:
+    """Encodes writes as HTTP/1.1 chunks; ``close()`` sends the last chunk."""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, data):
+        if data:
+            self.raw.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def close(self):
+        self.raw.write(b'0\r\n\r\n')
+        self.raw.flush()
+
+
+class _PlainWriter:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, data):
+        if data:
+            self.raw.write(data)
+
+    def close(self):
+        self.raw.flush()
+
+
+class GzipWriter:
+    """Compresses on the fly in front of another writer (gzip container)."""
+
+    def __init__(self, inner, level=6):
+        self.inner = inner
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def write(self, data):
+        self.inner.write(self._z.compress(data))
+
+    def close(self):
+        self.inner.write(self._z.flush())
+        self.inner.close()
+
+
+def _ndjson_encoder(columns):
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    def encode(rows):
+        return ''.join(dumps(dict(zip(columns, row))) + '\n' for row in rows).encode('utf-8')
+    return encode, None
+
+
+def _csv_encoder(columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+
+    def encode(rows):
+        writer.writerows(rows)
+        data = buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+        return data
+
+    writer.writerow(columns)
+    header = buf.getvalue().encode('utf-8')
+    buf.seek(0)
+    buf.truncate()
+    return encode, header
+
+
+ENCODERS = {'ndjson': _ndjson_encoder, 'csv': _csv_encoder}
+
+
+def open_writer(raw, chunked, gzip):
+    writer = ChunkedWriter(raw) if chunked else _PlainWriter(raw)
+    return GzipWriter(writer) if gzip else writer
+
+
+def stream_rows(cur, columns, fmt, writer):
+    """Escribe todas las filas del cursor ya ejecutado. Devuelve la cantidad de filas."""
+    encode, header = ENCODERS[fmt](columns)
+    pending = [header] if header else []
+    size = len(header or b'')
+    total = 0
+    while True:
+        rows = cur.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        total += len(rows)
+        data = encode(rows)
+        pending.append(data)
+        size += len(data)
+        if size >= CHUNK_BYTES:
+            writer.write(b''.join(pending))
+            pending = []
+            size = 0
+    if pending:
+        writer.write(b''.join(pending))
+    writer.close()
+    return total
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Genera CSVs sintéticos (pilotos, constructores, ganadores, resultados de carrera)
+con los mismos formatos de cabecera que aceptan los importadores de createDB.py.
+
+Cubre las variantes que existen en los CSVs reales: ``POS.``/``PTS.``,
+``Seson`` en vez de ``Season``, ``+1 Pt``, ``Set Fastest Lap`` y nombres con
+espacios duros (NBSP). Sirve para escalar a millones de filas.
+
+Run with: py -3 generar_datos.py --race-rows 1000000 --out datos_bench
+"""
+import argparse
+import csv
+import os
+import random
+
+FIRST_NAMES = ['Max', 'Lewis', 'Charles', 'Lando', 'Carlos', 'George', 'Fernando', 'Oscar', 'Sergio',
+               'Pierre', 'Esteban', 'Valtteri', 'Yuki', 'Alexander', 'Nico', 'Kevin', 'Daniel', 'Logan',
+               'Lance', 'Zhou', 'Oliver', 'Franco', 'Liam', 'Kimi', 'Gabriel', 'Isack', 'Jack']
+LAST_NAMES = ['Verstappen', 'Hamilton', 'Leclerc', 'Norris', 'Sainz', 'Russell', 'Alonso', 'Piastri',
+              'Perez', 'Gasly', 'Ocon', 'Bottas', 'Tsunoda', 'Albon', 'Hulkenberg', 'Magnussen',
+              'Ricciardo', 'Sargeant', 'Stroll', 'Guanyu', 'Bearman', 'Colapinto', 'Lawson',
+              'Antonelli', 'Bortoleto', 'Hadjar', 'Doohan']
+NATIONALITIES = ['NED', 'GBR', 'MON', 'ESP', 'AUS', 'MEX', 'FRA', 'FIN', 'JPN', 'THA', 'GER', 'DEN',
+                 'USA', 'CAN', 'CHN', 'ARG', 'NZL', 'ITA', 'BRA']
+TEAMS = ['Red Bull Racing Honda RBPT', 'Mercedes', 'Ferrari', 'McLaren Mercedes', 'Aston Martin Aramco Mercedes',
+         'Alpine Renault', 'Williams Mercedes', 'RB Honda RBPT', 'Kick Sauber Ferrari', 'Haas Ferrari']
+TRACKS = ['Bahrain', 'Saudi Arabia', 'Australia', 'Japan', 'China', 'Miami', 'Emilia Romagna', 'Monaco',
+          'Canada', 'Spain', 'Austria', 'Great Britain', 'Hungary', 'Belgium', 'Netherlands', 'Italy',
+          'Azerbaijan', 'Singapore', 'United States', 'Mexico', 'Brazil', 'Las Vegas', 'Qatar', 'Abu Dhabi']
+POINTS = [25, 18, 15, 12, 10, 8, 6, 4, 2, 1]
+
+# header variants accepted by createDB.py importers
+DRIVER_HEADERS = [
+    ['POS.', 'DRIVER', 'NATIONALITY', 'TEAM', 'PTS.', 'season'],
+    ['Pos', 'Driver', 'Nationality', 'Team', 'Pts', 'Season'],
+]
+CONSTRUCTOR_HEADERS = [
+    ['POS.', 'TEAM', 'PTS.', 'season'],
+    ['Pos', 'Team', 'Pts', 'Season'],
+]
+WINNER_HEADERS = [
+    ['GRAND PRIX', 'WINNER', 'TEAM', 'LAPS', 'TIME', 'SEASON'],
+    ['Grand Prix', 'Winner', 'Team', 'Laps', 'Time', 'Seson'],
+]
+RACE_HEADERS = {
+    'allseasons': ['Track', 'Position', 'No', 'Driver', 'Team', 'Starting Grid', 'Laps', 'Time/Retired',
+                   'Points', '+1 Pt', 'Fastest Lap', 'Season', 'Set Fastest Lap', 'Fastest Lap Time'],
+    'season': ['Track', 'Position', 'No', 'Driver', 'Team', 'Starting Grid', 'Laps', 'Time/Retired',
+               'Points', 'Set Fastest Lap', 'Fastest Lap Time'],
+}
+
+
+def nbsp(rng, name, ratio=0.05):
+    """Mete un espacio duro en algunos nombres, como en los CSVs scrapeados."""
+    return name.replace(' ', '\xa0', 1) if rng.random() < ratio else name
+
+
+def driver_pool(count, rng):
+    names = []
+    seen = set()
+    while len(names) < count:
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        if len(seen) >= len(FIRST_NAMES) * len(LAST_NAMES):
+            name = f"{name} {len(names)}"
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def lap_time(rng):
+    return f"1:{rng.randint(20, 40):02d}.{rng.randint(0, 999):03d}"
+
+
+def race_time(rng):
+    return f"1:{rng.randint(25, 59):02d}:{rng.randint(0, 59):02d}.{rng.randint(0, 999):03d}"
+
+
+def write_drivers(path, rows, rng, variant=0):
+    seasons = max(1, rows // 20)
+    names = driver_pool(max(20, rows // seasons + 5), rng)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(DRIVER_HEADERS[variant])
+        written = 0
+        for s in range(seasons):
+            season = 2025 - s
+            for pos, name in enumerate(rng.sample(names, min(len(names), 20)), 1):
+                if written >= rows:
+                    return written
+                pts = max(0, 600 - pos * 28 + rng.randint(-20, 20))
+                w.writerow([pos, nbsp(rng, name), rng.choice(NATIONALITIES), rng.choice(TEAMS), pts, season])
+                written += 1
+    return written
+
+
+def write_constructors(path, rows, rng, variant=0):
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(CONSTRUCTOR_HEADERS[variant])
+        season = 2025
+        while written < rows:
+            for pos, team in enumerate(rng.sample(TEAMS, len(TEAMS)), 1):
+                if written >= rows:
+                    break
+                w.writerow([pos, nbsp(rng, team), max(0, 900 - pos * 85 + rng.randint(-30, 30)), season])
+                written += 1
+            season -= 1
+    return written
+
+
+def _track_names(races_per_season):
+    # beyond the real calendar, invent extra rounds ("Monaco 2", ...) to scale up
+    names = list(TRACKS)
+    k = 2
+    while len(names) < races_per_season:
+        names.extend(f"{t} {k}" for t in TRACKS)
+        k += 1
+    return names[:races_per_season]
+
+
+def write_winners(path, rows, rng, variant=0):
+    seasons = max(1, min(76, rows // len(TRACKS) or 1))
+    tracks = _track_names(-(-rows // seasons))
+    drivers = driver_pool(40, rng)
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(WINNER_HEADERS[variant])
+        for s in range(seasons):
+            for track in tracks:
+                if written >= rows:
+                    return written
+                w.writerow([nbsp(rng, track), nbsp(rng, rng.choice(drivers)), rng.choice(TEAMS),
+                            rng.randint(44, 78), race_time(rng), 2025 - s])
+                written += 1
+    return written
+
+
+def write_race_results(path, rows, rng, variant='allseasons', grid=20):
+    races = -(-rows // grid)
+    seasons = 1 if variant == 'season' else max(1, min(76, races // len(TRACKS) or 1))
+    tracks = _track_names(-(-races // seasons))
+    drivers = driver_pool(max(grid, 60), rng)
+    header = RACE_HEADERS[variant]
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        for s in range(seasons):
+            season = 2025 - s
+            for track in tracks:
+                field = rng.sample(drivers, grid)
+                fastest = rng.randrange(grid)
+                laps = rng.randint(44, 78)
+                for i, driver in enumerate(field):
+                    if written >= rows:
+                        return written
+                    finished = rng.random() > 0.08
+                    position = str(i + 1) if finished else rng.choice(('NC', 'DQ'))
+                    points = POINTS[i] if finished and i < len(POINTS) else 0
+                    plus1 = 'Yes' if i == fastest and points else 'No'
+                    row = {
+                        'Track': nbsp(rng, track),
+                        'Position': position,
+                        'No': str(i + 1 + (s * 7) % 80),
+                        'Driver': nbsp(rng, driver),
+                        'Team': rng.choice(TEAMS),
+                        'Starting Grid': rng.randint(1, grid),
+                        'Laps': laps if finished else rng.randint(0, laps - 1),
+                        'Time/Retired': race_time(rng) if i == 0 else (f"+{rng.uniform(0.1, 90):.3f}" if finished else 'DNF'),
+                        'Points': points + (1 if plus1 == 'Yes' else 0),
+                        '+1 Pt': plus1,
+                        'Fastest Lap': lap_time(rng),
+                        'Season': season,
+                        'Set Fastest Lap': 'Yes' if i == fastest else 'No',
+                        'Fastest Lap Time': lap_time(rng) if variant == 'season' else '',
+                    }
+                    w.writerow([row[h] for h in header])
+                    written += 1
+    return written
+
+
+def generate(out_dir, race_rows, seed=1):
+    """Genera un juego completo de CSVs. Devuelve {nombre: (ruta, filas)}."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    small = max(20, race_rows // 50)
+    files = {}
+
+    def add(name, fn, rows, *args):
+        path = os.path.join(out_dir, name)
+        files[name] = (path, fn(path, rows, rng, *args))
+
+    add('pilotos.csv', write_drivers, small, 0)
+    add('pilotos_variante.csv', write_drivers, small, 1)
+    add('constructores.csv', write_constructors, max(10, small // 2), 0)
+    add('ganadores.csv', write_winners, small, 0)
+    add('ganadores_seson.csv', write_winners, small, 1)
+    add('race_results_allseasons.csv', write_race_results, race_rows, 'allseasons')
+    add('race_results_season.csv', write_race_results, max(20, race_rows // 20), 'season')
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera CSVs sintéticos para createDB.py')
+    parser.add_argument('--race-rows', type=int, default=100_000, help='filas de race_results (all seasons)')
+    parser.add_argument('--out', default='datos_bench')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    for name, (path, rows) in generate(args.out, args.race_rows, args.seed).items():
+        print(f"{rows:>10} rows  {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,21 @@
 // apuestas.js - frontend helpers for apuestas.html
 // Loads pilotos from the apuestas API and populates the TOP3 selects.
 const API_BASE = 'http://127.0.0.1:5500';
+// signed session token from /login; the server takes the user from it
+function authHeaders(extra = {}){
+  const token = localStorage.getItem('auth_token');
+  return token ? { ...extra, Authorization: `Bearer ${token}` } : extra;
+}
 let top3Form;
 let top3Alert;
 let misApuestasList;
 let misApuestasEmpty;
 let misApuestasAlert;
+// Mis Apuestas state, kept up to date by the /apuestas/stream deltas
+let misApuestas = [];
+let misApuestasLoaded = false;
+let apuestasStream = null;
+let apuestasStreamOpening = false;
 
 document.addEventListener('DOMContentLoaded', () => {
   top3Form = document.getElementById('form-top3');
@@ -16,10 +26,15 @@ document.addEventListener('DOMContentLoaded', () => {
 
   loadPilotos();
   loadMisApuestas();
+  startApuestasStream();
   const tabTop3 = document.getElementById('tab-top3');
   if (tabTop3) tabTop3.addEventListener('shown.bs.tab', loadPilotos);
   const tabMis = document.getElementById('tab-mis');
-  if (tabMis) tabMis.addEventListener('shown.bs.tab', () => loadMisApuestas());
+  if (tabMis) tabMis.addEventListener('shown.bs.tab', () => {
+    // with a live stream the local list is already current
+    if (apuestasStream && misApuestasLoaded) renderMisApuestas(misApuestas);
+    else loadMisApuestas();
+  });
 
   initCustomSelects();
   preventDuplicates();
@@ -88,8 +103,7 @@ function preventDuplicates(selectIds = ['top1','top2','top3']){
 async function handleTop3Submit(event){
   event.preventDefault();
   hideAlert(top3Alert);
-  const userId = localStorage.getItem('user_id');
-  if (!userId) {
+  if (!localStorage.getItem('auth_token')) {
     showAlert(top3Alert, 'Debes iniciar sesión para guardar una apuesta.', 'warning');
     return;
   }
@@ -105,14 +119,13 @@ async function handleTop3Submit(event){
 
   try {
     const payload = {
-      user_id: Number(userId),
       top1: Number(selections[0]),
       top2: Number(selections[1]),
       top3: Number(selections[2]),
     };
     const res = await fetch(`${API_BASE}/apuestas/top3`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.stringify(payload),
     });
     const data = await res.json().catch(() => ({}));
@@ -148,18 +161,19 @@ function resetTop3Selections(){
 async function loadMisApuestas(options = {}){
   const { preserveAlert = false } = options;
   if (!misApuestasList || !misApuestasEmpty) return;
-  const userId = localStorage.getItem('user_id');
-  if (!userId) {
+  if (!localStorage.getItem('auth_token')) {
     renderMisApuestas([]);
     showAlert(misApuestasAlert, 'Inicia sesión para ver tus apuestas guardadas.', 'info');
     return;
   }
   if (!preserveAlert) hideAlert(misApuestasAlert);
   try {
-    const res = await fetch(`${API_BASE}/apuestas/top3?user_id=${encodeURIComponent(userId)}`);
+    const res = await fetch(`${API_BASE}/apuestas/top3`, { headers: authHeaders() });
     const data = await res.json();
     if (res.ok && data.success) {
-      renderMisApuestas(data.apuestas || []);
+      misApuestas = data.apuestas || [];
+      misApuestasLoaded = true;
+      renderMisApuestas(misApuestas);
     } else {
       renderMisApuestas([]);
       showAlert(misApuestasAlert, data.message || 'No se pudieron cargar las apuestas.', 'danger');
@@ -272,8 +286,7 @@ function goToPayment(betId){
 }
 
 async function deleteBet(betId){
-  const userId = localStorage.getItem('user_id');
-  if (!userId) {
+  if (!localStorage.getItem('auth_token')) {
     showAlert(misApuestasAlert, 'Debes iniciar sesión para gestionar tus apuestas.', 'warning');
     return;
   }
@@ -282,13 +295,18 @@ async function deleteBet(betId){
   if (!confirmed) return;
 
   try {
-    const res = await fetch(`${API_BASE}/apuestas/top3?bet_id=${encodeURIComponent(betId)}&user_id=${encodeURIComponent(userId)}`, {
+    const res = await fetch(`${API_BASE}/apuestas/top3?bet_id=${encodeURIComponent(betId)}`, {
       method: 'DELETE',
+      headers: authHeaders(),
     });
     const data = await res.json();
     if (res.ok && data.success) {
       showAlert(misApuestasAlert, 'Apuesta eliminada correctamente.', 'success');
-      loadMisApuestas({ preserveAlert: true });
+      if (apuestasStream) {
+        applyApuestaEvent('deleted', { id: betId });
+      } else {
+        loadMisApuestas({ preserveAlert: true });
+      }
     } else {
       showAlert(misApuestasAlert, data.message || 'No se pudo borrar la apuesta.', 'danger');
     }
@@ -298,6 +316,71 @@ async function deleteBet(betId){
   }
 }
 
+/* ---------- Live updates (server-sent events) ---------- */
+// EventSource can't set headers: the stream takes a short-lived ticket
+// (never the session token) in the query string
+async function openBetStream(lastEventId){
+  const res = await fetch(`${API_BASE}/apuestas/stream/ticket`, { method: 'POST', headers: authHeaders() });
+  const data = await res.json();
+  if (!res.ok || !data.success) return null;
+  let url = `${API_BASE}/apuestas/stream?ticket=${encodeURIComponent(data.ticket)}`;
+  if (lastEventId) url += `&last_event_id=${encodeURIComponent(lastEventId)}`;
+  return new EventSource(url);
+}
+
+async function startApuestasStream(lastEventId){
+  if (!localStorage.getItem('auth_token') || !window.EventSource || apuestasStream || apuestasStreamOpening) return;
+  apuestasStreamOpening = true;
+  let stream;
+  try {
+    stream = await openBetStream(lastEventId);
+  } catch (err) {
+    console.error('Could not open the bet stream', err);
+  } finally {
+    apuestasStreamOpening = false;
+  }
+  if (!stream) return;
+  apuestasStream = stream;
+  ['created', 'status', 'settled', 'deleted'].forEach(type => {
+    stream.addEventListener(type, (ev) => {
+      lastEventId = ev.lastEventId || lastEventId;
+      try {
+        applyApuestaEvent(type, JSON.parse(ev.data));
+      } catch (err) {
+        console.error('Bad stream event', err);
+      }
+    });
+  });
+  stream.addEventListener('hello', (ev) => { lastEventId = ev.lastEventId || lastEventId; });
+  // the server could not replay what we missed: fall back to a full reload
+  stream.addEventListener('reset', (ev) => {
+    lastEventId = ev.lastEventId || lastEventId;
+    loadMisApuestas({ preserveAlert: true });
+  });
+  // once the ticket expires the browser's own reconnect is refused: get a new one
+  stream.addEventListener('error', () => {
+    if (stream.readyState !== EventSource.CLOSED) return;
+    apuestasStream = null;
+    setTimeout(() => startApuestasStream(lastEventId), 3000);
+  });
+}
+
+function applyApuestaEvent(type, bet){
+  if (!bet || bet.id == null) return;
+  const id = Number(bet.id);
+  const idx = misApuestas.findIndex(ap => Number(ap.id) === id);
+  if (type === 'deleted') {
+    if (idx !== -1) misApuestas.splice(idx, 1);
+  } else if (type === 'created') {
+    if (idx === -1) misApuestas.unshift(bet);
+  } else if (idx !== -1) {
+    misApuestas[idx] = Object.assign({}, misApuestas[idx], bet);
+  } else {
+    misApuestas.unshift(bet);
+  }
+  if (misApuestasLoaded) renderMisApuestas(misApuestas);
+}
+
 /* ---------- Custom select helpers ---------- */
 function initCustomSelects(){
   const customs = document.querySelectorAll('.custom-select');
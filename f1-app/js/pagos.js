@@ -1,4 +1,9 @@
 const API_BASE = 'http://127.0.0.1:5500';
+// signed session token from /login; the server takes the user from it
+function authHeaders(extra = {}){
+  const token = localStorage.getItem('auth_token');
+  return token ? { ...extra, Authorization: `Bearer ${token}` } : extra;
+}
 let paymentAlert;
 let betSummary;
 let paymentForm;
@@ -27,12 +32,69 @@ document.addEventListener('DOMContentLoaded', () => {
   if (btnRechazar) btnRechazar.addEventListener('click', () => updateStatus('rechazada'));
 
   fetchBetDetail(betId);
+  followBetStatus(betId);
 });
 
+// EventSource can't set headers: the stream takes a short-lived ticket
+// (never the session token) in the query string
+async function openBetStream(lastEventId){
+  const res = await fetch(`${API_BASE}/apuestas/stream/ticket`, { method: 'POST', headers: authHeaders() });
+  const data = await res.json();
+  if(!res.ok || !data.success) return null;
+  let url = `${API_BASE}/apuestas/stream?ticket=${encodeURIComponent(data.ticket)}`;
+  if(lastEventId) url += `&last_event_id=${encodeURIComponent(lastEventId)}`;
+  return new EventSource(url);
+}
+
+// Follow status changes made elsewhere (another tab, an admin) without polling
+async function followBetStatus(betId, lastEventId){
+  if(!localStorage.getItem('auth_token') || !window.EventSource) return;
+  let stream;
+  try{ stream = await openBetStream(lastEventId); }catch(err){ return; }
+  if(!stream) return;
+  let done = false;
+  const finish = () => { done = true; stream.close(); };
+  const onChange = (ev) => {
+    lastEventId = ev.lastEventId || lastEventId;
+    let bet;
+    try{ bet = JSON.parse(ev.data); }catch(err){ return; }
+    if(!bet || Number(bet.id) !== Number(betId)) return;
+    betData = Object.assign({}, betData, bet);
+    renderBet();
+    if(ev.type === 'settled') finish();
+  };
+  stream.addEventListener('hello', (ev) => { lastEventId = ev.lastEventId || lastEventId; });
+  stream.addEventListener('created', (ev) => { lastEventId = ev.lastEventId || lastEventId; });
+  stream.addEventListener('status', onChange);
+  stream.addEventListener('settled', onChange);
+  stream.addEventListener('deleted', (ev) => {
+    lastEventId = ev.lastEventId || lastEventId;
+    let bet;
+    try{ bet = JSON.parse(ev.data); }catch(err){ return; }
+    if(bet && Number(bet.id) === Number(betId)){
+      finish();
+      paymentForm?.classList.add('d-none');
+      localStorage.removeItem('pending_bet_id');
+      showAlert('La apuesta fue eliminada.', 'warning');
+    }
+  });
+  stream.addEventListener('reset', (ev) => {
+    lastEventId = ev.lastEventId || lastEventId;
+    fetchBetDetail(betId);
+  });
+  // once the ticket expires the browser's own reconnect is refused: get a new one
+  stream.addEventListener('error', () => {
+    if(done || stream.readyState !== EventSource.CLOSED) return;
+    setTimeout(() => followBetStatus(betId, lastEventId), 3000);
+  });
+}
+
 async function fetchBetDetail(betId){
   showAlert('Cargando información de la apuesta...', 'info');
   try{
-    const res = await fetch(`${API_BASE}/apuestas/top3/detalle?bet_id=${encodeURIComponent(betId)}`);
+    const res = await fetch(`${API_BASE}/apuestas/top3/detalle?bet_id=${encodeURIComponent(betId)}`, {
+      headers: authHeaders(),
+    });
     const data = await res.json();
     if(res.ok && data.success){
       betData = data.bet;
@@ -73,8 +135,7 @@ function renderBet(){
 
 async function updateStatus(newStatus){
   if(!betData) return;
-  const userId = Number(localStorage.getItem('user_id') || 0);
-  if(!userId){
+  if(!localStorage.getItem('auth_token')){
     showAlert('Debes iniciar sesión nuevamente para continuar.', 'warning');
     return;
   }
@@ -83,12 +144,11 @@ async function updateStatus(newStatus){
   try{
     const payload = {
       bet_id: betData.id,
-      user_id: userId,
       status: newStatus,
     };
     const res = await fetch(`${API_BASE}/apuestas/top3/status`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.stringify(payload),
     });
     const data = await res.json();
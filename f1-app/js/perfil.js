@@ -1,5 +1,10 @@
 // perfil.js - manejo del formulario de cambio de contraseña
 const API_BASE = 'http://127.0.0.1:5500';
+// signed session token from /login; the server takes the user from it
+function authHeaders(extra = {}){
+  const token = localStorage.getItem('auth_token');
+  return token ? { ...extra, Authorization: `Bearer ${token}` } : extra;
+}
 
 const form = document.getElementById('perfilForm');
 const currentPassword = document.getElementById('currentPassword');
@@ -66,8 +71,7 @@ if (form) {
     }
 
     // Verificar que el usuario esté logueado
-    const userId = localStorage.getItem('user_id');
-    if (!userId) {
+    if (!localStorage.getItem('auth_token')) {
       showAlert('Debes iniciar sesión para cambiar tu contraseña.', 'warning');
       return;
     }
@@ -77,20 +81,21 @@ if (form) {
 
     try {
       const payload = {
-        user_id: Number(userId),
         current_password: currentPwd,
         new_password: newPwd
       };
 
       const res = await fetch(`${API_BASE}/change-password`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders({ 'Content-Type': 'application/json' }),
         body: JSON.stringify(payload)
       });
 
       const data = await res.json().catch(() => ({}));
 
       if (res.ok && data.success) {
+        // other sessions were logged out; keep this one with the new token
+        if (data.token) localStorage.setItem('auth_token', data.token);
         showAlert('Contraseña actualizada correctamente.', 'success');
         form.reset();
         form.classList.remove('was-validated');
@@ -0,0 +1,161 @@
+"""In-memory token-bucket rate limiting.
+
+Each ``Rule`` (``per_minute`` tokens, up to ``burst``) owns one bucket per
+key (client IP, account email or user id). ``take()`` refills the bucket
+from the time elapsed since its last use and spends one token: two floats
+in a dict entry, O(1) per call. ``take_all()`` does the same for every
+rule of a request at once and spends nothing unless all of them allow it.
+
+A bucket left alone long enough to be full again is indistinguishable
+from a missing one, so it can be dropped. Buckets are scheduled once, at
+creation, on a hashed timer wheel at the time they would be full; when
+their slot comes up they are deleted, or rescheduled if they were used in
+the meantime. The wheel is advanced from ``take()`` itself (at most once
+per tick), so there is no sweeper thread and no full scan of the table.
+"""
+import math
+import threading
+import time
+
+
+class Rule:
+    __slots__ = ('name', 'key', 'rate', 'burst', 'allowed', 'throttled')
+
+    def __init__(self, name, key, per_minute, burst):
+        self.name = name
+        # what the bucket is keyed by: 'ip' or 'account'
+        self.key = key
+        self.rate = per_minute / 60.0
+        self.burst = float(burst)
+        self.allowed = 0
+        self.throttled = 0
+
+
+class TimerWheel:
+    """``schedule(item, when)`` en O(1); ``advance(now)`` devuelve los vencidos.
+
+    Times past the horizon (``slots * tick``) land in the farthest slot;
+    the caller re-checks whatever comes out and reschedules it.
+    """
+
+    def __init__(self, tick=1.0, slots=512):
+        self.tick = tick
+        self.slots = slots
+        self._wheel = [[] for _ in range(slots)]
+        self._current = None
+
+    def schedule(self, item, when):
+        t = math.ceil(when / self.tick)
+        if self._current is not None:
+            t = min(max(t, self._current + 1), self._current + self.slots - 1)
+        self._wheel[t % self.slots].append(item)
+
+    def advance(self, now):
+        target = int(now // self.tick)
+        if self._current is None:
+            self._current = target
+            return []
+        due = []
+        # a gap longer than the wheel still visits every slot only once
+        for t in range(self._current + 1, min(target, self._current + self.slots) + 1):
+            slot = self._wheel[t % self.slots]
+            if slot:
+                due.extend(slot)
+                slot.clear()
+        self._current = max(self._current, target)
+        return due
+
+
+class RateLimiter:
+    def __init__(self, tick=1.0, slots=512, clock=time.monotonic):
+        self.enabled = True
+        self.rules = {}
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (rule name, key) -> [tokens, updated_at]
+        self._buckets = {}
+        self._wheel = TimerWheel(tick, slots)
+        self._next_tick = 0.0
+        self.evicted = 0
+
+    def add_rule(self, name, key, per_minute, burst):
+        rule = self.rules[name] = Rule(name, key, per_minute, burst)
+        return rule
+
+    def take(self, rule, key, cost=1):
+        """0 si hay tokens (y los gasta); si no, segundos hasta que alcancen."""
+        return self.take_all(((rule, key),), cost)
+
+    def take_all(self, pairs, cost=1):
+        """Como ``take`` para varios ``(rule, key)``: gasta en todos o en ninguno.
+
+        Returns the longest wait among the buckets that are short.
+        """
+        now = self._clock()
+        with self._lock:
+            if now >= self._next_tick:
+                self._sweep(now)
+            buckets, new = [], []
+            for rule, key in pairs:
+                bucket_key = (rule.name, key)
+                bucket = self._buckets.get(bucket_key)
+                if bucket is None:
+                    bucket = self._buckets[bucket_key] = [rule.burst, now]
+                    new.append((rule, bucket_key, bucket))
+                else:
+                    bucket[0] = min(rule.burst, bucket[0] + (now - bucket[1]) * rule.rate)
+                    bucket[1] = now
+                buckets.append((rule, bucket))
+            wait = 0
+            for rule, bucket in buckets:
+                if bucket[0] < cost:
+                    rule.throttled += 1
+                    wait = max(wait, (cost - bucket[0]) / rule.rate)
+            if not wait:
+                for rule, bucket in buckets:
+                    bucket[0] -= cost
+                    rule.allowed += 1
+            for rule, bucket_key, bucket in new:
+                self._wheel.schedule(bucket_key, now + (rule.burst - bucket[0]) / rule.rate)
+        return wait
+
+    def _sweep(self, now):
+        self._next_tick = now + self._wheel.tick
+        for bucket_key in self._wheel.advance(now):
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                continue
+            rule = self.rules[bucket_key[0]]
+            full_at = bucket[1] + (rule.burst - bucket[0]) / rule.rate
+            if full_at <= now:
+                del self._buckets[bucket_key]
+                self.evicted += 1
+            else:
+                self._wheel.schedule(bucket_key, full_at)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def metrics(self):
+        """Samples in the format of ``METRICS.add_collector``."""
+        with self._lock:
+            rules = [(r.name, r.allowed, r.throttled) for r in self.rules.values()]
+            buckets = len(self._buckets)
+            evicted = self.evicted
+        return [
+            ('f1_rate_limit_allowed_total', 'counter', 'Requests that got a token, by rule.',
+             [({'rule': name}, allowed) for name, allowed, _ in rules]),
+            ('f1_rate_limit_throttled_total', 'counter', 'Requests answered with 429, by rule.',
+             [({'rule': name}, throttled) for name, _, throttled in rules]),
+            ('f1_rate_limit_buckets', 'gauge', 'Live token buckets.', [({}, buckets)]),
+            ('f1_rate_limit_evicted_total', 'counter', 'Idle buckets dropped by the timer wheel.',
+             [({}, evicted)]),
+        ]
+
+
+def retry_after(wait):
+    """Segundos enteros para el header Retry-After."""
+    return max(1, math.ceil(wait))
+
+
+LIMITER = RateLimiter()
@@ -0,0 +1,172 @@
+"""Per-route request metrics exposed in Prometheus text format (/metrics).
+
+Latencies go into HDR-style log-linear histograms: values are kept with
+``SIGNIFICANT_BITS`` bits of precision (~3% relative error) in a sparse
+dict, so recording is a couple of integer ops plus one dict update.
+Other modules can add gauges/counters with ``METRICS.add_collector``.
+"""
+import threading
+
+SIGNIFICANT_BITS = 6
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Log-linear histogram of non-negative integers (we use microseconds)."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+
+    def record(self, value):
+        value = int(value)
+        shift = value.bit_length() - SIGNIFICANT_BITS
+        if shift > 0:
+            value = (value >> shift) << shift
+        self.buckets[value] = self.buckets.get(value, 0) + 1
+        self.count += 1
+
+    def quantiles(self, qs=QUANTILES):
+        if not self.count:
+            return [float('nan') for _ in qs]
+        out = []
+        keys = sorted(self.buckets)
+        targets = [max(1, round(q * self.count)) for q in qs]
+        seen = 0
+        ti = 0
+        for k in keys:
+            seen += self.buckets[k]
+            while ti < len(targets) and seen >= targets[ti]:
+                # report the middle of the bucket
+                width = 1 << max(0, k.bit_length() - SIGNIFICANT_BITS)
+                out.append(k + (width - 1) / 2)
+                ti += 1
+        while len(out) < len(qs):
+            out.append(keys[-1])
+        return out
+
+
+class RouteStats:
+    __slots__ = ('lock', 'statuses', 'latency', 'latency_sum', 'sqlite_seconds',
+                 'bytes_out', 'in_flight')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statuses = {}
+        self.latency = Histogram()
+        self.latency_sum = 0.0
+        self.sqlite_seconds = 0.0
+        self.bytes_out = 0
+        self.in_flight = 0
+
+
+def _labels(**kw):
+    inner = ','.join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in kw.items())
+    return '{' + inner + '}' if inner else ''
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        if value != value:
+            return 'NaN'
+        return repr(round(value, 9))
+    return str(value)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._collectors = []
+
+    def _stats(self, method, route):
+        key = (method, route)
+        stats = self._routes.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._routes.setdefault(key, RouteStats())
+        return stats
+
+    def begin(self, method, route):
+        stats = self._stats(method, route)
+        with stats.lock:
+            stats.in_flight += 1
+
+    def end(self, method, route, status, seconds, sqlite_seconds, bytes_out):
+        stats = self._stats(method, route)
+        with stats.lock:
+            stats.in_flight -= 1
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.latency.record(seconds * 1e6)
+            stats.latency_sum += seconds
+            stats.sqlite_seconds += sqlite_seconds
+            stats.bytes_out += bytes_out
+
+    def add_collector(self, fn):
+        """``fn()`` devuelve [(name, type, help, [(labels_dict, value), ...]), ...]."""
+        self._collectors.append(fn)
+
+    def render(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+        # samples are (suffix, labels, value)
+        requests, latency, in_flight, sqlite_time, sent = [], [], [], [], []
+        for (method, route), st in routes:
+            base = _labels(method=method, route=route)
+            with st.lock:
+                for status, n in sorted(st.statuses.items()):
+                    requests.append(('', _labels(method=method, route=route, status=status), n))
+                for q, v in zip(QUANTILES, st.latency.quantiles()):
+                    latency.append(('', _labels(method=method, route=route, quantile=q), v / 1e6))
+                latency.append(('_sum', base, st.latency_sum))
+                latency.append(('_count', base, st.latency.count))
+                in_flight.append(('', base, st.in_flight))
+                sqlite_time.append(('', base, st.sqlite_seconds))
+                sent.append(('', base, st.bytes_out))
+
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for suffix, labels, value in samples:
+                lines.append(f'{name}{suffix}{labels} {_fmt(value)}')
+
+        family('f1_http_requests_total', 'counter', 'HTTP requests by route and status.', requests)
+        family('f1_http_request_duration_seconds', 'summary', 'Request latency.', latency)
+        family('f1_http_in_flight_requests', 'gauge', 'Requests being served.', in_flight)
+        family('f1_http_sqlite_seconds_total', 'counter', 'Time spent in SQLite.', sqlite_time)
+        family('f1_http_response_bytes_total', 'counter', 'Bytes written to clients.', sent)
+        for collector in self._collectors:
+            try:
+                for name, kind, help_text, samples in collector():
+                    family(name, kind, help_text, [('', _labels(**lbl), v) for lbl, v in samples])
+            except Exception as e:
+                lines.append(f'# collector failed: {e}')
+        return '\n'.join(lines) + '\n'
+
+
+class CountingWriter:
+    """Wraps the handler's wfile to count bytes sent."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes = 0
+
+    def write(self, data):
+        n = self.raw.write(data)
+        self.bytes += len(data)
+        return n
+
+    def flush(self):
+        return self.raw.flush()
+
+    def close(self):
+        return self.raw.close()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+
+METRICS = Metrics()
@@ -0,0 +1,263 @@
+"""Fixed-size worker pool TCP server with admission control.
+
+``ThreadingTCPServer`` starts one thread per connection with no upper
+bound. ``PooledTCPServer`` instead runs ``workers`` threads fed by a
+bounded queue:
+
+* accepted sockets wait in a selector (one classifier thread) until the
+  request line arrives, which is then peeked at with ``MSG_PEEK`` and
+  passed to ``classify(method, path)`` for a priority, 0 being the most
+  important; sockets still silent after ``peek_timeout`` are closed
+  without ever reaching a worker (idle preconnects, slowloris);
+* when the queue is full a new connection either evicts the newest queued
+  connection of a strictly lower priority or is rejected itself;
+* connections that waited longer than ``max_wait`` are dropped when a
+  worker picks them up, since the client has most likely given up;
+* rejected/dropped connections get a short ``503`` with ``Retry-After``
+  written straight from the accept loop or the worker.
+"""
+import selectors
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+
+PRIORITIES = ('high', 'normal', 'low')
+PEEK_BYTES = 1024
+SHED_RESPONSE = (
+    b'HTTP/1.0 503 Service Unavailable\r\n'
+    b'Content-Type: application/json; charset=utf-8\r\n'
+    b'Retry-After: %d\r\n'
+    b'Connection: close\r\n'
+    b'Content-Length: %d\r\n\r\n%s'
+)
+SHED_BODY = '{"success": false, "message": "Servidor ocupado, reintentá en unos segundos"}'.encode('utf-8')
+
+
+def peek_request_line(sock):
+    """(method, path) del pedido sin consumirlo; (None, None) si no se puede leer."""
+    try:
+        # MSG_DONTWAIT doesn't exist on Windows
+        sock.setblocking(False)
+        try:
+            head = sock.recv(PEEK_BYTES, socket.MSG_PEEK)
+        finally:
+            sock.setblocking(True)
+    except OSError:
+        return None, None
+    line = head.split(b'\r\n', 1)[0].split(b' ')
+    if len(line) < 2:
+        return None, None
+    path = line[1].split(b'?', 1)[0]
+    return line[0].decode('latin-1'), path.decode('latin-1')
+
+
+class PooledTCPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=16, max_queue=64,
+                 max_wait=5.0, retry_after=2, classify=None, peek_timeout=2.0,
+                 bind_and_activate=True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.classify = classify or (lambda method, path: 1)
+        self._queues = [deque() for _ in PRIORITIES]
+        self._queued = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self.busy = 0
+        self.accepted = [0] * len(PRIORITIES)
+        # (reason, priority) -> count; reason in full / evicted / timeout / idle
+        self.shed = {}
+        self.wait_seconds = 0.0
+        self.peek_timeout = peek_timeout
+        self._selector = selectors.DefaultSelector()
+        # sockets accepted but not classified yet: sock -> (address, accepted_at)
+        self._unclassified = {}
+        self._unclassified_lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._threads = [threading.Thread(target=self._classifier, name='http-classifier', daemon=True)]
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f'http-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._threads[0].start()
+
+    # ---- accept side ----
+    def process_request(self, request, client_address):
+        # don't block the accept loop waiting for the request line
+        with self._unclassified_lock:
+            self._unclassified[request] = (client_address, time.monotonic())
+            self._selector.register(request, selectors.EVENT_READ)
+        self._wakeup_w.send(b'x')
+
+    def _classifier(self):
+        while not self._stopping:
+            events = self._selector.select(self.peek_timeout / 2)
+            now = time.monotonic()
+            ready, idle = [], []
+            with self._unclassified_lock:
+                for key, _ in events:
+                    if key.fileobj is self._wakeup_r:
+                        try:
+                            self._wakeup_r.recv(4096)
+                        except BlockingIOError:
+                            pass
+                        continue
+                    ready.append(key.fileobj)
+                for sock, (_, accepted_at) in self._unclassified.items():
+                    if now - accepted_at > self.peek_timeout and sock not in ready:
+                        idle.append(sock)
+                items = []
+                for sock in ready + idle:
+                    entry = self._unclassified.pop(sock, None)
+                    if entry is None:
+                        continue
+                    self._selector.unregister(sock)
+                    items.append((sock, entry[0]))
+            for sock, address in items:
+                if sock in idle:
+                    # nothing to answer yet: a worker would just block on it
+                    with self._cond:
+                        self._count_shed('idle', 1)
+                    self.shutdown_request(sock)
+                else:
+                    self._admit(sock, address)
+
+    def _admit(self, request, client_address):
+        method, path = peek_request_line(request)
+        priority = self.classify(method, path) if method else 1
+        priority = min(max(priority, 0), len(PRIORITIES) - 1)
+        victim = None
+        with self._cond:
+            if self._queued >= self.max_queue:
+                # make room by dropping the newest queued lower-priority request
+                for p in range(len(PRIORITIES) - 1, priority, -1):
+                    if self._queues[p]:
+                        victim = (self._queues[p].pop(), p)
+                        self._queued -= 1
+                        break
+                if victim is None:
+                    self._count_shed('full', priority)
+                    rejected = True
+                else:
+                    self._count_shed('evicted', victim[1])
+                    rejected = False
+            else:
+                rejected = False
+            if not rejected:
+                self._queues[priority].append((request, client_address, time.monotonic()))
+                self._queued += 1
+                self.accepted[priority] += 1
+                self._cond.notify()
+        if victim is not None:
+            self.reject(victim[0][0])
+        if rejected:
+            self.reject(request)
+
+    def _count_shed(self, reason, priority):
+        key = (reason, PRIORITIES[priority])
+        self.shed[key] = self.shed.get(key, 0) + 1
+
+    def reject(self, request):
+        """Contesta 503 + Retry-After y cierra, sin pasar por el handler."""
+        try:
+            request.setblocking(False)
+            try:
+                # drain what the client already sent so close() doesn't RST
+                while request.recv(65536):
+                    pass
+            except (BlockingIOError, InterruptedError):
+                pass
+            request.settimeout(0.5)
+            request.sendall(SHED_RESPONSE % (self.retry_after, len(SHED_BODY), SHED_BODY))
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    # ---- worker side ----
+    def _next(self):
+        with self._cond:
+            while not self._queued and not self._stopping:
+                self._cond.wait()
+            if self._stopping:
+                return None
+            for p, q in enumerate(self._queues):
+                if q:
+                    self._queued -= 1
+                    self.busy += 1
+                    return q.popleft() + (p,)
+
+    def _worker(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            request, client_address, queued_at, priority = item
+            try:
+                waited = time.monotonic() - queued_at
+                expired = self.max_wait and waited > self.max_wait
+                with self._cond:
+                    self.wait_seconds += waited
+                    if expired:
+                        self._count_shed('timeout', priority)
+                if expired:
+                    self.reject(request)
+                    continue
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                self.shutdown_request(request)
+            finally:
+                with self._cond:
+                    self.busy -= 1
+
+    def queue_depth(self):
+        with self._cond:
+            return [len(q) for q in self._queues]
+
+    def server_close(self):
+        with self._unclassified_lock:
+            unclassified = list(self._unclassified)
+            self._unclassified.clear()
+        with self._cond:
+            self._stopping = True
+            pending = unclassified + [item[0] for q in self._queues for item in q]
+            for q in self._queues:
+                q.clear()
+            self._queued = 0
+            self._cond.notify_all()
+        self._wakeup_w.send(b'x')
+        for request in pending:
+            self.shutdown_request(request)
+        super().server_close()
+
+    def metrics(self):
+        """Samples in the format of ``METRICS.add_collector``."""
+        depth = self.queue_depth()
+        with self._cond:
+            shed = sorted(self.shed.items())
+            busy = self.busy
+            accepted = list(self.accepted)
+            wait = self.wait_seconds
+        return [
+            ('f1_pool_workers', 'gauge', 'HTTP worker threads.', [({}, self.workers)]),
+            ('f1_pool_busy_workers', 'gauge', 'Workers handling a request.', [({}, busy)]),
+            ('f1_pool_queue_depth', 'gauge', 'Connections waiting for a worker.',
+             [({'priority': name}, depth[i]) for i, name in enumerate(PRIORITIES)]),
+            ('f1_pool_queue_limit', 'gauge', 'Maximum queued connections.', [({}, self.max_queue)]),
+            ('f1_pool_accepted_total', 'counter', 'Connections admitted to the queue.',
+             [({'priority': name}, accepted[i]) for i, name in enumerate(PRIORITIES)]),
+            ('f1_pool_shed_total', 'counter', 'Connections answered with 503.',
+             [({'reason': reason, 'priority': priority}, n) for (reason, priority), n in shed]),
+            ('f1_pool_queue_wait_seconds_total', 'counter', 'Time spent queued by admitted connections.',
+             [({}, wait)]),
+        ]
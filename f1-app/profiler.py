@@ -0,0 +1,161 @@
+"""Sampled cProfile of HTTP requests.
+
+Disabled unless ``F1_PROFILE_RATE`` (0..1) or ``F1_PROFILE_ROUTE`` is set,
+or an admin turns it on through ``POST /debug/profile``. When disabled the
+handler only checks ``PROFILER.enabled``.
+
+Each profiled request is dumped as its own ``.pstats`` file in
+``F1_PROFILE_DIR`` (only the newest ``keep`` are kept) and merged into a
+rolling aggregate, written to ``aggregate.pstats`` every few requests and
+readable with ``pstats`` or via ``GET /debug/profile``.
+
+One request is profiled at a time; sampled requests that arrive while
+another is being profiled are skipped and counted
+(``f1_profile_skipped_total``). Since Python 3.12 cProfile hooks
+``sys.monitoring``, which is process-wide: a profile also contains
+whatever the other handler threads ran meanwhile, so under concurrent
+load a route's numbers include its neighbours' work. Profile one route
+(``F1_PROFILE_ROUTE``) or a quiet server when attribution matters.
+"""
+import cProfile
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+AGGREGATE_FILE = 'aggregate.pstats'
+
+
+class RequestProfiler:
+    def __init__(self, rate=0.0, route=None, out_dir=None, keep=200, aggregate_every=10):
+        self.out_dir = out_dir
+        self.keep = keep
+        self.aggregate_every = aggregate_every
+        self._lock = threading.Lock()
+        # held from start() to stop() by the request being profiled
+        self._active = threading.Lock()
+        self._aggregate = None
+        self._since_dump = 0
+        self.profiled = 0
+        self.skipped = 0
+        self.configure(rate, route)
+
+    def configure(self, rate=None, route=None):
+        """Cambia la tasa de muestreo y/o la ruta; rate=0 y route=None lo apaga."""
+        if route is not None and rate is None:
+            rate = 1.0
+        self.rate = max(0.0, min(1.0, float(rate or 0.0)))
+        self.route = route or None
+        self.enabled = self.rate > 0
+
+    def should_profile(self, route):
+        if self.route is not None and route != self.route:
+            return False
+        return self.rate >= 1.0 or random.random() < self.rate
+
+    def start(self):
+        """Un Profile ya activo, o None si hay otro pedido perfilándose."""
+        if not self._active.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            return None
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # a profiler we don't own is active (Python 3.12+ allows only one)
+            self._active.release()
+            with self._lock:
+                self.skipped += 1
+            return None
+        return prof
+
+    def stop(self, prof, method, route, seconds):
+        try:
+            prof.disable()
+        finally:
+            self._active.release()
+        with self._lock:
+            self.profiled += 1
+            if self._aggregate is None:
+                self._aggregate = pstats.Stats(prof)
+            else:
+                self._aggregate.add(prof)
+            self._since_dump += 1
+            dump_aggregate = self._since_dump >= self.aggregate_every
+            if dump_aggregate:
+                self._since_dump = 0
+        if not self.out_dir:
+            return
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+            name = f"{int(time.time() * 1000)}-{method}-{slug}-{seconds * 1000:.0f}ms.pstats"
+            prof.dump_stats(os.path.join(self.out_dir, name))
+            self._prune()
+            if dump_aggregate:
+                self.dump_aggregate()
+        except OSError as e:
+            print(f"Could not write profile: {e}")
+
+    def dump_aggregate(self):
+        with self._lock:
+            if self._aggregate is None or not self.out_dir:
+                return
+            tmp = os.path.join(self.out_dir, AGGREGATE_FILE + '.tmp')
+            self._aggregate.dump_stats(tmp)
+        os.replace(tmp, os.path.join(self.out_dir, AGGREGATE_FILE))
+
+    def _prune(self):
+        files = sorted(f for f in os.listdir(self.out_dir)
+                       if f.endswith('.pstats') and f != AGGREGATE_FILE)
+        for old in files[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.out_dir, old))
+            except OSError:
+                pass
+
+    def top_functions(self, n=25, sort='cumulative'):
+        if sort not in ('cumulative', 'tottime', 'ncalls'):
+            sort = 'cumulative'
+        with self._lock:
+            if self._aggregate is None:
+                return []
+            stats = self._aggregate.stats
+            rows = []
+            for (filename, line, func), (cc, nc, tt, ct, _callers) in stats.items():
+                rows.append({
+                    'function': f"{os.path.basename(filename)}:{line}({func})",
+                    'ncalls': nc,
+                    'tottime': round(tt, 6),
+                    'cumulative': round(ct, 6),
+                })
+        rows.sort(key=lambda r: r[sort], reverse=True)
+        return rows[:n]
+
+    def reset(self):
+        with self._lock:
+            self._aggregate = None
+            self._since_dump = 0
+            self.profiled = 0
+            self.skipped = 0
+
+    def metrics(self):
+        """Samples in the format of ``METRICS.add_collector``."""
+        with self._lock:
+            profiled, skipped = self.profiled, self.skipped
+        return [
+            ('f1_profile_requests_total', 'counter', 'Requests profiled.', [({}, profiled)]),
+            ('f1_profile_skipped_total', 'counter',
+             'Sampled requests not profiled because another one was.', [({}, skipped)]),
+        ]
+
+
+PROFILER = RequestProfiler(
+    rate=float(os.environ.get('F1_PROFILE_RATE') or 0.0) or None,
+    route=os.environ.get('F1_PROFILE_ROUTE') or None,
+    out_dir=os.environ.get('F1_PROFILE_DIR')
+    or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'),
+)
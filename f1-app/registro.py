@@ -6,39 +6,82 @@ Then open: http://127.0.0.1:5500/registro.html
 """
 import http.server
 import socketserver
-import json
 import os
 import re
 import sqlite3
-import hashlib
 import hmac
-import binascii
+import threading
+import time
 from datetime import datetime, date
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlsplit
 
-HOST = "127.0.0.1"
-PORT = 5500
+import db
+from cache import BET_CACHE, encode
+from claves import PasswordHasher, Rehasher, load_policy
+from diario import JOURNAL, READ_LIMIT
+from createDB import ensure_reference_db
+from eventos import HUB
+import exportar
+from limites import LIMITER, retry_after
+from metricas import METRICS, CountingWriter
+from pool import PooledTCPServer
+from profiler import PROFILER
+import rutas
+from rutas import SENT, HTTPError, Response
+from sesiones import SESSIONS, TICKET_TTL, InvalidToken, load_secret
+from tareas import SCHEDULER, SqliteLease
+from tendencias import TRENDING, table_digest
+
+HOST = os.environ.get('F1_HOST', "127.0.0.1")
+# F1_PORT=0 picks a free port (used by bench_carga.py)
+PORT = int(os.environ.get('F1_PORT', 5500))
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'f1_app.db')
+DB_PATH = os.environ.get('F1_DB_PATH') or os.path.join(BASE_DIR, 'f1_app.db')
+# drivers & co. live in their own file, attached read-only as "ref"
+REF_DB_PATH = os.environ.get('F1_REF_DB_PATH') or os.path.join(os.path.dirname(DB_PATH), 'f1_ref.db')
+TRENDING_STATE_PATH = os.path.join(os.path.dirname(DB_PATH), 'trending_state.json')
+# append-only bet event journal (diario.py); F1_JOURNAL=0 turns it off
+JOURNAL_DIR = os.environ.get('F1_JOURNAL_DIR') or os.path.join(os.path.dirname(DB_PATH), 'journal')
+JOURNAL_ENABLED = os.environ.get('F1_JOURNAL', '1') != '0'
+# F1_SERVER_MODE=pool: F1_WORKERS threads and at most F1_QUEUE waiting
+# connections; beyond that clients get 503 + Retry-After
+SERVER_MODE = os.environ.get('F1_SERVER_MODE', 'thread')
+SERVER_WORKERS = int(os.environ.get('F1_WORKERS', 16))
+SERVER_QUEUE = int(os.environ.get('F1_QUEUE', 64))
+# seconds a connection may stay silent mid-request before it is closed
+REQUEST_TIMEOUT = float(os.environ.get('F1_REQUEST_TIMEOUT', 10))
+# session tokens: signing key (F1_SESSION_SECRET or a generated file) and
+# revocations, both next to the DB
+SESSION_SECRET_PATH = os.path.join(os.path.dirname(DB_PATH), 'session_secret')
+SESSION_STATE_PATH = os.path.join(os.path.dirname(DB_PATH), 'sessions.json')
+SESSION_TTL = int(os.environ.get('F1_SESSION_TTL', 12 * 3600))
+# shared secret for /debug/* admin actions (X-Admin-Token); unset = disabled
+ADMIN_TOKEN = os.environ.get('F1_ADMIN_TOKEN', '')
+# F1_RATE_LIMIT=0 turns the per-IP/per-account token buckets off
+LIMITER.enabled = os.environ.get('F1_RATE_LIMIT', '1') != '0'
+# background maintenance jobs (tareas.py); F1_SCHEDULER=0 turns them off
+SCHEDULER_ENABLED = os.environ.get('F1_SCHEDULER', '1') != '0'
+# bets still 'pendiente' after this long are rejected by the expire_pending job
+PENDING_TTL_HOURS = float(os.environ.get('F1_PENDING_TTL_HOURS', 72))
+# warm_up job: bet lists of the most recently active users
+WARM_USERS = int(os.environ.get('F1_WARM_USERS', 200))
+
+# password hashing (claves.py): policy written by `python claves.py calibrate
+# --write`; F1_KDF_CONCURRENCY caps simultaneous derivations (default: CPUs)
+KDF_POLICY_PATH = os.environ.get('F1_KDF_POLICY') or os.path.join(os.path.dirname(DB_PATH), 'password_kdf.json')
+PASSWORDS = PasswordHasher(max_concurrent=int(os.environ.get('F1_KDF_CONCURRENCY', 0)) or None)
+REHASHER = Rehasher(PASSWORDS)
 
-# Password hashing using PBKDF2-HMAC-SHA256 (stdlib only)
-def hash_password(password, iterations=100_000):
-    salt = os.urandom(16)
-    dk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
-    return f"pbkdf2_sha256${iterations}${binascii.hexlify(salt).decode()}${binascii.hexlify(dk).decode()}"
+
+def hash_password(password):
+    return PASSWORDS.hash(password)
 
 def verify_password(stored, password):
-    try:
-        algo, iterations, salt_hex, dk_hex = stored.split('$')
-        iterations = int(iterations)
-        salt = binascii.unhexlify(salt_hex)
-        dk = binascii.unhexlify(dk_hex)
-        newdk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
-        return hmac.compare_digest(newdk, dk)
-    except Exception:
-        return False
+    return PASSWORDS.verify(stored, password)
 
+_QUERY_RE = re.compile(r'\?\S*')
 PWD_REGEX = re.compile(r'(?=.*[a-z])(?=.*[A-Z])(?=.*\d).{8,}')
+SETTLED_STATUSES = ('activa', 'rechazada')
 
 def ensure_usuarios_table(conn):
     cur = conn.cursor()
@@ -75,6 +118,11 @@ def ensure_apuestas_table(conn):
     ''')
     conn.commit()
     _ensure_apuestas_extra_columns(conn)
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_apuestas_top3_user ON apuestas_top3(user_id, created_at)')
+    # expire_pending job: only the (few) bets still waiting for payment
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_apuestas_top3_pendiente ON apuestas_top3(created_at) "
+                "WHERE status = 'pendiente'")
+    conn.commit()
 
 
 def _ensure_apuestas_extra_columns(conn):
@@ -85,60 +133,178 @@ def _ensure_apuestas_extra_columns(conn):
         cur.execute("ALTER TABLE apuestas_top3 ADD COLUMN status TEXT NOT NULL DEFAULT 'pendiente'")
         conn.commit()
 
+REF_WATCH = db.RefWatcher(REF_DB_PATH)
+# F1_REF_MEMORY=0 reads reference tables straight from f1_ref.db
+REF_REPLICA = db.RefReplica() if os.environ.get('F1_REF_MEMORY', '1') != '0' else None
+
+
+def _connect():
+    # a swapped-in reference file is picked up by the ATTACH below (or by
+    # the replica refresh); the watcher notices the new generation
+    REF_WATCH.check()
+    if REF_REPLICA is None:
+        return db.connect_app(DB_PATH, REF_DB_PATH)
+    # the copy can't be dropped between reading its uri and attaching it
+    ref_uri = REF_REPLICA.pin()
+    try:
+        return db.connect_app(DB_PATH, REF_DB_PATH, ref_uri=ref_uri)
+    finally:
+        REF_REPLICA.unpin(ref_uri)
+
+
+def _ref_generation_changed(generation):
+    BET_CACHE.clear()
+    SCHEDULER.trigger('warm_up')
+
+
+def start_ref_replica():
+    """Copy the reference tables into memory and reload them on every new generation."""
+    generation = REF_WATCH.check()
+    if REF_REPLICA is None:
+        # cached bets embed driver names from the reference data
+        REF_WATCH.add_listener(_ref_generation_changed)
+        return
+    try:
+        REF_REPLICA.load(REF_DB_PATH, generation)
+    except Exception as e:
+        print(f"Reference replica unavailable, reading {REF_DB_PATH}: {e}")
+    REF_WATCH.add_listener(
+        lambda gen: REF_REPLICA.refresh_async(REF_DB_PATH, gen, done=_ref_generation_changed,
+                                              current=REF_WATCH.check))
+
+
+def init_app_db():
+    """Schema and file-level pragmas, once at startup instead of per request."""
+    ensure_reference_db(DB_PATH, REF_DB_PATH)
+    conn = db.connect(DB_PATH)
+    try:
+        db.apply_pragmas(conn, db.APP_PERSISTENT_PRAGMAS)
+        ensure_usuarios_table(conn)
+        ensure_apuestas_table(conn)
+    finally:
+        conn.close()
+
+
+EXPORT_PREFIX = '/api/export/'
+# methods whose body is read (bounded) before auth, so errors never leave
+# unread bytes on the connection
+BODY_METHODS = frozenset(('POST',))
+
+
 class Handler(http.server.SimpleHTTPRequestHandler):
+    # socket timeout: a client that stops sending can't hold a thread forever
+    timeout = REQUEST_TIMEOUT
+    _metrics_route = None
+    _profile = None
+    _route = None
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        parsed = urlsplit(self.path)
+        self._path, self._query = parsed.path, parsed.query
+        # the only route lookup of the request; dispatch reuses it
+        self._route = ROUTES.match(self.command, self._path)
+        if self._route is not None:
+            self._metrics_route = self._route.path
+        else:
+            self._metrics_route = self._path if ROUTES.methods(self._path) else 'static'
+        self._status = None
+        self._t0 = time.perf_counter()
+        self._bytes0 = self.wfile.bytes
+        db.reset_request_time()
+        METRICS.begin(self.command, self._metrics_route)
+        if PROFILER.enabled and PROFILER.should_profile(self._metrics_route):
+            self._profile = PROFILER.start()
+        return True
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        finally:
+            route = self._metrics_route
+            if route is not None:
+                self._metrics_route = None
+                elapsed = time.perf_counter() - self._t0
+                if self._profile is not None:
+                    PROFILER.stop(self._profile, self.command, route, elapsed)
+                    self._profile = None
+                METRICS.end(self.command, route, self._status or 0, elapsed,
+                            db.request_time(), self.wfile.bytes - self._bytes0)
+
+    def log_message(self, format, *args):
+        # query strings may carry a stream ticket: keep them out of the log
+        args = [_QUERY_RE.sub('?<redacted>', a) if isinstance(a, str) else a for a in args]
+        super().log_message(format, *args)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
     # serve files from BASE_DIR
     def translate_path(self, path):
         # adapt to serve files relative to BASE_DIR
         # strip query
-        path = urlparse(path).path
+        path = urlsplit(path).path
         if path == '/':
             path = '/index.html'
         full = os.path.join(BASE_DIR, path.lstrip('/'))
         return full
 
     def do_GET(self):
-        parsed = urlparse(self.path)
-        if parsed.path == '/api/pilotos':
-            self._handle_pilotos()
-            return
-        if parsed.path == '/apuestas/top3':
-            self._handle_list_apuestas(parsed)
-            return
-        if parsed.path == '/apuestas/top3/detalle':
-            self._handle_apuesta_detalle(parsed)
-            return
-        return super().do_GET()
+        if self._route is None and not ROUTES.methods(self._path):
+            return super().do_GET()
+        self._dispatch()
 
     def do_POST(self):
-        if self.path == '/register':
-            self._handle_register()
-        elif self.path == '/login':
-            self._handle_login()
-        elif self.path == '/apuestas/top3':
-            self._handle_create_apuesta()
-        elif self.path == '/apuestas/top3/status':
-            self._handle_update_apuesta_status()
-        elif self.path == '/change-password':
-            self._handle_change_password()
-        else:
-            self.send_error(404, 'Not found')
+        self._dispatch()
 
     def do_DELETE(self):
-        parsed = urlparse(self.path)
-        if parsed.path == '/apuestas/top3':
-            self._handle_delete_apuesta(parsed)
-            return
-        self.send_error(404, 'Not found')
+        self._dispatch()
 
-    def _handle_register(self):
-        length = int(self.headers.get('Content-Length', 0))
-        raw = self.rfile.read(length)
-        try:
-            data = json.loads(raw.decode('utf-8'))
-        except Exception:
-            self._send_json({'success': False, 'message': 'Invalid JSON'}, status=400)
+    def do_OPTIONS(self):
+        # Respond to preflight CORS requests
+        self.send_response(200)
+        for name, value in rutas.CORS_HEADERS:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _dispatch(self):
+        route = self._route
+        if route is None:
+            allowed = ROUTES.methods(self._path)
+            response = Response.error(405 if allowed else 404,
+                                      'Método no permitido' if allowed else 'Not found')
+            if allowed:
+                response.headers.append(('Allow', ', '.join(allowed + ['OPTIONS'])))
+            # a body we don't know how to read stays on the socket
+            self.close_connection = True
+        else:
+            response = PIPELINE(rutas.Request(self, route, self._path, self._query))
+        self._send(response)
+
+    def _send(self, response):
+        if response is SENT:
             return
+        self.send_response(response.status)
+        if response.content_type:
+            self.send_header('Content-Type', response.content_type)
+        if response.status != 304:
+            # a 304's Content-Length would describe the 200 it stands for
+            self.send_header('Content-Length', str(len(response.body)))
+        for name, value in response.headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if response.body:
+            self.wfile.write(response.body)
 
+    def _handle_register(self, req):
+        data = req.json()
         nombre = (data.get('nombre') or '').strip()
         apellido = (data.get('apellido') or '').strip()
         email = (data.get('email') or '').strip().lower()
@@ -146,192 +312,128 @@ class Handler(http.server.SimpleHTTPRequestHandler):
         password = data.get('password') or ''
 
         if not nombre or not apellido or not email or not password or not fecha:
-            self._send_json({'success': False, 'message': 'Faltan campos requeridos'}, status=400)
-            return
+            return Response.error(400, 'Faltan campos requeridos')
         if not PWD_REGEX.match(password):
-            self._send_json({'success': False, 'message': 'La contraseña no cumple los requisitos'}, status=400)
-            return
+            return Response.error(400, 'La contraseña no cumple los requisitos')
         try:
             birthdate = datetime.strptime(fecha, '%Y-%m-%d').date()
         except ValueError:
-            self._send_json({'success': False, 'message': 'Fecha de nacimiento inválida'}, status=400)
-            return
+            return Response.error(400, 'Fecha de nacimiento inválida')
         today = date.today()
         if birthdate > today:
-            self._send_json({'success': False, 'message': 'La fecha de nacimiento no puede ser futura'}, status=400)
-            return
+            return Response.error(400, 'La fecha de nacimiento no puede ser futura')
         age = today.year - birthdate.year - ((today.month, today.day) < (birthdate.month, birthdate.day))
         if age < 18:
-            self._send_json({'success': False, 'message': 'Debes ser mayor de 18 años'}, status=400)
-            return
+            return Response.error(400, 'Debes ser mayor de 18 años')
 
         pwd_hash = hash_password(password)
+        conn = _connect()
         try:
-            conn = sqlite3.connect(DB_PATH)
-            ensure_usuarios_table(conn)
             cur = conn.cursor()
             cur.execute('SELECT id FROM usuarios WHERE email = ?', (email,))
             if cur.fetchone():
-                self._send_json({'success': False, 'message': 'El email ya está registrado'}, status=409)
-                return
+                return Response.error(409, 'El email ya está registrado')
             cur.execute('INSERT INTO usuarios (nombre, apellido, email, contrasena, fecha_nacimiento) VALUES (?, ?, ?, ?, ?)',
                         (nombre, apellido, email, pwd_hash, fecha))
             conn.commit()
-            self._send_json({'success': True})
-        except Exception as e:
-            self._send_json({'success': False, 'message': str(e)}, status=500)
+            return Response.json({'success': True})
         finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
-
-    def _handle_delete_apuesta(self, parsed):
-        params = parse_qs(parsed.query or '')
-        bet_id = params.get('bet_id', [None])[0]
-        user_id = params.get('user_id', [None])[0]
+            conn.close()
+
+    def _handle_delete_apuesta(self, req):
+        user_id = req.session[0]
         try:
-            bet_id = int(bet_id)
-            user_id = int(user_id)
+            bet_id = int(req.param('bet_id'))
         except (TypeError, ValueError):
-            self._send_json({'success': False, 'message': 'bet_id y user_id inválidos'}, status=400)
-            return
-        if not bet_id or not user_id:
-            self._send_json({'success': False, 'message': 'bet_id y user_id requeridos'}, status=400)
-            return
+            return Response.error(400, 'bet_id inválido')
+        if not bet_id:
+            return Response.error(400, 'bet_id requerido')
 
+        conn = _connect()
         try:
-            conn = sqlite3.connect(DB_PATH)
-            ensure_apuestas_table(conn)
             cur = conn.cursor()
-            cur.execute('SELECT id FROM apuestas_top3 WHERE id = ? AND user_id = ?', (bet_id, user_id))
-            if not cur.fetchone():
-                self._send_json({'success': False, 'message': 'Apuesta no encontrada'}, status=404)
-                return
+            bet = self._fetch_apuesta(cur, bet_id)
+            if not bet or bet['user_id'] != user_id:
+                return Response.error(404, 'Apuesta no encontrada')
             cur.execute('DELETE FROM apuestas_top3 WHERE id = ?', (bet_id,))
             conn.commit()
-            self._send_json({'success': True})
-        except Exception as e:
-            self._send_json({'success': False, 'message': str(e)}, status=500)
+            HUB.publish('deleted', user_id, bet)
+            return Response.json({'success': True})
         finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
-
-    def _handle_login(self):
-        length = int(self.headers.get('Content-Length', 0))
-        raw = self.rfile.read(length)
-        try:
-            data = json.loads(raw.decode('utf-8'))
-        except Exception:
-            self._send_json({'success': False, 'message': 'Invalid JSON'}, status=400)
-            return
+            conn.close()
 
+    def _handle_login(self, req):
+        data = req.json()
         email = (data.get('email') or '').strip().lower()
         password = data.get('password') or ''
 
         if not email or not password:
-            self._send_json({'success': False, 'message': 'Email y contraseña requeridos'}, status=400)
-            return
+            return Response.error(400, 'Email y contraseña requeridos')
 
+        conn = _connect()
         try:
-            conn = sqlite3.connect(DB_PATH)
-            ensure_usuarios_table(conn)
             cur = conn.cursor()
             cur.execute('SELECT id, nombre, apellido, contrasena FROM usuarios WHERE email = ?', (email,))
             row = cur.fetchone()
-            if not row:
-                self._send_json({'success': False, 'message': 'Email o contraseña incorrectos'}, status=401)
-                return
-            
-            user_id, nombre, apellido, pwd_hash = row
-            # debug: print partial hash and email to help troubleshoot
-            try:
-                print(f"DEBUG login attempt for {email}; stored_hash_start={pwd_hash[:40]}")
-            except Exception:
-                pass
-            ok = verify_password(pwd_hash, password)
-            print(f"DEBUG verify_password returned: {ok}")
-            if not ok:
-                self._send_json({'success': False, 'message': 'Email o contraseña incorrectos'}, status=401)
-                return
-            
-            # Login exitoso
-            self._send_json({
-                'success': True,
-                'user_id': user_id,
-                'user_name': f'{nombre} {apellido}',
-                'token': f'token_{user_id}_{email}'
-            })
-        except Exception as e:
-            self._send_json({'success': False, 'message': str(e)}, status=500)
         finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
+            conn.close()
+        if not row:
+            return Response.error(401, 'Email o contraseña incorrectos')
+
+        user_id, nombre, apellido, pwd_hash = row
+        if not verify_password(pwd_hash, password):
+            return Response.error(401, 'Email o contraseña incorrectos')
+        if PASSWORDS.needs_rehash(pwd_hash):
+            # upgraded to the current policy on REHASHER's thread
+            REHASHER.submit(user_id, pwd_hash, password)
 
-    def _handle_pilotos(self):
+        # Login exitoso
+        return Response.json({
+            'success': True,
+            'user_id': user_id,
+            'user_name': f'{nombre} {apellido}',
+            'token': SESSIONS.issue(user_id),
+            'expires_in': SESSIONS.ttl,
+        })
+
+    def _handle_pilotos(self, req):
+        conn = _connect()
         try:
-            conn = sqlite3.connect(DB_PATH)
             cur = conn.cursor()
             cur.execute("""
                 SELECT MIN(id) AS id, name
-                FROM drivers
+                FROM ref.drivers
                 GROUP BY name
                 ORDER BY name COLLATE NOCASE
             """)
             rows = cur.fetchall()
-            pilotos = [{'id': r[0], 'name': r[1]} for r in rows]
-            self._send_json({'success': True, 'pilotos': pilotos})
-        except Exception as e:
-            self._send_json({'success': False, 'message': str(e)}, status=500)
         finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
-
-    def _handle_create_apuesta(self):
-        length = int(self.headers.get('Content-Length', 0))
-        raw = self.rfile.read(length)
-        try:
-            data = json.loads(raw.decode('utf-8'))
-        except Exception:
-            self._send_json({'success': False, 'message': 'JSON inválido'}, status=400)
-            return
+            conn.close()
+        pilotos = [{'id': r[0], 'name': r[1]} for r in rows]
+        return Response.json({'success': True, 'pilotos': pilotos})
 
+    def _handle_create_apuesta(self, req):
+        user_id = req.session[0]
+        data = req.json()
         try:
-            user_id = int(data.get('user_id', 0))
             top1 = int(data.get('top1'))
             top2 = int(data.get('top2'))
             top3 = int(data.get('top3'))
         except (TypeError, ValueError):
-            self._send_json({'success': False, 'message': 'Datos inválidos'}, status=400)
-            return
+            return Response.error(400, 'Datos inválidos')
 
-        if not user_id or not top1 or not top2 or not top3:
-            self._send_json({'success': False, 'message': 'Faltan campos requeridos'}, status=400)
-            return
+        if not top1 or not top2 or not top3:
+            return Response.error(400, 'Faltan campos requeridos')
         if len({top1, top2, top3}) < 3:
-            self._send_json({'success': False, 'message': 'Los pilotos deben ser distintos'}, status=400)
-            return
+            return Response.error(400, 'Los pilotos deben ser distintos')
 
+        conn = _connect()
         try:
-            conn = sqlite3.connect(DB_PATH)
-            ensure_usuarios_table(conn)
-            ensure_apuestas_table(conn)
             cur = conn.cursor()
-            cur.execute('SELECT 1 FROM usuarios WHERE id = ?', (user_id,))
-            if not cur.fetchone():
-                self._send_json({'success': False, 'message': 'Usuario no encontrado'}, status=404)
-                return
-            cur.execute('SELECT COUNT(*) FROM drivers WHERE id IN (?, ?, ?)', (top1, top2, top3))
+            cur.execute('SELECT COUNT(*) FROM ref.drivers WHERE id IN (?, ?, ?)', (top1, top2, top3))
             count = cur.fetchone()[0]
             if count < 3:
-                self._send_json({'success': False, 'message': 'Pilotos inválidos'}, status=400)
-                return
+                return Response.error(400, 'Pilotos inválidos')
 
             cur.execute('''
                 INSERT INTO apuestas_top3 (user_id, top1_driver_id, top2_driver_id, top3_driver_id, status)
@@ -341,175 +443,289 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             conn.commit()
 
             bet = self._fetch_apuesta(cur, bet_id)
-            self._send_json({'success': True, 'bet': bet})
-        except Exception as e:
-            self._send_json({'success': False, 'message': str(e)}, status=500)
+            HUB.publish('created', user_id, bet)
+            return Response.json({'success': True, 'bet': bet})
         finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
+            conn.close()
 
-    def _handle_list_apuestas(self, parsed):
-        params = parse_qs(parsed.query or '')
-        user_id = params.get('user_id', [None])[0]
-        try:
-            user_id = int(user_id)
-        except (TypeError, ValueError):
-            self._send_json({'success': False, 'message': 'user_id requerido'}, status=400)
-            return
+    def _handle_list_apuestas(self, req):
+        user_id = req.session[0]
+        payload = BET_CACHE.lists.get(user_id)
+        if payload is not None:
+            return Response(payload)
 
+        ticket = BET_CACHE.lists.ticket(user_id)
+        conn = _connect()
         try:
-            conn = sqlite3.connect(DB_PATH)
-            ensure_apuestas_table(conn)
-            cur = conn.cursor()
-            apuestas = self._fetch_apuestas_for_user(cur, user_id)
-            self._send_json({'success': True, 'apuestas': apuestas})
-        except Exception as e:
-            self._send_json({'success': False, 'message': str(e)}, status=500)
+            apuestas = self._fetch_apuestas_for_user(conn.cursor(), user_id)
         finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
+            conn.close()
+        payload = encode({'success': True, 'apuestas': apuestas})
+        BET_CACHE.lists.put(user_id, payload, ticket)
+        return Response(payload)
 
-    def _handle_apuesta_detalle(self, parsed):
-        params = parse_qs(parsed.query or '')
-        bet_id = params.get('bet_id', [None])[0]
+    def _handle_apuesta_detalle(self, req):
+        bet_id = req.param('bet_id')
         if bet_id is None:
-            self._send_json({'success': False, 'message': 'bet_id requerido'}, status=400)
-            return
+            return Response.error(400, 'bet_id requerido')
         try:
             bet_id = int(bet_id)
         except (TypeError, ValueError):
-            self._send_json({'success': False, 'message': 'bet_id inválido'}, status=400)
-            return
+            return Response.error(400, 'bet_id inválido')
 
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            ensure_apuestas_table(conn)
-            cur = conn.cursor()
-            bet = self._fetch_apuesta(cur, bet_id)
-            if not bet:
-                self._send_json({'success': False, 'message': 'Apuesta no encontrada'}, status=404)
-                return
-            self._send_json({'success': True, 'bet': bet})
-        except Exception as e:
-            self._send_json({'success': False, 'message': str(e)}, status=500)
-        finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
+        cached = BET_CACHE.details.get(bet_id)
+        if cached is not None and cached[0] == req.session[0]:
+            return Response(cached[1])
 
-    def _handle_update_apuesta_status(self):
-        length = int(self.headers.get('Content-Length', 0))
-        raw = self.rfile.read(length)
+        ticket = BET_CACHE.details.ticket(bet_id)
+        conn = _connect()
         try:
-            data = json.loads(raw.decode('utf-8'))
-        except Exception:
-            self._send_json({'success': False, 'message': 'JSON inválido'}, status=400)
-            return
+            bet = self._fetch_apuesta(conn.cursor(), bet_id)
+        finally:
+            conn.close()
+        if not bet or bet['user_id'] != req.session[0]:
+            return Response.error(404, 'Apuesta no encontrada')
+        payload = encode({'success': True, 'bet': bet})
+        BET_CACHE.details.put(bet_id, (bet['user_id'], payload), ticket)
+        return Response(payload)
 
+    def _handle_update_apuesta_status(self, req):
+        user_id = req.session[0]
+        data = req.json()
         try:
             bet_id = int(data.get('bet_id', 0))
-            user_id = int(data.get('user_id', 0))
         except (TypeError, ValueError):
-            self._send_json({'success': False, 'message': 'Datos inválidos'}, status=400)
-            return
+            return Response.error(400, 'Datos inválidos')
         status = (data.get('status') or '').strip().lower()
         if status not in ('pendiente', 'rechazada', 'activa'):
-            self._send_json({'success': False, 'message': 'Estado inválido'}, status=400)
-            return
-        if not bet_id or not user_id:
-            self._send_json({'success': False, 'message': 'bet_id y user_id requeridos'}, status=400)
-            return
+            return Response.error(400, 'Estado inválido')
+        if not bet_id:
+            return Response.error(400, 'bet_id requerido')
 
+        conn = _connect()
         try:
-            conn = sqlite3.connect(DB_PATH)
-            ensure_apuestas_table(conn)
             cur = conn.cursor()
-            cur.execute('SELECT id FROM apuestas_top3 WHERE id = ? AND user_id = ?', (bet_id, user_id))
-            if not cur.fetchone():
-                self._send_json({'success': False, 'message': 'Apuesta no encontrada'}, status=404)
-                return
+            cur.execute('SELECT status FROM apuestas_top3 WHERE id = ? AND user_id = ?', (bet_id, user_id))
+            row = cur.fetchone()
+            if not row:
+                return Response.error(404, 'Apuesta no encontrada')
+            previous = row[0]
             cur.execute('UPDATE apuestas_top3 SET status = ? WHERE id = ?', (status, bet_id))
             conn.commit()
             bet = self._fetch_apuesta(cur, bet_id)
-            self._send_json({'success': True, 'bet': bet})
-        except Exception as e:
-            self._send_json({'success': False, 'message': str(e)}, status=500)
+            if previous != status:
+                # leaving 'pendiente' means the payment was resolved either way
+                event = 'settled' if status in SETTLED_STATUSES else 'status'
+                HUB.publish(event, user_id, dict(bet, previous_status=previous))
+            return Response.json({'success': True, 'bet': bet})
         finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
-
-    def _handle_change_password(self):
-        length = int(self.headers.get('Content-Length', 0))
-        raw = self.rfile.read(length)
-        try:
-            data = json.loads(raw.decode('utf-8'))
-        except Exception:
-            self._send_json({'success': False, 'message': 'JSON inválido'}, status=400)
-            return
-
-        try:
-            user_id = int(data.get('user_id', 0))
-        except (TypeError, ValueError):
-            self._send_json({'success': False, 'message': 'user_id inválido'}, status=400)
-            return
+            conn.close()
 
+    def _handle_change_password(self, req):
+        user_id = req.session[0]
+        data = req.json()
         current_password = data.get('current_password', '').strip()
         new_password = data.get('new_password', '').strip()
 
-        if not user_id or not current_password or not new_password:
-            self._send_json({'success': False, 'message': 'Faltan campos requeridos'}, status=400)
-            return
+        if not current_password or not new_password:
+            return Response.error(400, 'Faltan campos requeridos')
 
         if not PWD_REGEX.match(new_password):
-            self._send_json({'success': False, 'message': 'La nueva contraseña no cumple los requisitos'}, status=400)
-            return
+            return Response.error(400, 'La nueva contraseña no cumple los requisitos')
 
         if current_password == new_password:
-            self._send_json({'success': False, 'message': 'La nueva contraseña debe ser diferente a la actual'}, status=400)
-            return
+            return Response.error(400, 'La nueva contraseña debe ser diferente a la actual')
 
+        conn = _connect()
         try:
-            conn = sqlite3.connect(DB_PATH)
-            ensure_usuarios_table(conn)
             cur = conn.cursor()
             cur.execute('SELECT id, contrasena FROM usuarios WHERE id = ?', (user_id,))
             row = cur.fetchone()
             if not row:
-                self._send_json({'success': False, 'message': 'Usuario no encontrado'}, status=404)
-                return
+                return Response.error(404, 'Usuario no encontrado')
 
             stored_hash = row[1]
             if not verify_password(stored_hash, current_password):
-                self._send_json({'success': False, 'message': 'Contraseña actual incorrecta'}, status=401)
-                return
+                return Response.error(401, 'Contraseña actual incorrecta')
 
             new_hash = hash_password(new_password)
             cur.execute('UPDATE usuarios SET contrasena = ? WHERE id = ?', (new_hash, user_id))
             conn.commit()
-            self._send_json({'success': True, 'message': 'Contraseña actualizada correctamente'})
-        except Exception as e:
-            self._send_json({'success': False, 'message': str(e)}, status=500)
         finally:
+            conn.close()
+        # log out every other session; this client gets a fresh token
+        SESSIONS.revoke_user(user_id)
+        return Response.json({
+            'success': True,
+            'message': 'Contraseña actualizada correctamente',
+            'token': SESSIONS.issue(user_id),
+            'expires_in': SESSIONS.ttl,
+        })
+
+    def _handle_metrics(self, req):
+        return Response(METRICS.render().encode('utf-8'),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def _handle_debug_queries(self, req):
+        if not db.QUERY_LOG.enabled:
+            return Response.error(404, 'Query log deshabilitado (F1_QUERY_LOG=1)')
+        try:
+            n = int(req.param('n', '20'))
+        except ValueError:
+            n = 20
+        return Response.json({
+            'success': True,
+            'slow_ms': db.QUERY_LOG.slow_seconds * 1000,
+            'queries': db.QUERY_LOG.top(n, req.param('sort', 'total')),
+        })
+
+    def _handle_logout(self, req):
+        user_id, sid, expires_at = req.session
+        SESSIONS.revoke(sid, expires_at, user_id)
+        return Response.json({'success': True})
+
+    def _handle_debug_profile(self, req):
+        try:
+            n = int(req.param('n', '25'))
+        except ValueError:
+            n = 25
+        return Response.json({
+            'success': True,
+            'rate': PROFILER.rate,
+            'route': PROFILER.route,
+            'profiled': PROFILER.profiled,
+            'skipped': PROFILER.skipped,
+            'functions': PROFILER.top_functions(n, req.param('sort', 'cumulative')),
+        })
+
+    def _handle_configure_profile(self, req):
+        data = req.json()
+        try:
+            rate = data.get('rate')
+            rate = float(rate) if rate is not None else None
+        except (ValueError, TypeError):
+            return Response.error(400, 'JSON inválido')
+        if data.get('reset'):
+            PROFILER.reset()
+        PROFILER.configure(rate, data.get('route'))
+        return Response.json({'success': True, 'rate': PROFILER.rate, 'route': PROFILER.route})
+
+    def _handle_export(self, req):
+        spec = exportar.EXPORTS.get(req.path[len(EXPORT_PREFIX):])
+        if spec is None:
+            return Response.error(404, 'Exportación desconocida')
+        if spec.admin:
+            _check_admin(req)
+        params = req.query
+        fmt = req.param('format', 'ndjson')
+        if fmt not in exportar.ENCODERS:
+            return Response.error(400, 'format debe ser ndjson o csv')
+        try:
+            limit = req.param('limit')
+            limit = min(int(limit), exportar.MAX_LIMIT) if limit else None
+            sql, args = spec.build_query(params, limit)
+        except ValueError as e:
+            return Response.error(400, str(e))
+        gzip = (req.param('gzip', '0') == '1'
+                or rutas.accepts_gzip(self.headers.get('Accept-Encoding')))
+
+        conn = _connect()
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, args)
+            except sqlite3.Error as e:
+                return Response.error(500, str(e))
+            # no Content-Length: chunked for HTTP/1.1 clients, EOF-delimited
+            # for HTTP/1.0; either way this connection ends with the export
+            chunked = self.request_version == 'HTTP/1.1'
+            if chunked:
+                self.protocol_version = 'HTTP/1.1'
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header('Content-Type', exportar.CONTENT_TYPES[fmt])
+            if chunked:
+                self.send_header('Transfer-Encoding', 'chunked')
+            if gzip:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Connection', 'close')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            writer = exportar.open_writer(self.wfile, chunked, gzip)
             try:
-                conn.close()
-            except Exception:
-                pass
+                exportar.stream_rows(cur, spec.columns, fmt, writer)
+            except (sqlite3.Error, OSError) as e:
+                # headers are gone: all we can do is cut the body short
+                print(f"Export {req.path} aborted: {e}")
+            return SENT
+        finally:
+            conn.close()
 
-    def _fetch_apuestas_for_user(self, cur, user_id):
+    def _handle_journal(self, req):
+        if not JOURNAL.enabled:
+            return Response.error(404, 'Journal deshabilitado (F1_JOURNAL=0)')
+        try:
+            since = int(req.param('since', '0'))
+            limit = max(1, min(int(req.param('limit', str(READ_LIMIT))), 10 * READ_LIMIT))
+        except ValueError:
+            return Response.error(400, 'since/limit inválidos')
+        events = JOURNAL.events_since(since, limit)
+        if events is None:
+            # the consumer's position was compacted away: start over from 0
+            return Response.json({'success': True, 'reset': True, 'next': 0,
+                                  'last_seq': JOURNAL.durable_seq, 'events': []})
+        # records are stored as JSON already: splice them instead of re-encoding
+        body = b'{"success":true,"reset":false,"next":%d,"last_seq":%d,"events":[%s]}' % (
+            events[-1][0] if events else since, JOURNAL.durable_seq,
+            b','.join(payload for _, payload in events))
+        return Response(body)
+
+    def _handle_journal_compact(self, req):
+        if not JOURNAL.enabled:
+            return Response.error(404, 'Journal deshabilitado (F1_JOURNAL=0)')
+        return Response.json({'success': True, 'compacted': JOURNAL.compact_now(),
+                              'compacted_through': JOURNAL.compacted_through})
+
+    def _handle_trending(self, req):
+        try:
+            k = int(req.param('k', '5'))
+        except ValueError:
+            return Response.error(400, 'k inválido')
+        k = max(1, min(k, 20))
+        return Response.json(dict(TRENDING.snapshot(k), success=True))
+
+    def _handle_stream_ticket(self, req):
+        return Response.json({'success': True, 'ticket': SESSIONS.issue_ticket(req.session, 'stream'),
+                              'expires_in': TICKET_TTL})
+
+    def _handle_apuestas_stream(self, req):
+        user_id = req.session[0]
+        # EventSource sends Last-Event-ID on reconnect; the query param lets
+        # a fresh page resume from what it already rendered
+        last_id = (self.headers.get('Last-Event-ID') or req.param('last_event_id') or '').strip() or None
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.flush()
+        # hand the socket over to the hub's pusher thread and free this one
+        self.close_connection = True
+        self.server.detach(self.request)
+        HUB.subscribe(self.request, user_id, last_id)
+        return SENT
+
+    @staticmethod
+    def _fetch_apuestas_for_user(cur, user_id):
         cur.execute('''
             SELECT a.id, a.created_at, a.status,
                    d1.name, d2.name, d3.name
             FROM apuestas_top3 a
-            JOIN drivers d1 ON d1.id = a.top1_driver_id
-            JOIN drivers d2 ON d2.id = a.top2_driver_id
-            JOIN drivers d3 ON d3.id = a.top3_driver_id
+            JOIN ref.drivers d1 ON d1.id = a.top1_driver_id
+            JOIN ref.drivers d2 ON d2.id = a.top2_driver_id
+            JOIN ref.drivers d3 ON d3.id = a.top3_driver_id
             WHERE a.user_id = ?
             ORDER BY a.created_at DESC, a.id DESC
         ''', (user_id,))
@@ -525,14 +741,16 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             } for row in rows
         ]
 
-    def _fetch_apuesta(self, cur, bet_id):
+    @staticmethod
+    def _fetch_apuesta(cur, bet_id):
         cur.execute('''
             SELECT a.id, a.created_at,
-                   d1.name, d2.name, d3.name, a.user_id, a.status
+                   d1.name, d2.name, d3.name, a.user_id, a.status,
+                   a.top1_driver_id, a.top2_driver_id, a.top3_driver_id
             FROM apuestas_top3 a
-            JOIN drivers d1 ON d1.id = a.top1_driver_id
-            JOIN drivers d2 ON d2.id = a.top2_driver_id
-            JOIN drivers d3 ON d3.id = a.top3_driver_id
+            JOIN ref.drivers d1 ON d1.id = a.top1_driver_id
+            JOIN ref.drivers d2 ON d2.id = a.top2_driver_id
+            JOIN ref.drivers d3 ON d3.id = a.top3_driver_id
             WHERE a.id = ?
         ''', (bet_id,))
         row = cur.fetchone()
@@ -546,34 +764,434 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             'top3': row[4],
             'user_id': row[5],
             'status': row[6],
+            'top1_id': row[7],
+            'top2_id': row[8],
+            'top3_id': row[9],
         }
 
-    def _send_json(self, obj, status=200):
-        payload = json.dumps(obj).encode('utf-8')
-        self.send_response(status)
-        # CORS headers to allow requests from the browser (useful if pages are served
-        # from a different origin during development)
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
-        self.send_header('Content-Length', str(len(payload)))
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-        self.wfile.write(payload)
 
-    def do_OPTIONS(self):
-        # Respond to preflight CORS requests
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+def _session_from(req):
+    """(user_id, sid, expires_at) del token; HTTPError 401 si falta o no sirve."""
+    auth = req.headers.get('Authorization') or ''
+    token = auth[7:].strip() if auth[:7].lower() == 'bearer ' else None
+    ticket = req.param('ticket') if not token and req.route.auth == 'stream' else None
+    if not token and not ticket:
+        raise HTTPError(401, 'Sesión requerida')
+    try:
+        if ticket:
+            # EventSource can't send headers: a short-lived stream ticket
+            return SESSIONS.verify_ticket(ticket, 'stream')
+        return SESSIONS.verify(token)
+    except InvalidToken as e:
+        raise HTTPError(401, 'Sesión expirada' if e.reason == 'expired' else 'Sesión inválida')
+
+
+def _check_admin(req):
+    token = req.headers.get('X-Admin-Token') or ''
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPError(403, 'No autorizado')
+
+
+def _check_limits(req):
+    """Cobra un token por regla de la ruta; HTTPError 429 (sin cobrar nada) si alguna está vacía."""
+    pairs = []
+    for rule in req.route.limits:
+        if rule.key == 'ip':
+            key = req.handler.client_address[0]
+        elif req.session is not None:
+            key = req.session[0]
+        else:
+            # /login, /register: the account is the email, checked before PBKDF2
+            key = str(req.json().get('email') or '').strip().lower()
+            if not key:
+                continue
+        pairs.append((rule, key))
+    # a request refused by the account rule must not use up its IP's budget
+    wait = LIMITER.take_all(pairs)
+    if wait:
+        raise HTTPError(429, 'Demasiados intentos, reintentá en unos segundos',
+                        (('Retry-After', str(retry_after(wait))),))
+
+
+def _endpoint(req):
+    """Innermost step of the pipeline: body, auth, limits, then the route's handler."""
+    route = req.route
+    try:
+        if req.method in BODY_METHODS:
+            req.body()
+        if route.auth in ('session', 'stream'):
+            req.session = _session_from(req)
+        elif route.auth == 'admin':
+            _check_admin(req)
+        if route.limits and LIMITER.enabled:
+            _check_limits(req)
+        return route.handler(req.handler, req)
+    except HTTPError as e:
+        return Response.error(e.status, e.message, e.headers)
+    except Exception as e:
+        return Response.error(500, str(e))
+
+
+# token buckets: (name, keyed by, tokens per minute, burst). Password
+# routes pay a PBKDF2 per attempt; bet writes share one budget per client
+PASSWORD_LIMITS = (
+    LIMITER.add_rule('login_ip', 'ip', 30, 10),
+    LIMITER.add_rule('login_account', 'account', 10, 5),
+)
+REGISTER_LIMITS = (LIMITER.add_rule('register_ip', 'ip', 10, 5),)
+CHANGE_PASSWORD_LIMITS = (
+    LIMITER.add_rule('change_password_ip', 'ip', 10, 5),
+    LIMITER.add_rule('change_password_account', 'account', 5, 3),
+)
+BET_WRITE_LIMITS = (
+    LIMITER.add_rule('bet_write_ip', 'ip', 240, 60),
+    LIMITER.add_rule('bet_write_account', 'account', 120, 30),
+)
+
+# login/bets first, then the rest of the API; exports and static files last
+ROUTES = rutas.Router()
+ROUTES.add('POST', '/register', Handler._handle_register, priority=rutas.HIGH, limits=REGISTER_LIMITS)
+ROUTES.add('POST', '/login', Handler._handle_login, priority=rutas.HIGH, limits=PASSWORD_LIMITS)
+ROUTES.add('POST', '/logout', Handler._handle_logout, auth='session')
+ROUTES.add('POST', '/change-password', Handler._handle_change_password, auth='session', priority=rutas.HIGH,
+           limits=CHANGE_PASSWORD_LIMITS)
+ROUTES.add('GET', '/api/pilotos', Handler._handle_pilotos, cache='public, max-age=300')
+ROUTES.add('GET', '/apuestas/top3', Handler._handle_list_apuestas, auth='session', cache='private, no-cache')
+ROUTES.add('POST', '/apuestas/top3', Handler._handle_create_apuesta, auth='session', priority=rutas.HIGH,
+           limits=BET_WRITE_LIMITS)
+ROUTES.add('DELETE', '/apuestas/top3', Handler._handle_delete_apuesta, auth='session', priority=rutas.HIGH,
+           limits=BET_WRITE_LIMITS)
+ROUTES.add('GET', '/apuestas/top3/detalle', Handler._handle_apuesta_detalle, auth='session',
+           cache='private, no-cache')
+ROUTES.add('POST', '/apuestas/top3/status', Handler._handle_update_apuesta_status, auth='session',
+           priority=rutas.HIGH, limits=BET_WRITE_LIMITS)
+ROUTES.add('POST', '/apuestas/stream/ticket', Handler._handle_stream_ticket, auth='session')
+ROUTES.add('GET', '/apuestas/stream', Handler._handle_apuestas_stream, auth='stream')
+ROUTES.add('GET', '/api/apuestas/trending', Handler._handle_trending, cache='public, max-age=5')
+ROUTES.add('GET', '/api/journal', Handler._handle_journal, auth='admin', priority=rutas.LOW)
+ROUTES.add('POST', '/api/journal/compact', Handler._handle_journal_compact, auth='admin',
+           priority=rutas.LOW)
+ROUTES.add('GET', '/metrics', Handler._handle_metrics)
+ROUTES.add('GET', '/debug/queries', Handler._handle_debug_queries, auth='admin')
+ROUTES.add('GET', '/debug/profile', Handler._handle_debug_profile, auth='admin')
+ROUTES.add('POST', '/debug/profile', Handler._handle_configure_profile, auth='admin')
+for _name in exportar.EXPORTS:
+    ROUTES.add('GET', EXPORT_PREFIX + _name, Handler._handle_export, priority=rutas.LOW)
+# unknown export names still get a JSON 404
+ROUTES.add('GET', EXPORT_PREFIX, Handler._handle_export, priority=rutas.LOW, prefix=True)
+
+PIPELINE = rutas.compose(rutas.DEFAULT_MIDDLEWARE, _endpoint)
+
+
+class _DetachMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+
+    def detach(self, request):
+        """Keep the connection open after the handler returns (SSE)."""
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+
+class Server(_DetachMixin, socketserver.ThreadingTCPServer):
+    """One thread per connection (F1_SERVER_MODE=thread, the default)."""
+    daemon_threads = True
+    # the default backlog of 5 makes bursts wait for SYN retransmits
+    request_queue_size = 128
+
+
+def route_priority(method, path):
+    route = ROUTES.match(method, path)
+    return route.priority if route is not None else rutas.LOW
+
+
+class PoolServer(_DetachMixin, PooledTCPServer):
+    """Fixed worker pool + bounded queue (F1_SERVER_MODE=pool)."""
+
+    def __init__(self, server_address, handler_class, **kwargs):
+        kwargs.setdefault('workers', SERVER_WORKERS)
+        kwargs.setdefault('max_queue', SERVER_QUEUE)
+        kwargs.setdefault('classify', route_priority)
+        super().__init__(server_address, handler_class, **kwargs)
+
+
+def make_server(address, mode=None):
+    mode = mode or SERVER_MODE
+    if mode == 'pool':
+        httpd = PoolServer(address, Handler)
+        METRICS.add_collector(httpd.metrics)
+        return httpd
+    return Server(address, Handler)
+
+
+def _hub_metrics():
+    return [
+        ('f1_sse_subscribers', 'gauge', 'Open /apuestas/stream connections.',
+         [({}, HUB.subscriber_count())]),
+        ('f1_bet_events_total', 'counter', 'Bet events published on the hub.',
+         [({}, HUB.last_id)]),
+        ('f1_ref_generation', 'gauge', 'Generation of the reference database on disk.',
+         [({}, REF_WATCH.generation or 0)]),
+    ]
+
+
+def _replica_metrics():
+    if REF_REPLICA is None:
+        return []
+    return [
+        ('f1_ref_replica_generation', 'gauge', 'Generation loaded in the in-memory reference replica.',
+         [({}, REF_REPLICA.generation or 0)]),
+        ('f1_ref_replica_bytes', 'gauge', 'Size of the in-memory reference replica.',
+         [({}, REF_REPLICA.size_bytes())]),
+        ('f1_ref_replica_load_seconds', 'gauge', 'Duration of the last replica load.',
+         [({}, REF_REPLICA.load_seconds)]),
+        ('f1_ref_replica_loads_total', 'counter', 'Replica loads, by outcome.',
+         [({'outcome': 'ok'}, REF_REPLICA.loads), ({'outcome': 'error'}, REF_REPLICA.failures)]),
+    ]
+
+
+def _session_metrics():
+    stats = SESSIONS.stats()
+    return [
+        ('f1_sessions_issued_total', 'counter', 'Session tokens issued.', [({}, stats['issued'])]),
+        ('f1_session_verifications_total', 'counter', 'Token verifications by outcome.',
+         [({'outcome': k}, v) for k, v in sorted(stats['verified'].items())]),
+        ('f1_sessions_revoked', 'gauge', 'Revoked sessions not yet expired.', [({}, stats['revoked'])]),
+        ('f1_session_user_cutoffs', 'gauge', 'Users whose older sessions were revoked.',
+         [({}, stats['user_cutoffs'])]),
+    ]
+
+
+METRICS.add_collector(_hub_metrics)
+METRICS.add_collector(BET_CACHE.metrics)
+METRICS.add_collector(_session_metrics)
+METRICS.add_collector(_replica_metrics)
+METRICS.add_collector(LIMITER.metrics)
+METRICS.add_collector(JOURNAL.metrics)
+METRICS.add_collector(SCHEDULER.metrics)
+METRICS.add_collector(PASSWORDS.metrics)
+METRICS.add_collector(REHASHER.metrics)
+METRICS.add_collector(PROFILER.metrics)
+
+
+def start_sessions():
+    SESSIONS.configure(load_secret(SESSION_SECRET_PATH), SESSION_TTL)
+    if SESSIONS.load(SESSION_STATE_PATH):
+        print(f"Session revocations loaded from {SESSION_STATE_PATH}")
+    SESSIONS.start_persistence(SESSION_STATE_PATH)
+
+
+def _store_rehash(user_id, old_hash, new_hash):
+    conn = db.connect(DB_PATH, timeout=db.BUSY_TIMEOUT)
+    try:
+        # a password changed since the login keeps its new hash
+        cur = conn.execute('UPDATE usuarios SET contrasena = ? WHERE id = ? AND contrasena = ?',
+                           (new_hash, user_id, old_hash))
+        conn.commit()
+        return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+def start_passwords():
+    """Load the calibrated hashing policy and start the re-hash worker."""
+    try:
+        PASSWORDS.configure(load_policy(KDF_POLICY_PATH))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Password policy {KDF_POLICY_PATH} ignored: {e}")
+    params = ', '.join(f'{k}={v}' for k, v in PASSWORDS.params.items())
+    print(f"Password hashing: {PASSWORDS.scheme} ({params})")
+    REHASHER.start(_store_rehash)
+
+
+def start_bet_cache():
+    """Drop cached lists/details on every committed bet change."""
+    HUB.add_listener(BET_CACHE.on_event)
+
+
+def start_journal():
+    """Open the journal and append every committed bet change to it.
+
+    A new, empty journal is seeded with one 'created' record per existing
+    bet so that replaying it from 0 matches the table.
+    """
+    if not JOURNAL_ENABLED:
+        return
+    last = JOURNAL.open(JOURNAL_DIR)
+    if last == 0:
+        conn = _connect()
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                SELECT a.id, a.created_at, d1.name, d2.name, d3.name, a.user_id, a.status,
+                       a.top1_driver_id, a.top2_driver_id, a.top3_driver_id
+                FROM apuestas_top3 a
+                JOIN ref.drivers d1 ON d1.id = a.top1_driver_id
+                JOIN ref.drivers d2 ON d2.id = a.top2_driver_id
+                JOIN ref.drivers d3 ON d3.id = a.top3_driver_id
+                ORDER BY a.id
+            ''')
+            fields = ('id', 'created_at', 'top1', 'top2', 'top3', 'user_id', 'status',
+                      'top1_id', 'top2_id', 'top3_id')
+            for row in cur:
+                JOURNAL.append('created', row[5], dict(zip(fields, row)))
+        finally:
+            conn.close()
+        JOURNAL.flush()
+        last = JOURNAL.durable_seq
+    print(f"Journal at {JOURNAL_DIR}, last seq {last}")
+    HUB.add_listener(JOURNAL.on_event)
+
+
+def start_trending():
+    """Load (or rebuild) the trending aggregator and keep it fed by the hub."""
+    conn = _connect()
+    try:
+        how = TRENDING.load_or_rebuild(conn.cursor(), TRENDING_STATE_PATH)
+        print(f"Trending picks {how} ({TRENDING.total} bets)")
+    finally:
+        conn.close()
+    HUB.add_listener(TRENDING.on_event)
+    TRENDING.start_persistence(TRENDING_STATE_PATH)
+
+
+# ---- scheduled jobs (tareas.py) ----
+def _job_wal_checkpoint():
+    """Fold the WAL back into the DB file so it doesn't grow between restarts."""
+    conn = db.connect(DB_PATH, timeout=db.BUSY_TIMEOUT)
+    try:
+        busy, frames, moved = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        if busy:
+            print(f"WAL checkpoint blocked by readers ({moved}/{frames} frames)")
+    finally:
+        conn.close()
+
+
+def _job_optimize():
+    conn = db.connect(DB_PATH, timeout=db.BUSY_TIMEOUT)
+    try:
+        conn.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+
+
+def _job_analyze():
+    conn = db.connect(DB_PATH, timeout=db.BUSY_TIMEOUT)
+    try:
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _job_expire_pending():
+    """Reject bets left 'pendiente' for more than PENDING_TTL_HOURS.
+
+    Each bet is updated on its own, guarded on its status, and published
+    as 'settled' like a user change so caches, journal and trending follow.
+    """
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM apuestas_top3 WHERE status = 'pendiente' AND created_at < datetime('now', ?)",
+                    (f'-{PENDING_TTL_HOURS} hours',))
+        expired = [row[0] for row in cur.fetchall()]
+        for bet_id in expired:
+            cur.execute("UPDATE apuestas_top3 SET status = 'rechazada' WHERE id = ? AND status = 'pendiente'",
+                        (bet_id,))
+            if cur.rowcount != 1:
+                # changed (or deleted) by its owner in the meantime
+                conn.rollback()
+                continue
+            conn.commit()
+            bet = Handler._fetch_apuesta(cur, bet_id)
+            if bet is None:
+                # deleted by its owner right after the update, or a driver
+                # missing from the reference data; check_trending reconciles
+                continue
+            HUB.publish('settled', bet['user_id'], dict(bet, previous_status='pendiente'))
+    finally:
+        conn.close()
+    if expired:
+        print(f"Expired {len(expired)} pending bets")
+
+
+def _job_check_trending():
+    """Rebuild the trending aggregator if it drifted from the table."""
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM apuestas_top3 WHERE status != 'rechazada'")
+        # a missed delete and a missed un-rejection leave the count as it was
+        if cur.fetchone()[0] != TRENDING.total or table_digest(cur) != TRENDING.digest:
+            TRENDING.rebuild(cur)
+            print(f"Trending picks rebuilt ({TRENDING.total} bets)")
+    finally:
+        conn.close()
+
+
+def _job_warm_up():
+    """Fill this process's caches after startup or a new reference generation."""
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        # reference pages into the replica / page cache
+        cur.execute('SELECT COUNT(*), MAX(name) FROM ref.drivers').fetchone()
+        cur.execute('SELECT user_id FROM apuestas_top3 GROUP BY user_id ORDER BY MAX(id) DESC LIMIT ?',
+                    (WARM_USERS,))
+        for user_id in [row[0] for row in cur.fetchall()]:
+            if BET_CACHE.lists.get(user_id) is not None:
+                continue
+            ticket = BET_CACHE.lists.ticket(user_id)
+            apuestas = Handler._fetch_apuestas_for_user(cur, user_id)
+            BET_CACHE.lists.put(user_id, encode({'success': True, 'apuestas': apuestas}), ticket)
+    finally:
+        conn.close()
+    TRENDING.snapshot()
+
+
+def start_scheduler():
+    """Register the maintenance jobs and start the scheduler thread.
+
+    Jobs that write the shared DB are single-flight: with several server
+    processes on one DB only one of them runs each period. Cache jobs run
+    in every process.
+    """
+    if not SCHEDULER_ENABLED:
+        return
+    SCHEDULER.lease = SqliteLease(lambda: db.connect(DB_PATH, timeout=db.BUSY_TIMEOUT))
+    SCHEDULER.add('wal_checkpoint', _job_wal_checkpoint, every=300, jitter=30, single_flight=True)
+    SCHEDULER.add('optimize', _job_optimize, cron='15 * * * *', jitter=20, single_flight=True)
+    SCHEDULER.add('analyze', _job_analyze, cron='30 4 * * *', jitter=20, single_flight=True)
+    SCHEDULER.add('expire_pending', _job_expire_pending, every=600, jitter=60, single_flight=True)
+    SCHEDULER.add('check_trending', _job_check_trending, every=3600, jitter=300)
+    SCHEDULER.add('warm_up', _job_warm_up, run_at_start=True)
+    SCHEDULER.start()
+    print(f"Scheduler running {len(SCHEDULER.jobs)} jobs")
 
 
-def run():
+def run(host=HOST, port=PORT):
     os.chdir(BASE_DIR)
-    with socketserver.ThreadingTCPServer((HOST, PORT), Handler) as httpd:
-        print(f"Serving at http://{HOST}:{PORT} (serving files from {BASE_DIR})")
+    init_app_db()
+    start_ref_replica()
+    start_sessions()
+    start_passwords()
+    start_bet_cache()
+    start_journal()
+    start_trending()
+    start_scheduler()
+    with make_server((host, port)) as httpd:
+        host, port = httpd.server_address[:2]
+        print(f"Serving at http://{host}:{port} (serving files from {BASE_DIR}, {SERVER_MODE} mode)", flush=True)
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
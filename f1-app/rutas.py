@@ -0,0 +1,294 @@
+"""Route table and middleware pipeline for ``registro.Handler``.
+
+Every API endpoint is declared once as ``(method, path, handler, options)``.
+Dispatch is one dict lookup on ``(method, path)``; prefix routes (unknown
+exports) are only tried after an exact miss. The same table answers 405s
+and gives the pool its priority and the metrics their route label.
+
+A ``Request`` is built once per call: the query string is parsed once and
+the body is read at most once, capped at ``MAX_BODY`` (413 beyond that).
+
+Handlers return a ``Response`` instead of writing the socket, so
+cross-cutting concerns are middleware: ``fn(request, call_next)`` returning
+a Response. ``compose`` nests them once at startup, outermost first::
+
+    timing -> cors -> compress -> conditional -> endpoint
+
+Streaming handlers (exports, SSE) write the socket themselves and return
+``SENT``, which every middleware passes through untouched.
+"""
+import hashlib
+import json
+import os
+import time
+import zlib
+from urllib.parse import parse_qs
+
+import db
+
+MAX_BODY = int(os.environ.get('F1_MAX_BODY', 64 * 1024))
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+# the gzip variant of a body is a different representation: its own ETag
+GZIP_ETAG_SUFFIX = '-gzip'
+JSON_TYPE = 'application/json; charset=utf-8'
+COMPRESSIBLE = ('application/json', 'text/')
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
+)
+# pool.PooledTCPServer priorities
+HIGH, NORMAL, LOW = 0, 1, 2
+
+
+class HTTPError(Exception):
+    """Se responde como ``{"success": false, "message": ...}`` con ``status``."""
+
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+
+
+class Response:
+    def __init__(self, body=b'', status=200, content_type=JSON_TYPE, headers=None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = list(headers or ())
+
+    @classmethod
+    def json(cls, obj, status=200):
+        return cls(json.dumps(obj).encode('utf-8'), status)
+
+    @classmethod
+    def error(cls, status, message, headers=()):
+        response = cls.json({'success': False, 'message': message}, status)
+        response.headers.extend(headers)
+        return response
+
+    def header(self, name):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+
+# returned by handlers that already wrote their response
+SENT = Response(None)
+
+
+class Route:
+    """``auth``: None, 'session', 'stream' (sesión o ``?ticket=`` de stream) o 'admin'.
+    ``cache``: Cache-Control (activa ETag).
+    ``limits``: reglas de ``limites`` que se cobran en cada pedido.
+    """
+
+    __slots__ = ('method', 'path', 'handler', 'auth', 'priority', 'cache', 'prefix', 'limits')
+
+    def __init__(self, method, path, handler, auth=None, priority=NORMAL, cache=None, prefix=False,
+                 limits=()):
+        self.method = method
+        self.path = path
+        self.handler = handler
+        self.auth = auth
+        self.priority = priority
+        self.cache = cache
+        self.prefix = prefix
+        self.limits = limits
+
+
+class Router:
+    def __init__(self):
+        self._exact = {}
+        self._prefix = []
+        self._methods = {}
+
+    def add(self, method, path, handler, **options):
+        route = Route(method, path, handler, **options)
+        if route.prefix:
+            self._prefix.append(route)
+        else:
+            if (method, path) in self._exact:
+                raise ValueError(f"duplicate route {method} {path}")
+            self._exact[(method, path)] = route
+            self._methods.setdefault(path, []).append(method)
+        return route
+
+    def match(self, method, path):
+        route = self._exact.get((method, path))
+        if route is None:
+            for candidate in self._prefix:
+                if candidate.method == method and path.startswith(candidate.path):
+                    return candidate
+        return route
+
+    def methods(self, path):
+        """Métodos registrados para ``path`` (para 405 / Allow)."""
+        return self._methods.get(path, ())
+
+    def __iter__(self):
+        yield from self._exact.values()
+        yield from self._prefix
+
+
+_UNSET = object()
+
+
+class Request:
+    def __init__(self, handler, route, path, query):
+        self.handler = handler
+        self.route = route
+        self.method = handler.command
+        self.path = path
+        self.headers = handler.headers
+        self.query = parse_qs(query) if query else {}
+        self.session = None
+        self._body = None
+        self._json = _UNSET
+
+    def param(self, name, default=None):
+        return self.query.get(name, [default])[0]
+
+    def body(self):
+        """Lee el cuerpo una sola vez; 413 si supera MAX_BODY."""
+        if self._body is None:
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                self.handler.close_connection = True
+                raise HTTPError(400, 'Content-Length inválido')
+            if length > MAX_BODY:
+                # the body stays unread: this connection can't be reused
+                self.handler.close_connection = True
+                raise HTTPError(413, 'Cuerpo demasiado grande')
+            self._body = self.handler.rfile.read(length) if length > 0 else b''
+        return self._body
+
+    def json(self):
+        """Cuerpo como dict JSON (parseado una vez); 400 si no lo es."""
+        if self._json is _UNSET:
+            try:
+                data = json.loads(self.body().decode('utf-8') or '{}')
+            except ValueError:
+                raise HTTPError(400, 'JSON inválido')
+            if not isinstance(data, dict):
+                raise HTTPError(400, 'JSON inválido')
+            self._json = data
+        return self._json
+
+
+def compose(middleware, endpoint):
+    """Encadena ``middleware`` (el primero queda afuera) alrededor de ``endpoint``."""
+    app = endpoint
+    for mw in reversed(middleware):
+        app = _bind(mw, app)
+    return app
+
+
+def _bind(mw, call_next):
+    return lambda request: mw(request, call_next)
+
+
+# ---- middleware ----
+def timing(request, call_next):
+    """Server-Timing: total time and SQLite time of the request."""
+    t0 = time.perf_counter()
+    response = call_next(request)
+    if response is not SENT:
+        app_ms = (time.perf_counter() - t0) * 1000
+        response.headers.append(
+            ('Server-Timing', f"app;dur={app_ms:.2f}, db;dur={db.request_time() * 1000:.2f}"))
+    return response
+
+
+def cors(request, call_next):
+    response = call_next(request)
+    if response is not SENT:
+        response.headers.extend(CORS_HEADERS)
+    return response
+
+
+def accepts_gzip(accept_encoding):
+    """True si ``Accept-Encoding`` admite gzip con q > 0 (directo o vía ``*``)."""
+    qualities = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.strip().lower()] = q
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def compress(request, call_next):
+    """gzip text/JSON bodies over GZIP_MIN_BYTES when the client accepts it."""
+    response = call_next(request)
+    if response is not SENT and response.status == 304:
+        # the client's cached copy may be either variant
+        response.headers.append(('Vary', 'Accept-Encoding'))
+        return response
+    if (response is SENT or len(response.body) < GZIP_MIN_BYTES
+            or not (response.content_type or '').startswith(COMPRESSIBLE)
+            or response.header('Content-Encoding')):
+        return response
+    response.headers.append(('Vary', 'Accept-Encoding'))
+    if accepts_gzip(request.headers.get('Accept-Encoding')):
+        z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        response.body = z.compress(response.body) + z.flush()
+        response.headers.append(('Content-Encoding', 'gzip'))
+        response.headers = [(k, _gzip_etag(v) if k == 'ETag' else v) for k, v in response.headers]
+    return response
+
+
+def _gzip_etag(etag):
+    return etag[:-1] + GZIP_ETAG_SUFFIX + '"'
+
+
+def _etag_base(tag):
+    """La ETag sin ``W/`` ni el sufijo de la variante gzip."""
+    tag = tag.strip()
+    if tag.startswith('W/'):
+        tag = tag[2:]
+    if tag.endswith(GZIP_ETAG_SUFFIX + '"'):
+        tag = tag[:-len(GZIP_ETAG_SUFFIX) - 1] + '"'
+    return tag
+
+
+def conditional(request, call_next):
+    """ETag + Cache-Control for GET routes with ``cache``; 304 on If-None-Match.
+
+    The tag is computed on the uncompressed body; ``compress`` adds
+    ``-gzip`` to it when it compresses.
+    """
+    response = call_next(request)
+    cache = request.route.cache
+    if cache is None or response is SENT or response.status != 200 or request.method != 'GET':
+        return response
+    etag = '"%s"' % hashlib.blake2b(response.body, digest_size=12).hexdigest()
+    match = request.headers.get('If-None-Match') or ''
+    if match.strip() == '*':
+        # the resource exists: any cached copy will do
+        return Response(b'', 304, content_type=None, headers=[('ETag', etag), ('Cache-Control', cache)])
+    for tag in match.split(','):
+        # either variant validates: the body they were made from is the same
+        if _etag_base(tag) == etag:
+            # echo the client's tag so a gzip variant stays a gzip variant
+            return Response(b'', 304, content_type=None,
+                            headers=[('ETag', tag.strip()), ('Cache-Control', cache)])
+    response.headers.extend([('ETag', etag), ('Cache-Control', cache)])
+    return response
+
+
+DEFAULT_MIDDLEWARE = (timing, cors, compress, conditional)
@@ -0,0 +1,252 @@
+"""Stateless HMAC-signed session tokens.
+
+``/login`` issues ``v1.<sid>.<user_id>.<issued_us>.<expires_at>.<signature>``
+(issue time in microseconds, expiry in seconds) where the signature is HMAC-SHA256 over everything before it. Verifying a
+token is a split, one HMAC and two dict lookups: no ``usuarios`` query.
+
+Long-lived tokens never go in URLs. EventSource can't send headers, so
+``/apuestas/stream`` takes a ticket instead: ``t1.<purpose>.<sid>.<user_id>.
+<issued_us>.<expires_at>.<signature>``, minted from a valid session, good
+for one purpose and ``TICKET_TTL`` seconds, and revoked along with it.
+
+Revocation is the only state:
+
+* ``/logout`` revokes one session id; revoked ids live in a bounded LRU
+  until their token would have expired anyway. When the LRU overflows, the
+  evicted session's user gets a cutoff instead (see below), so an eviction
+  never brings a revoked token back to life.
+* changing the password sets a per-user cutoff: tokens of that user issued
+  before it are rejected.
+
+Both are written to a small JSON file every few seconds when they change
+and reloaded at startup. The signing key comes from ``F1_SESSION_SECRET``
+or from a random key kept next to the database.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+VERSION = 'v1'
+DEFAULT_TTL = 12 * 3600
+MAX_REVOKED = 10_000
+PERSIST_SECONDS = 5.0
+TICKET_VERSION = 't1'
+TICKET_TTL = 60
+
+
+class InvalidToken(Exception):
+    """``reason`` is one of malformed / bad_signature / expired / revoked."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def load_secret(path):
+    """Lee la clave de firma de ``path``; si no existe la genera (0600)."""
+    env = os.environ.get('F1_SESSION_SECRET')
+    if env:
+        return env.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+    except FileNotFoundError:
+        pass
+    secret = secrets.token_hex(32).encode('ascii')
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+    return secret
+
+
+class SessionManager:
+    def __init__(self, secret=None, ttl=DEFAULT_TTL, max_revoked=MAX_REVOKED):
+        # without configure() tokens are signed with a per-process key
+        self._secret = secret or secrets.token_bytes(32)
+        self.ttl = ttl
+        self.max_revoked = max_revoked
+        self._lock = threading.Lock()
+        # sid -> (expires_at, user_id), oldest revocation first
+        self._revoked = OrderedDict()
+        # user_id -> tokens issued at or before this time (µs) are invalid
+        self._cutoff = {}
+        self._dirty = False
+        self.issued = 0
+        self.verified = {}
+
+    def configure(self, secret, ttl=None):
+        self._secret = secret
+        if ttl:
+            self.ttl = ttl
+
+    def _sign(self, payload):
+        return _b64(hmac.new(self._secret, payload.encode('ascii'), hashlib.sha256).digest())
+
+    def issue(self, user_id, now=None):
+        now = now if now is not None else time.time()
+        sid = secrets.token_urlsafe(12)
+        with self._lock:
+            issued_us = self._issued_us(int(user_id), now)
+            self.issued += 1
+        payload = f"{VERSION}.{sid}.{int(user_id)}.{issued_us}.{int(now) + self.ttl}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def _issued_us(self, user_id, now):
+        # a coarse clock (~15 ms on older Windows) can give the token issued
+        # right after a password change the cutoff's own timestamp
+        return max(int(now * 1e6), self._cutoff.get(user_id, -1) + 1)
+
+    def _count(self, outcome):
+        with self._lock:
+            self.verified[outcome] = self.verified.get(outcome, 0) + 1
+
+    def issue_ticket(self, session, purpose, ttl=TICKET_TTL, now=None):
+        """Ticket corto para ``purpose`` a partir de una sesión ya verificada."""
+        user_id, sid, session_expires = session
+        now = now if now is not None else time.time()
+        expires_at = min(int(now) + ttl, int(session_expires))
+        with self._lock:
+            issued_us = self._issued_us(int(user_id), now)
+        payload = f"{TICKET_VERSION}.{purpose}.{sid}.{int(user_id)}.{issued_us}.{expires_at}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token, now=None):
+        """Devuelve ``(user_id, sid, expires_at)`` o lanza InvalidToken."""
+        return self._verify(token, VERSION, now)
+
+    def verify_ticket(self, ticket, purpose, now=None):
+        """Como ``verify`` pero para un ticket de ``purpose``."""
+        return self._verify(ticket, f"{TICKET_VERSION}.{purpose}", now)
+
+    def _verify(self, token, prefix, now):
+        try:
+            payload, signature = token.rsplit('.', 1)
+            if not payload.startswith(prefix + '.'):
+                raise ValueError(prefix)
+            sid, user_id, issued_at, expires_at = payload[len(prefix) + 1:].split('.')
+            user_id, issued_at, expires_at = int(user_id), int(issued_at), int(expires_at)
+        except (AttributeError, ValueError):
+            self._count('malformed')
+            raise InvalidToken('malformed')
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            self._count('bad_signature')
+            raise InvalidToken('bad_signature')
+        now = now if now is not None else time.time()
+        if now >= expires_at:
+            self._count('expired')
+            raise InvalidToken('expired')
+        with self._lock:
+            revoked = sid in self._revoked or issued_at <= self._cutoff.get(user_id, -1)
+        if revoked:
+            self._count('revoked')
+            raise InvalidToken('revoked')
+        self._count('ok')
+        return user_id, sid, expires_at
+
+    def revoke(self, sid, expires_at, user_id):
+        """Revoca una sesión (logout)."""
+        with self._lock:
+            self._revoked[sid] = (int(expires_at), int(user_id))
+            self._revoked.move_to_end(sid)
+            while len(self._revoked) > self.max_revoked:
+                _, (_, evicted_user) = self._revoked.popitem(last=False)
+                # can't remember that sid any more: fall back to revoking
+                # everything its user was issued so far
+                self._cutoff[evicted_user] = max(self._cutoff.get(evicted_user, 0), int(time.time() * 1e6))
+            self._dirty = True
+
+    def revoke_user(self, user_id, now=None):
+        """Invalida todos los tokens emitidos hasta ahora para ``user_id``."""
+        with self._lock:
+            self._cutoff[int(user_id)] = int((now if now is not None else time.time()) * 1e6)
+            self._dirty = True
+
+    def _prune(self, now):
+        for sid, (expires_at, _) in list(self._revoked.items()):
+            if expires_at <= now:
+                del self._revoked[sid]
+        horizon = (now - self.ttl) * 1e6
+        for user_id, cutoff in list(self._cutoff.items()):
+            # every token issued before the cutoff has expired by now
+            if cutoff <= horizon:
+                del self._cutoff[user_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'issued': self.issued,
+                'verified': dict(self.verified),
+                'revoked': len(self._revoked),
+                'user_cutoffs': len(self._cutoff),
+            }
+
+    # ---- persistence ----
+    def to_state(self):
+        with self._lock:
+            self._prune(time.time())
+            return {
+                'version': 1,
+                'revoked': [[sid, exp, uid] for sid, (exp, uid) in self._revoked.items()],
+                'cutoff': {str(k): v for k, v in self._cutoff.items()},
+            }
+
+    def load_state(self, state):
+        with self._lock:
+            self._revoked = OrderedDict((sid, (int(exp), int(uid))) for sid, exp, uid in state.get('revoked', []))
+            self._cutoff = {int(k): int(v) for k, v in state.get('cutoff', {}).items()}
+            self._prune(time.time())
+
+    def load(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.load_state(json.load(f))
+            return True
+        except FileNotFoundError:
+            return False
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Ignoring session state {path}: {e}")
+            return False
+
+    def save(self, path):
+        with self._lock:
+            if not self._dirty:
+                return False
+            self._dirty = False
+        state = self.to_state()
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp, path)
+        except OSError:
+            # try again on the next round
+            with self._lock:
+                self._dirty = True
+            raise
+        return True
+
+    def start_persistence(self, path, interval=PERSIST_SECONDS):
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.save(path)
+                except OSError as e:
+                    print(f"Could not save sessions: {e}")
+
+        threading.Thread(target=loop, name='sessions-persist', daemon=True).start()
+
+
+SESSIONS = SessionManager()
@@ -0,0 +1,329 @@
+"""Columnar, memory-mapped snapshot of ``race_results``.
+
+createDB.py writes ``race_results.snap`` next to f1_ref.db after every
+import. Analytics/odds processes ``open_snapshot()`` it instead of
+re-querying SQLite: the file is mmapped read-only and every column is a
+zero-copy ``memoryview`` over it, so opening is O(columns) and all the
+processes reading it share the same page cache.
+
+Layout (little-endian)::
+
+    prefix   magic b'F1SNAP\\0\\0', version u32, header length u32,
+             header crc32 u32, data crc32 u32
+    header   JSON: row count, generation, columns (name, kind, offset,
+             length; dictionary offset/length for strings)
+    data     one section per column, 8-byte aligned:
+               int   int64, NULL = INT_NULL
+               float float64, NULL = NaN
+               str   int32 codes into a dictionary (NULL = -1); the
+                     dictionary is uint32 end offsets + UTF-8 bytes
+
+The header crc is checked on every open; the data crc covers the whole
+data area and is only checked by ``verify()`` (reads every page).
+"""
+import array
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+MAGIC = b'F1SNAP\0\0'
+VERSION = 1
+PREFIX = struct.Struct('<8sIIII')
+ALIGN = 8
+INT_NULL = -(2 ** 63)
+STR_NULL = -1
+
+# (column, kind) in file order
+RACE_RESULTS_COLUMNS = (
+    ('id', 'int'), ('season', 'int'), ('track', 'str'), ('position', 'str'),
+    ('car_no', 'str'), ('driver', 'str'), ('team', 'str'), ('starting_grid', 'int'),
+    ('laps', 'int'), ('time_retired', 'str'), ('points', 'float'), ('plus1pt', 'str'),
+    ('fastest_lap', 'str'), ('fastest_lap_time', 'str'),
+)
+TYPECODES = {'int': 'q', 'float': 'd', 'str': 'i'}
+FETCH_ROWS = 5000
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def default_path(ref_path):
+    return os.environ.get('F1_SNAPSHOT_PATH') or os.path.join(
+        os.path.dirname(os.path.abspath(ref_path)), 'race_results.snap')
+
+
+def _to_int(value):
+    if value is None or value == '':
+        return INT_NULL
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return INT_NULL
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _encode_dictionary(values):
+    blob = bytearray()
+    ends = array.array('I')
+    for value in values:
+        blob += value.encode('utf-8')
+        ends.append(len(blob))
+    if sys.byteorder != 'little':
+        ends.byteswap()
+    return ends.tobytes() + bytes(blob)
+
+
+def write_snapshot(conn, path, table='race_results', columns=RACE_RESULTS_COLUMNS, generation=None):
+    """Vuelca la tabla a ``path`` (escritura atómica). Devuelve la cantidad de filas."""
+    data = {name: array.array(TYPECODES[kind]) for name, kind in columns}
+    dictionaries = {name: {} for name, kind in columns if kind == 'str'}
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(name for name, _ in columns)} FROM {table} ORDER BY id")
+    rows = 0
+    while True:
+        batch = cur.fetchmany(FETCH_ROWS)
+        if not batch:
+            break
+        rows += len(batch)
+        for i, (name, kind) in enumerate(columns):
+            out = data[name]
+            if kind == 'int':
+                out.extend(_to_int(r[i]) for r in batch)
+            elif kind == 'float':
+                out.extend(_to_float(r[i]) for r in batch)
+            else:
+                codes = dictionaries[name]
+                for r in batch:
+                    v = r[i]
+                    if v is None:
+                        out.append(STR_NULL)
+                    else:
+                        v = str(v)
+                        code = codes.get(v)
+                        if code is None:
+                            code = codes[v] = len(codes)
+                        out.append(code)
+
+    sections = []
+    meta_columns = []
+    offset = 0
+
+    def add(blob):
+        nonlocal offset
+        pad = -offset % ALIGN
+        if pad:
+            sections.append(b'\0' * pad)
+            offset += pad
+        start = offset
+        sections.append(blob)
+        offset += len(blob)
+        return start, len(blob)
+
+    for name, kind in columns:
+        values = data[name]
+        if sys.byteorder != 'little':
+            values.byteswap()
+        col_offset, col_length = add(values.tobytes())
+        entry = {'name': name, 'kind': kind, 'offset': col_offset, 'length': col_length}
+        if kind == 'str':
+            dict_offset, dict_length = add(_encode_dictionary(dictionaries[name]))
+            entry.update(dict_offset=dict_offset, dict_length=dict_length,
+                         dict_size=len(dictionaries[name]))
+        meta_columns.append(entry)
+        data[name] = None
+
+    header = json.dumps({
+        'table': table,
+        'rows': rows,
+        'generation': generation,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'columns': meta_columns,
+    }, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-(PREFIX.size + len(header)) % ALIGN)
+    data_crc = 0
+    for blob in sections:
+        data_crc = zlib.crc32(blob, data_crc)
+
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, VERSION, len(header), zlib.crc32(header), data_crc))
+        f.write(header)
+        for blob in sections:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    # readers that already mapped the old file keep their mapping
+    os.replace(tmp, path)
+    return rows
+
+
+class StringColumn:
+    """Dictionary-encoded column: ``codes`` is zero-copy, ``values`` decoded on demand."""
+
+    def __init__(self, codes, dictionary, size):
+        self.codes = codes
+        self._dictionary = dictionary
+        self._size = size
+        self._values = None
+
+    @property
+    def values(self):
+        if self._values is None:
+            ends = self._dictionary[:self._size * 4].cast('I')
+            blob = self._dictionary[self._size * 4:]
+            values = []
+            start = 0
+            for end in ends:
+                values.append(bytes(blob[start:end]).decode('utf-8'))
+                start = end
+            self._values = values
+        return self._values
+
+    def code_of(self, value):
+        """Código de ``value`` en el diccionario, o None si no aparece."""
+        try:
+            return self.values.index(value)
+        except ValueError:
+            return None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        code = self.codes[i]
+        return None if code == STR_NULL else self.values[code]
+
+
+class Snapshot:
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise SnapshotError('snapshots are little-endian; this host is not')
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load_header()
+        except Exception:
+            self._mm.close()
+            raise
+        self._columns = {}
+
+    def _load_header(self):
+        if len(self._mm) < PREFIX.size:
+            raise SnapshotError(f"{self.path}: truncated")
+        magic, version, header_len, header_crc, self._data_crc = PREFIX.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"{self.path}: not a snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"{self.path}: version {version}, expected {VERSION}")
+        header = self._mm[PREFIX.size:PREFIX.size + header_len]
+        if zlib.crc32(header) != header_crc:
+            raise SnapshotError(f"{self.path}: header checksum mismatch")
+        self.header = json.loads(header)
+        self.rows = self.header['rows']
+        self.generation = self.header.get('generation')
+        self._data_start = PREFIX.size + header_len
+        self._view = memoryview(self._mm)
+        for c in self.header['columns']:
+            if self._data_start + c['offset'] + c['length'] > len(self._mm):
+                raise SnapshotError(f"{self.path}: truncated column {c['name']}")
+        self._meta = {c['name']: c for c in self.header['columns']}
+
+    @property
+    def columns(self):
+        return list(self._meta)
+
+    def _section(self, offset, length):
+        start = self._data_start + offset
+        return self._view[start:start + length]
+
+    def column(self, name):
+        """memoryview de int64/float64, o StringColumn para texto."""
+        col = self._columns.get(name)
+        if col is None:
+            meta = self._meta[name]
+            codes = self._section(meta['offset'], meta['length']).cast(TYPECODES[meta['kind']])
+            if meta['kind'] == 'str':
+                col = StringColumn(codes, self._section(meta['dict_offset'], meta['dict_length']),
+                                   meta['dict_size'])
+            else:
+                col = codes
+            self._columns[name] = col
+        return col
+
+    def row(self, i):
+        out = {}
+        for name, meta in self._meta.items():
+            value = self.column(name)[i]
+            if meta['kind'] == 'int' and value == INT_NULL:
+                value = None
+            elif meta['kind'] == 'float' and math.isnan(value):
+                value = None
+            out[name] = value
+        return out
+
+    def verify(self):
+        """Recalcula el crc de los datos (lee todo el archivo)."""
+        crc = zlib.crc32(self._view[self._data_start:])
+        if crc != self._data_crc:
+            raise SnapshotError(f"{self.path}: data checksum mismatch")
+        return True
+
+    def close(self):
+        # memoryviews handed out keep the mapping alive; drop ours only
+        self._columns = {}
+        self._view.release()
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_snapshot(path, verify=False):
+    snap = Snapshot(path)
+    if verify:
+        snap.verify()
+    return snap
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else default_path(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'f1_ref.db'))
+    t0 = time.perf_counter()
+    snap = open_snapshot(path)
+    opened = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    snap.verify()
+    verified = time.perf_counter() - t0
+    print(f"{path}: {snap.rows} rows, generation {snap.generation}, {os.path.getsize(path)} bytes")
+    print(f"open {opened * 1000:.2f} ms, verify {verified * 1000:.1f} ms")
+    for name in snap.columns:
+        meta = snap._meta[name]
+        extra = f", {meta['dict_size']} distinct" if meta['kind'] == 'str' else ''
+        print(f"  {name:<18}{meta['kind']:<6}{meta['length']:>10} bytes{extra}")
+    if snap.rows:
+        print(snap.row(0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""Background job scheduler for the server process.
+
+Maintenance jobs (WAL checkpoints, ``PRAGMA optimize``, expiring stale
+bets, warm-up...) run here, on one ``f1-scheduler`` thread, and never on
+a request thread. A job runs:
+
+* every ``every`` seconds, or
+* on a ``cron`` schedule, ``'minute hour day month weekday'`` in local
+  time with ``*``, ``*/n``, ``a-b``, ``a-b/n`` and ``a,b`` (weekday 0 or 7
+  is Sunday), or
+* only when ``trigger(name)`` is called (neither given),
+
+plus up to ``jitter`` random seconds so processes don't fire in lockstep.
+
+Jobs that touch the shared database set ``single_flight``: before running,
+the scheduler takes a lease row in SQLite (``scheduler_leases``). The lease
+is not released after the run but expires on its own (by default a bit
+before the next period), so when several server processes share the
+database each period runs once, in whichever process gets there first.
+Jobs that only refresh this process's memory run everywhere.
+"""
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+CRON_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+# a cron job's lease covers its minute, jitter included
+CRON_LEASE_SECONDS = 50.0
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(x) for x in part.split('-', 1))
+        else:
+            start = end = int(part)
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"cron field out of range: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    def __init__(self, spec):
+        parts = spec.split()
+        if len(parts) != len(CRON_FIELDS):
+            raise ValueError(f"cron needs 5 fields: {spec!r}")
+        self.spec = spec
+        fields = [_parse_field(p, low, high) for p, (_, low, high) in zip(parts, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = fields
+        self.weekdays = {d % 7 for d in weekdays}
+        # standard cron: with both day and weekday restricted either one matches
+        self._day_any = parts[2] == '*'
+        self._weekday_any = parts[4] == '*'
+
+    def _day_ok(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self._day_any or self._weekday_any:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, ts):
+        """Próximo instante (timestamp) posterior a ``ts`` que cumple la expresión."""
+        t = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 4)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_ok(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t.timestamp()
+        raise ValueError(f"cron never fires: {self.spec!r}")
+
+
+class SqliteLease:
+    """Lease por job en la base compartida: un solo proceso corre cada período."""
+
+    def __init__(self, connect):
+        self._connect = connect
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+        conn = connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS scheduler_leases (
+                    job TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def acquire(self, job, seconds):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT owner, expires_at FROM scheduler_leases WHERE job = ?',
+                               (job,)).fetchone()
+            if row is not None and row[1] > now and row[0] != self.owner:
+                conn.rollback()
+                return False
+            conn.execute('INSERT OR REPLACE INTO scheduler_leases (job, owner, expires_at) VALUES (?, ?, ?)',
+                         (job, self.owner, now + seconds))
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+
+
+class Job:
+    def __init__(self, name, fn, every=None, cron=None, jitter=0.0, single_flight=False,
+                 lease_seconds=None, run_at_start=False):
+        if every is not None and cron is not None:
+            raise ValueError(f"{name}: every or cron, not both")
+        self.name = name
+        self.fn = fn
+        self.every = every
+        self.cron = Cron(cron) if cron else None
+        self.jitter = jitter
+        self.single_flight = single_flight
+        if lease_seconds is None:
+            lease_seconds = every * 0.9 if every else CRON_LEASE_SECONDS
+        self.lease_seconds = lease_seconds
+        self.run_at_start = run_at_start
+        self.next_run = None
+        self.runs = {'ok': 0, 'error': 0}
+        self.skipped = 0
+        self.seconds = 0.0
+        self.last_seconds = 0.0
+        self.last_success = 0.0
+        self.last_error = None
+
+    def schedule(self, now, first=False):
+        if first and self.run_at_start:
+            self.next_run = now
+            return
+        if self.every:
+            base = now + self.every
+        elif self.cron:
+            base = self.cron.next_after(now)
+        else:
+            # manual job: only trigger() runs it
+            self.next_run = None
+            return
+        self.next_run = base + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+
+class Scheduler:
+    def __init__(self, lease=None, clock=time.time):
+        self.lease = lease
+        self.jobs = {}
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.current = None
+
+    def add(self, name, fn, **options):
+        job = Job(name, fn, **options)
+        with self._cond:
+            self.jobs[name] = job
+            if self._thread is not None:
+                job.schedule(self._clock(), first=True)
+                self._cond.notify()
+        return job
+
+    def trigger(self, name):
+        """Corre el job lo antes posible (sin esperar su próximo turno)."""
+        with self._cond:
+            job = self.jobs.get(name)
+            if job is None or self._thread is None:
+                return False
+            job.next_run = self._clock()
+            self._cond.notify()
+        return True
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            now = self._clock()
+            for job in self.jobs.values():
+                job.schedule(now, first=True)
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name='f1-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                due = [j for j in self.jobs.values() if j.next_run is not None]
+                job = min(due, key=lambda j: j.next_run) if due else None
+                wait = job.next_run - self._clock() if job is not None else None
+                if wait is None or wait > 0:
+                    # also wakes on add()/trigger()/stop()
+                    self._cond.wait(wait)
+                    continue
+                # the next run counts from now, not from when this one ends
+                job.schedule(self._clock())
+                self.current = job.name
+            try:
+                self._run(job)
+            finally:
+                self.current = None
+
+    def _run(self, job):
+        if job.single_flight and self.lease is not None:
+            try:
+                if not self.lease.acquire(job.name, job.lease_seconds):
+                    job.skipped += 1
+                    return
+            except Exception as e:
+                job.runs['error'] += 1
+                job.last_error = f"lease: {e}"
+                print(f"Job {job.name}: could not take its lease: {e}")
+                return
+        t0 = time.perf_counter()
+        try:
+            job.fn()
+        except Exception as e:
+            job.runs['error'] += 1
+            job.last_error = str(e)
+            print(f"Job {job.name} failed: {e}")
+        else:
+            job.runs['ok'] += 1
+            job.last_success = time.time()
+        finally:
+            job.last_seconds = time.perf_counter() - t0
+            job.seconds += job.last_seconds
+
+    def run_now(self, name):
+        """Corre el job en el hilo que llama (herramientas y pruebas)."""
+        self._run(self.jobs[name])
+
+    def metrics(self):
+        """Samples in the format of ``METRICS.add_collector``."""
+        with self._cond:
+            jobs = list(self.jobs.values())
+        runs, seconds, last, success, skipped, next_run = [], [], [], [], [], []
+        for job in jobs:
+            labels = {'job': job.name}
+            runs.extend(({'job': job.name, 'outcome': k}, v) for k, v in job.runs.items())
+            seconds.append((labels, job.seconds))
+            last.append((labels, job.last_seconds))
+            success.append((labels, job.last_success))
+            skipped.append((labels, job.skipped))
+            if job.next_run is not None:
+                next_run.append((labels, job.next_run))
+        return [
+            ('f1_job_runs_total', 'counter', 'Scheduled job runs by outcome.', runs),
+            ('f1_job_seconds_total', 'counter', 'Time spent running each job.', seconds),
+            ('f1_job_last_duration_seconds', 'gauge', 'Duration of the last run.', last),
+            ('f1_job_last_success_timestamp_seconds', 'gauge', 'Unix time of the last successful run.',
+             success),
+            ('f1_job_lease_skipped_total', 'counter', 'Runs skipped because another process held the lease.',
+             skipped),
+            ('f1_job_next_run_timestamp_seconds', 'gauge', 'Unix time of the next planned run.', next_run),
+        ]
+
+
+SCHEDULER = Scheduler()
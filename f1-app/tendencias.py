@@ -0,0 +1,303 @@
+"""Incrementally maintained "most popular podium picks" for top-3 bets.
+
+Fed by the bet events published on ``eventos.HUB``: exact counts per
+driver for each podium slot and approximate heavy hitters (Space-Saving)
+for full triples. A bet counts while it is not 'rechazada'.
+
+Reads come from a snapshot that is only rebuilt after a change, so the
+``/api/apuestas/trending`` handler does O(k) work. State is saved to a
+JSON file periodically and on a clean exit. On startup it is only trusted
+if its digest of every bet's ``(id, status)`` matches the table's; totals
+alone miss a deletion and an un-rejection cancelling each other out.
+"""
+import atexit
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+
+SLOTS = ('top1', 'top2', 'top3')
+TRIPLE_CAPACITY = 256
+PERSIST_SECONDS = 30.0
+STATE_VERSION = 2
+DIGEST_MASK = (1 << 64) - 1
+
+
+def counts_bet(status):
+    return (status or 'pendiente') != 'rechazada'
+
+
+def bet_digest(bet_id, status):
+    """Huella de ``(id, estado)``; la de un conjunto de apuestas es la suma (mod 2**64)."""
+    key = f"{int(bet_id)}:{status or 'pendiente'}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def table_digest(cur):
+    """La huella de todo apuestas_top3, comparable con ``TrendingAggregator.digest``."""
+    cur.execute('SELECT id, status FROM apuestas_top3')
+    return sum(bet_digest(bet_id, status) for bet_id, status in cur) & DIGEST_MASK
+
+
+class SpaceSaving:
+    """Space-Saving heavy hitters (Metwally et al.) with ``capacity`` counters.
+
+    Each tracked key keeps ``[count, error]``; the true frequency lies in
+    ``[count - error, count]``. Removals only decrement tracked keys.
+    """
+
+    def __init__(self, capacity=TRIPLE_CAPACITY):
+        self.capacity = capacity
+        self.counters = {}
+
+    def add(self, key):
+        entry = self.counters.get(key)
+        if entry is not None:
+            entry[0] += 1
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [1, 0]
+            return
+        # replace the minimum counter; capacity is small so a scan is fine
+        victim = min(self.counters, key=lambda k: self.counters[k][0])
+        floor = self.counters.pop(victim)[0]
+        self.counters[key] = [floor + 1, floor]
+
+    def remove(self, key):
+        entry = self.counters.get(key)
+        if entry is None:
+            return
+        entry[0] -= 1
+        if entry[0] <= 0:
+            del self.counters[key]
+        elif entry[1] > entry[0]:
+            entry[1] = entry[0]
+
+    def top(self, k):
+        items = sorted(self.counters.items(), key=lambda kv: (-kv[1][0], kv[0]))
+        return [(key, c, e) for key, (c, e) in items[:k]]
+
+
+class TrendingAggregator:
+    def __init__(self, capacity=TRIPLE_CAPACITY):
+        self._lock = threading.Lock()
+        self.slots = [Counter() for _ in SLOTS]
+        self.triples = SpaceSaving(capacity)
+        self.names = {}
+        self.total = 0
+        self.max_bet_id = None
+        # order-independent digest of every bet's (id, status), rejected ones too
+        self.digest = 0
+        self.version = 0
+        self._saved_version = 0
+        self._snapshots = {}
+        # events seen while rebuild() scans the table, None otherwise
+        self._replay = None
+
+    # ---- updates ----
+    def _apply(self, bet, delta):
+        ids = tuple(int(bet[f'{s}_id']) for s in SLOTS)
+        for slot, driver_id in zip(self.slots, ids):
+            slot[driver_id] += delta
+            if slot[driver_id] <= 0:
+                del slot[driver_id]
+        for s, driver_id in zip(SLOTS, ids):
+            if bet.get(s):
+                self.names[driver_id] = bet[s]
+        if delta > 0:
+            self.triples.add(ids)
+        else:
+            self.triples.remove(ids)
+        self.total += delta
+        self.version += 1
+        self._snapshots = {}
+
+    def on_event(self, event_id, event, user_id, bet):
+        """Listener para ``EventHub.add_listener``."""
+        if not bet or f'{SLOTS[0]}_id' not in bet:
+            return
+        with self._lock:
+            if self._replay is not None and 'id' in bet:
+                # rebuild() is reading the table: it re-applies this after the scan
+                self._replay.append((event, bet))
+            if 'id' in bet:
+                self._track(event, bet)
+            if event == 'created':
+                self.max_bet_id = max(self.max_bet_id or 0, int(bet['id']))
+                if counts_bet(bet.get('status')):
+                    self._apply(bet, 1)
+            elif event == 'deleted':
+                if counts_bet(bet.get('status')):
+                    self._apply(bet, -1)
+            elif event in ('status', 'settled'):
+                before = counts_bet(bet.get('previous_status'))
+                after = counts_bet(bet.get('status'))
+                if before != after:
+                    self._apply(bet, 1 if after else -1)
+
+    def _track(self, event, bet):
+        if event == 'created':
+            self.digest += bet_digest(bet['id'], bet.get('status'))
+        elif event == 'deleted':
+            self.digest -= bet_digest(bet['id'], bet.get('status'))
+        elif event in ('status', 'settled'):
+            self.digest += (bet_digest(bet['id'], bet.get('status'))
+                            - bet_digest(bet['id'], bet.get('previous_status')))
+        self.digest &= DIGEST_MASK
+
+    # ---- reads ----
+    def snapshot(self, k=5):
+        with self._lock:
+            snap = self._snapshots.get(k)
+            if snap is None:
+                snap = self._build_snapshot(k)
+                self._snapshots[k] = snap
+            return snap
+
+    def _build_snapshot(self, k):
+        def driver(driver_id):
+            return {'driver_id': driver_id, 'name': self.names.get(driver_id)}
+
+        slots = {}
+        for name, counter in zip(SLOTS, self.slots):
+            top = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+            slots[name] = [dict(driver(d), count=c) for d, c in top]
+        triples = [
+            {
+                'drivers': [driver(d) for d in key],
+                'count': count,
+                'error': error,
+            } for key, count, error in self.triples.top(k)
+        ]
+        return {'total': self.total, 'slots': slots, 'triples': triples}
+
+    # ---- persistence ----
+    def to_state(self):
+        with self._lock:
+            return self._state_locked()
+
+    def _state_locked(self):
+        return {
+            'version': STATE_VERSION,
+            'total': self.total,
+            'slots': [{str(d): c for d, c in slot.items()} for slot in self.slots],
+            'triples': [[list(key), c, e] for key, (c, e) in self.triples.counters.items()],
+            'names': {str(d): n for d, n in self.names.items()},
+            'max_bet_id': self.max_bet_id,
+            'digest': self.digest,
+        }
+
+    def load_state(self, state):
+        with self._lock:
+            self.total = state['total']
+            self.slots = [Counter({int(d): c for d, c in slot.items()}) for slot in state['slots']]
+            self.triples.counters = {tuple(key): [c, e] for key, c, e in state['triples']}
+            self.names = {int(d): n for d, n in state['names'].items()}
+            self.max_bet_id = state.get('max_bet_id')
+            self.digest = state['digest']
+            self.version += 1
+            self._saved_version = self.version
+            self._snapshots = {}
+
+    def save(self, path):
+        # the version must be the one the state was taken at, or an update
+        # in between would count as saved
+        with self._lock:
+            state = self._state_locked()
+            version = self.version
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp, path)
+        self._saved_version = version
+
+    def rebuild(self, cur):
+        """Recalcula todo desde apuestas_top3 (una sola pasada).
+
+        ``cur`` must come from a connection with the reference DB attached.
+        Events published while the table is being read are logged and, once
+        the scan is done, applied as "this bet now looks like this" on top
+        of it, so the swap neither loses them nor counts them twice.
+        """
+        with self._lock:
+            self._replay = []
+        try:
+            cur.execute('''
+                SELECT a.id, a.top1_driver_id, a.top2_driver_id, a.top3_driver_id,
+                       d1.name, d2.name, d3.name, a.status
+                FROM apuestas_top3 a
+                LEFT JOIN ref.drivers d1 ON d1.id = a.top1_driver_id
+                LEFT JOIN ref.drivers d2 ON d2.id = a.top2_driver_id
+                LEFT JOIN ref.drivers d3 ON d3.id = a.top3_driver_id
+                ORDER BY a.id
+            ''')
+            bets = {row[0]: {'top1_id': row[1], 'top2_id': row[2], 'top3_id': row[3],
+                             'top1': row[4], 'top2': row[5], 'top3': row[6], 'status': row[7]}
+                    for row in cur}
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            replay, self._replay = self._replay, None
+            for event, bet in replay:
+                if event == 'deleted':
+                    bets.pop(int(bet['id']), None)
+                else:
+                    bets[int(bet['id'])] = bet
+            fresh = TrendingAggregator(self.triples.capacity)
+            for bet_id, bet in bets.items():
+                fresh.digest += bet_digest(bet_id, bet.get('status'))
+                if counts_bet(bet.get('status')):
+                    fresh._apply(bet, 1)
+            self.slots, self.triples, self.names = fresh.slots, fresh.triples, fresh.names
+            self.total = fresh.total
+            self.digest = fresh.digest & DIGEST_MASK
+            self.version += 1
+            self._snapshots = {}
+
+    def load_or_rebuild(self, cur, path):
+        """Usa el estado persistido si coincide con la base, si no reconstruye."""
+        cur.execute("SELECT COUNT(*) FROM apuestas_top3 WHERE status != 'rechazada'")
+        count = cur.fetchone()[0]
+        cur.execute('SELECT MAX(id) FROM apuestas_top3')
+        self.max_bet_id = cur.fetchone()[0]
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    state = json.load(f)
+                if (state.get('version') == STATE_VERSION and state['total'] == count
+                        and state.get('max_bet_id') == self.max_bet_id
+                        and state['digest'] == table_digest(cur)):
+                    self.load_state(state)
+                    return 'loaded'
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Trending state ignored ({e}), rebuilding")
+        self.rebuild(cur)
+        return 'rebuilt'
+
+    def _persist(self, path):
+        if self.version != self._saved_version:
+            try:
+                self.save(path)
+            except OSError as e:
+                print(f"Could not persist trending state: {e}")
+
+    def start_persistence(self, path, interval=PERSIST_SECONDS):
+        def loop():
+            while not stop.wait(interval):
+                self._persist(path)
+
+        def final():
+            # whatever changed in the last interval
+            stop.set()
+            self._persist(path)
+
+        stop = threading.Event()
+        threading.Thread(target=loop, name='trending-persist', daemon=True).start()
+        atexit.register(final)
+        return stop
+
+
+TRENDING = TrendingAggregator()